@@ -2,7 +2,8 @@ from cocotools.query import *
 from cocotools.mapgraph import *
 from cocotools.congraph import *
 from cocotools.endgraph import *
-from cocotools.infomap import nx2infomap
+from cocotools.infomap import (nx2infomap, multi_seed_infomap,
+                               coassignment_matrix, consensus_modules)
 from cocotools.stats import *
 from cocotools.nxdraw import *
 from cocotools.utils import *
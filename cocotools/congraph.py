@@ -1,12 +1,14 @@
 from numpy import mean, float64
 from networkx import DiGraph
 
+from utils import CaseIndexedGraph
+
 
 class ConGraphError(Exception):
     pass
 
 
-class ConGraph(DiGraph):
+class ConGraph(CaseIndexedGraph, DiGraph):
 
     """Subclass of the NetworkX DiGraph designed to hold Connectivity data.
 
@@ -72,6 +74,8 @@ class ConGraph(DiGraph):
           Dictionary of edge attributes.
         """
         self._assert_valid_attr(new_attr)
+        self.case_index.add(source)
+        self.case_index.add(target)
         add_edge = DiGraph.add_edge.im_func
         if not self.has_edge(source, target):
             add_edge(self, source, target, new_attr)
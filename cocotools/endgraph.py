@@ -2,16 +2,271 @@ from itertools import product
 
 import networkx as nx
 import numpy as np
+import scipy.sparse
+
+
+# Codes used to vectorize translation with the modified AT method.
+_RCS = ('I', 'S', 'L', 'O')
+_CONNECTIONS = ('Present', 'Absent', 'Unknown')
 
 
 class EndGraphError(Exception):
     pass
 
 
+def _grown(array, size):
+    """Return array, or a copy with room for size items if it is short.
+
+    Capacity is at least doubled, so appending is amortized O(1).
+    """
+    if size <= len(array):
+        return array
+    grown = np.empty(max(2 * len(array), size, 16), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class EdgeProvenance(object):
+
+    """Compact record of the conn edges and mapp relations behind edges.
+
+    Edges from conn, relations (edges) from mapp, and edges in the
+    EndGraph (pairs) are each stored once and referred to by integer IDs.
+    Each contribution is a row of three parallel integer arrays: pair
+    ID, conn edge ID, and relation ID (-1 for a conn edge translated
+    without relations).  Lookups use CSR-style indexes (rows sorted by
+    one column, with offsets per ID) built on demand and reused until
+    rows are added.
+
+    Discarding a pair retires its ID, so its rows no longer count.  The
+    rows and IDs of retired pairs are dropped, and the remaining IDs
+    renumbered, when they make up most of the record.
+    """
+
+    _COLUMNS = ('pair', 'conn', 'relation')
+
+    def __init__(self):
+        self.conn_edges = []
+        self.relations = []
+        self.pairs = []
+        self._conn_ids = {}
+        self._relation_ids = {}
+        # Only pairs currently recorded have an entry.
+        self._pair_ids = {}
+        self._pair_alive = np.zeros(0, dtype=bool)
+        self._columns = dict((name, np.zeros(0, dtype=np.int32)) for name
+                             in self._COLUMNS)
+        self._n_rows = 0
+        self._indexes = {}
+
+    def _intern(self, item, items, ids):
+        """Return the ID for item, assigning a new one if needed."""
+        try:
+            return ids[item]
+        except KeyError:
+            ids[item] = len(items)
+            items.append(item)
+            return ids[item]
+
+    def __contains__(self, pair):
+        return pair in self._pair_ids
+
+    def __len__(self):
+        return len(self._pair_ids)
+
+    def __getitem__(self, pair):
+        return self.explain(pair)
+
+    def add(self, pair, conn_edge, relations):
+        """Note that conn_edge and relations contributed to pair.
+
+        Parameters
+        ----------
+        pair : tuple
+          Edge in the EndGraph.
+
+        conn_edge : tuple
+          Edge in conn that was translated to pair.
+
+        relations : list
+          Edges in mapp used for the translation.
+        """
+        pair_id = self._intern(pair, self.pairs, self._pair_ids)
+        self._pair_alive = _grown(self._pair_alive, len(self.pairs))
+        self._pair_alive[pair_id] = True
+        conn_id = self._intern(conn_edge, self.conn_edges, self._conn_ids)
+        relation_ids = [self._intern(relation, self.relations,
+                                     self._relation_ids) for relation in
+                        relations] or [-1]
+        start = self._n_rows
+        self._n_rows += len(relation_ids)
+        for name, value in (('pair', pair_id), ('conn', conn_id),
+                            ('relation', relation_ids)):
+            self._columns[name] = _grown(self._columns[name], self._n_rows)
+            self._columns[name][start:self._n_rows] = value
+        self._indexes = {}
+
+    def discard(self, pair):
+        """Forget everything recorded for pair."""
+        pair_id = self._pair_ids.pop(pair, None)
+        if pair_id is not None:
+            self._pair_alive[pair_id] = False
+
+    def _column(self, name):
+        return self._columns[name][:self._n_rows]
+
+    def to_arrays(self):
+        """Return the record as item lists and ID columns.
+
+        Retired pairs are dropped first.  Pass the results to from_arrays
+        to rebuild the record.
+
+        Returns
+        -------
+        pairs, conn_edges, relations : list
+          Items, each at the position of its ID.
+
+        columns : dict
+          Maps 'pair', 'conn', and 'relation' to the ID column of each
+          contribution.
+        """
+        self._compact()
+        return (self.pairs, self.conn_edges, self.relations,
+                dict((name, self._column(name)) for name in self._COLUMNS))
+
+    @classmethod
+    def from_arrays(cls, pairs, conn_edges, relations, columns):
+        """Return a record rebuilt from the results of to_arrays."""
+        provenance = cls()
+        for items, ids, given in ((provenance.pairs, provenance._pair_ids,
+                                   pairs),
+                                  (provenance.conn_edges,
+                                   provenance._conn_ids, conn_edges),
+                                  (provenance.relations,
+                                   provenance._relation_ids, relations)):
+            items.extend(given)
+            ids.update(zip(given, range(len(given))))
+        provenance._columns = dict((name, np.array(columns[name],
+                                                   dtype=np.int32))
+                                   for name in cls._COLUMNS)
+        provenance._n_rows = len(provenance._columns['pair'])
+        provenance._pair_alive = np.ones(len(pairs), dtype=bool)
+        return provenance
+
+    def _compact(self):
+        """Drop the rows of retired pairs and renumber the IDs in use."""
+        alive = self._pair_alive[self._column('pair')]
+        for name, items, ids in (('pair', self.pairs, self._pair_ids),
+                                 ('conn', self.conn_edges, self._conn_ids),
+                                 ('relation', self.relations,
+                                  self._relation_ids)):
+            column = self._column(name)[alive]
+            used, new_ids = np.unique(column, return_inverse=True)
+            if name == 'relation' and len(used) and used[0] == -1:
+                # Keep -1 for conn edges translated without relations.
+                used = used[1:]
+                new_ids -= 1
+            items[:] = [items[i] for i in used.tolist()]
+            ids.clear()
+            ids.update(zip(items, range(len(items))))
+            self._columns[name] = new_ids.astype(np.int32)
+        self._n_rows = int(alive.sum())
+        self._pair_alive = np.ones(len(self.pairs), dtype=bool)
+        self._indexes = {}
+
+    def _index(self, name):
+        """Return (order, offsets) of rows sorted by column name.
+
+        The rows with ID i in that column are order[offsets[i]:
+        offsets[i+1]].
+        """
+        if name not in self._indexes:
+            n_retired = len(self.pairs) - len(self._pair_ids)
+            if n_retired > len(self._pair_ids):
+                self._compact()
+            column = self._column(name)
+            n_ids = len({'pair': self.pairs, 'conn': self.conn_edges,
+                         'relation': self.relations}[name])
+            order = np.argsort(column, kind='mergesort')
+            offsets = np.searchsorted(column[order], np.arange(n_ids + 1))
+            self._indexes[name] = (order, offsets)
+        return self._indexes[name]
+
+    def _lookup(self, key_column, key, value_column):
+        """Return sorted distinct IDs in value_column of rows for key.
+
+        key is a pair, conn edge, or relation, according to key_column.
+        Rows of retired pairs are skipped.
+        """
+        # Building the index may renumber IDs, so look up key after.
+        order, offsets = self._index(key_column)
+        ids = {'pair': self._pair_ids, 'conn': self._conn_ids,
+               'relation': self._relation_ids}[key_column]
+        key_id = ids.get(key)
+        if key_id is None:
+            return []
+        rows = order[offsets[key_id]:offsets[key_id+1]]
+        rows = rows[self._pair_alive[self._column('pair')[rows]]]
+        values = np.unique(self._column(value_column)[rows])
+        return values[values >= 0].tolist()
+
+    def conn_edges_for(self, pair):
+        """Return the conn edges that contributed to pair."""
+        if pair not in self._pair_ids:
+            raise KeyError(pair)
+        return [self.conn_edges[i] for i in
+                self._lookup('pair', pair, 'conn')]
+
+    def pairs_for_conn_edge(self, conn_edge):
+        """Return the EndGraph edges conn_edge contributed to."""
+        return [self.pairs[i] for i in
+                self._lookup('conn', conn_edge, 'pair')]
+
+    def pairs_for_relation(self, relation):
+        """Return the EndGraph edges relation contributed to."""
+        return [self.pairs[i] for i in
+                self._lookup('relation', relation, 'pair')]
+
+    def explain(self, pair):
+        """Return the conn edges and mapp relations behind pair.
+
+        Parameters
+        ----------
+        pair : tuple
+          Edge in the EndGraph.
+
+        Returns
+        -------
+        sources : dict
+          Maps 'conn_edges' and 'relations' to sets of edges.
+        """
+        return {'conn_edges': set(self.conn_edges_for(pair)),
+                'relations': set([self.relations[i] for i in
+                                  self._lookup('pair', pair, 'relation')])}
+
+
 class EndGraph(nx.DiGraph):
 
     """Subclass of the NetworkX DiGraph designed to hold post-ORT data."""
 
+    # Built for one translation only (see _clear_translation_caches).
+    _TRANSLATION_CACHES = ('_conn_arrays', '_connection_table')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._TRANSLATION_CACHES:
+            state.pop(name, None)
+        return state
+
+    def _clear_translation_caches(self):
+        """Drop the conn matrices and lookup table built to translate.
+
+        They hold on to conn, so they are dropped once a translation is
+        done rather than kept with the graph.
+        """
+        for name in self._TRANSLATION_CACHES:
+            self.__dict__.pop(name, None)
+
     def _new_attributes_are_better(self, source, target, attr):
         """Return True if PDC is an improvement and False otherwise.
 
@@ -80,10 +335,62 @@ class EndGraph(nx.DiGraph):
         """
         if source == target:
             return
-        if not self.has_edge(source, target):
-            nx.DiGraph.add_edge.im_func(self, source, target, attributes)
-        elif self._new_attributes_are_better(source, target, attributes):
+        if not self.has_edge(source, target) or \
+                self._new_attributes_are_better(source, target, attributes):
             nx.DiGraph.add_edge.im_func(self, source, target, attributes)
+            self._update_columns('set_edge', source, target,
+                                 self[source][target])
+
+    def add_edges_from(self, ebunch, attr_dict=None, **attr):
+        """Add edges as the NetworkX DiGraph does, without comparing PDCs."""
+        ebunch = list(ebunch)
+        nx.DiGraph.add_edges_from.im_func(self, ebunch, attr_dict, **attr)
+        for edge in ebunch:
+            self._update_columns('set_edge', edge[0], edge[1],
+                                 self[edge[0]][edge[1]])
+
+    def remove_edge(self, source, target):
+        nx.DiGraph.remove_edge.im_func(self, source, target)
+        self._update_columns('remove_edge', source, target)
+
+    def remove_edges_from(self, ebunch):
+        for edge in ebunch:
+            if self.has_edge(edge[0], edge[1]):
+                self.remove_edge(edge[0], edge[1])
+
+    def add_node(self, n, attr_dict=None, **attr):
+        nx.DiGraph.add_node.im_func(self, n, attr_dict, **attr)
+        self._update_columns('add_node', n)
+
+    def add_nodes_from(self, nodes, **attr):
+        nodes = list(nodes)
+        nx.DiGraph.add_nodes_from.im_func(self, nodes, **attr)
+        for n in nodes:
+            try:
+                hash(n)
+            except TypeError:
+                # A (node, attribute dict) tuple.
+                n = n[0]
+            self._update_columns('add_node', n)
+
+    def remove_node(self, n):
+        nx.DiGraph.remove_node.im_func(self, n)
+        self._update_columns('remove_node', n)
+
+    def remove_nodes_from(self, nodes):
+        for n in nodes:
+            if n in self.succ:
+                self.remove_node(n)
+
+    def clear(self):
+        nx.DiGraph.clear.im_func(self)
+        self._columns = None
+
+    def _update_columns(self, method, *args):
+        """Apply a change to the cached EdgeColumns, if there are any."""
+        columns = getattr(self, '_columns', None)
+        if columns is not None:
+            getattr(columns, method)(*args)
 
     def _resolve_connections(self, connections):
         """Return Connection value for the edge in the desired BrainMap.
@@ -272,26 +579,91 @@ latter are not disjoint""" % (new, originals))
         target_rcs, pdcs = self._get_rcs(t_mapping, mapp, pdcs)
         new_source, original_sources = s_mapping
         new_target, original_targets = t_mapping
-        votes = []
-        for i_s, original_s in enumerate(original_sources):
-            for i_t, original_t in enumerate(original_targets):
-                try:
-                    c = conn[original_s][original_t]['Connection']
-                except KeyError:
-                    votes.append('Unknown')
-                    pdcs.append(18)
-                else:
-                    votes.append(self._translate_connection(source_rcs[i_s],
-                                                            target_rcs[i_t],
-                                                            c))
-                    pdcs.append(self._get_mean_pdc(original_s, original_t,
-                                                   conn))
-        return {'Connection': self._resolve_connections(set(votes)),
+        # Gather the conn sub-block for the original sources and targets.
+        # Missing edges are coded as 'Unknown' with PDCs of 18.
+        index, conn_codes, conn_pdcs = self._get_conn_arrays(conn)
+        missing = len(index)
+        src_idx = np.array([index.get(s, missing) for s in original_sources])
+        tgt_idx = np.array([index.get(t, missing) for t in original_targets])
+        block = np.ix_(src_idx, tgt_idx)
+        codes = conn_codes[block].toarray()
+        present = codes > 0
+        codes = np.where(present, codes - 1, _CONNECTIONS.index('Unknown'))
+        block_pdcs = np.where(present, conn_pdcs[block].toarray(), 18)
+        # Compute all the votes and PDCs in one step.
+        s_indices = np.array([_RCS.index(rc) for rc in source_rcs])
+        t_indices = np.array([_RCS.index(rc) for rc in target_rcs])
+        votes = self._get_connection_table()[s_indices[:, np.newaxis],
+                                             t_indices[np.newaxis, :], codes]
+        pdcs = np.concatenate((pdcs, block_pdcs.ravel()))
+        return {'Connection': self._resolve_connections(
+                    set([_CONNECTIONS[i] for i in np.unique(votes)])),
                 # Note that each original mapp edge and each original
                 # conn edge gets a single entry in pdcs, and thus are
                 # weighted equally.
                 'PDC': np.mean(pdcs)}
 
+    def _get_conn_arrays(self, conn):
+        """Return conn as sparse matrices of Connections and PDCs.
+
+        Returns
+        -------
+        index : dict
+          Maps each node in conn to its row and column.  One more row
+          and column, with no edges, stands in for nodes not in conn.
+
+        codes : scipy.sparse.csr_matrix
+          One more than the position in _CONNECTIONS of each edge's
+          Connection, and 0 where there is no edge.
+
+        pdcs : scipy.sparse.csr_matrix
+          The PDC of each edge: the mean of its four PDCs (see
+          _get_mean_pdc).
+
+        The matrices are built once per translation.
+        """
+        cached = getattr(self, '_conn_arrays', None)
+        if cached is not None and cached[0] is conn:
+            return cached[1:]
+        index = dict((node, i) for i, node in enumerate(conn.nodes_iter()))
+        rows, cols, codes, pdcs = [], [], [], []
+        for source, target, attributes in conn.edges_iter(data=True):
+            rows.append(index[source])
+            cols.append(index[target])
+            codes.append(_CONNECTIONS.index(attributes['Connection']) + 1)
+            pdcs.append((attributes['PDC_EC_Source'] +
+                         attributes['PDC_EC_Target'] +
+                         attributes['PDC_Site_Source'] +
+                         attributes['PDC_Site_Target']) / 4.0)
+        shape = (len(index) + 1, len(index) + 1)
+        codes = scipy.sparse.csr_matrix((codes, (rows, cols)), shape=shape,
+                                        dtype=int)
+        pdcs = scipy.sparse.csr_matrix((pdcs, (rows, cols)), shape=shape,
+                                       dtype=float)
+        self._conn_arrays = (conn, index, codes, pdcs)
+        return index, codes, pdcs
+
+    def _get_connection_table(self):
+        """Return _translate_connection as a lookup table.
+
+        The table is indexed by positions in _RCS (for the source and
+        target RCs) and in _CONNECTIONS, and holds positions in
+        _CONNECTIONS.  It is built once per translation.
+        """
+        try:
+            return self._connection_table
+        except AttributeError:
+            pass
+        table = np.empty((len(_RCS), len(_RCS), len(_CONNECTIONS)),
+                         dtype=int)
+        for i_s, s_rc in enumerate(_RCS):
+            for i_t, t_rc in enumerate(_RCS):
+                for i_c, connection in enumerate(_CONNECTIONS):
+                    table[i_s, i_t, i_c] = _CONNECTIONS.index(
+                        self._translate_connection(s_rc, t_rc, connection))
+        self._connection_table = table
+        return table
+
     def _at_logic(self, ecs, rcs):
         """Look up tables"""
         if len(rcs) == 1 and rcs[0] in ('I', 'L'):
@@ -562,9 +934,156 @@ latter are not disjoint""" % (new, originals))
             translation_dict[new_node] = self._translate_node(mapp, new_node,
                                                               original_map)
         return translation_dict
-	
-	
-    def add_translated_edges(self, mapp, conn, desired_map, method):
+
+    def _iter_translations(self, mapp, conn, desired_map, original_s,
+                           original_t, translation_dicts=None,
+                           only_source=None):
+        """Yield candidate edges in desired_map for one edge in conn.
+
+        Parameters
+        ----------
+        mapp : MapGraph
+
+        conn : ConGraph
+
+        desired_map : string
+          The BrainMap to which translation of edges is being performed.
+
+        original_s, original_t : strings
+          Source and target of an edge in conn.
+
+        translation_dicts : dict (optional)
+          Cache of translation dicts keyed by node in conn.  Missing
+          entries are computed and stored.
+
+        only_source : string (optional)
+          Node in desired_map (with its BrainMap prefix).  If supplied,
+          only candidates with this source are yielded.
+
+        Returns
+        -------
+        candidates : generator
+          (new_source, new_target, attr, relations) tuples, where
+          relations lists the mapp edges used to relate the original
+          nodes to the new ones.
+        """
+        if translation_dicts is None:
+            translation_dicts = {}
+        for original in (original_s, original_t):
+            if original not in translation_dicts:
+                translation_dicts[original] = self._make_translation_dict(
+                    mapp, original, desired_map)
+        s_dict = translation_dicts[original_s]
+        t_dict = translation_dicts[original_t]
+        if only_source is None:
+            s_mappings = s_dict.iteritems()
+        else:
+            s_mappings = [(only_source, s_dict[only_source])]
+        for s_mapping in s_mappings:
+            for t_mapping in t_dict.iteritems():
+                attr = self._translate_attr(s_mapping, t_mapping, mapp, conn)
+                relations = []
+                for new, originals in (s_mapping, t_mapping):
+                    relations.extend([(orig, new) for orig in originals if
+                                      orig != new])
+                # The first element in each mapping is the node in
+                # desired_map.  We must remove the brain map name,
+                # pre-pended to the name of the area.  (Note that
+                # the brain map is stored as self.map.)
+                new_source = s_mapping[0].split('-', 1)[-1]
+                new_target = t_mapping[0].split('-', 1)[-1]
+                yield new_source, new_target, attr, relations
+
+    def _add_candidate(self, new_source, new_target, attr, conn_edge,
+                       relations):
+        """Add a translated edge, recording its provenance if tracked."""
+        if new_source == new_target:
+            return
+        self.add_edge(new_source, new_target, attr)
+        if getattr(self, 'provenance', None) is not None:
+            self.provenance.add((new_source, new_target), conn_edge,
+                                relations)
+
+    def _set_up_translation(self, mapp, conn, desired_map, method):
+        """Register desired_map nodes and the AT method."""
+        if method not in ('original', 'modified'):
+            raise EndGraphError("method must be 'original' or 'modified'")
+        self.map = desired_map
+        self.method = method
+        # conn may have changed since the last translation.
+        self._clear_translation_caches()
+        # Add all target-map nodes to the EndGraph.  We need to search both
+        # the map and con graphs because one can contain nodes the other
+        # doesn't have.
+        for node in set(mapp.nodes()+conn.nodes()):
+            if node.split('-')[0] == desired_map:
+                self.add_node(node.split('-', 1)[-1])
+
+    def _translate_attr(self, s_mapping, t_mapping, mapp, conn):
+        """Translate edge attributes with the AT method in self.method.
+
+        The method is looked up on each call, so graphs restored by
+        cocotools.iotools.load_graph can be translated further.
+        """
+        if self.method == 'original':
+            return self._translate_attr_original(s_mapping, t_mapping, mapp,
+                                                 conn)
+        return self._translate_attr_modified(s_mapping, t_mapping, mapp,
+                                             conn)
+
+    def _stream_translated_edges(self, mapp, conn, desired_map, sink):
+        """Translate edges in conn, handing finished ones to sink.
+
+        Candidates are generated one new source at a time: for each node
+        in desired_map, the edges in conn from the nodes that translate
+        to it are translated.  All the candidates for that node's edges
+        have then been seen, so the edges are written to sink and removed
+        from the graph.  Memory use is thus bounded by the out-degree of
+        one node, plus the translation dicts of the nodes in conn.
+
+        Parameters
+        ----------
+        mapp : MapGraph
+
+        conn : ConGraph
+
+        desired_map : string
+          The BrainMap to which translation of edges is being performed.
+
+        sink : object
+          Has a write_edge(source, target, attr) method.
+        """
+        translation_dicts = {}
+        # Nodes in conn that translate to each new source, in the order
+        # in which conn.edges_iter reaches them, so that candidates for
+        # each edge are added in the same order as by add_edge alone.
+        originals_for = {}
+        for original_s, successors in conn.adjacency_iter():
+            if not successors:
+                continue
+            translation_dicts[original_s] = self._make_translation_dict(
+                mapp, original_s, desired_map)
+            for new_source in translation_dicts[original_s]:
+                originals_for.setdefault(new_source, []).append(original_s)
+        for prefixed_source, originals in originals_for.iteritems():
+            for original_s in originals:
+                for original_t in conn.successors_iter(original_s):
+                    for new_source, new_target, attr, relations in \
+                            self._iter_translations(mapp, conn, desired_map,
+                                                    original_s, original_t,
+                                                    translation_dicts,
+                                                    prefixed_source):
+                        if new_source != new_target:
+                            self.add_edge(new_source, new_target, attr)
+            new_source = prefixed_source.split('-', 1)[-1]
+            if new_source not in self:
+                continue
+            for new_target, attr in self.succ[new_source].items():
+                sink.write_edge(new_source, new_target, attr)
+                self.remove_edge(new_source, new_target)
+
+    def add_translated_edges(self, mapp, conn, desired_map, method,
+                             track_provenance=False, sink=None):
         """Translate edges in conn to nomenclature of desired_bmap.
 
         Add all desired_map nodes in mapp to this graph.
@@ -584,31 +1103,208 @@ latter are not disjoint""" % (new, originals))
         method : string
           AT method to be used: 'original' (that of Stephan & Kotter)
           or 'modified'
+
+        track_provenance : bool (optional)
+          If True, record which conn edges and mapp relations each
+          translated edge came from (see explain).  This is required
+          for later calls to apply_delta.
+
+        sink : object (optional)
+          If supplied, each translated edge is passed to
+          sink.write_edge(source, target, attr) once all the edges from
+          its source have been translated, and is not kept in this graph
+          (see cocotools.iotools.EdgeCSVWriter).  Memory use is then
+          bounded by the edges from one node in desired_map.
         """
-        self.map = desired_map
-        # Add all target-map nodes to the EndGraph.  We need to search both
-        # the map and con graphs because one can contain nodes the other
-        # doesn't have.
-        for node in set(mapp.nodes()+conn.nodes()):
-            if node.split('-')[0] == desired_map:
-                self.add_node(node.split('-', 1)[-1])
-        at_setting = {'original': self._translate_attr_original,
-                      'modified': self._translate_attr_modified}
-        self._translate_attr = at_setting[method]
-        for original_s, original_t in conn.edges_iter():
-            s_dict = self._make_translation_dict(mapp, original_s, desired_map)
-            t_dict = self._make_translation_dict(mapp, original_t, desired_map)
-            for s_mapping in s_dict.iteritems():
-                for t_mapping in t_dict.iteritems():
-                    attr = self._translate_attr(s_mapping, t_mapping, mapp,
-                                                conn)
-                    # The first element in each mapping is the node in
-                    # desired_map.  We must remove the brain map name,
-                    # pre-pended to the name of the area.  (Note that
-                    # the brain map is stored as self.map.)
-                    new_source = s_mapping[0].split('-', 1)[-1]
-                    new_target = t_mapping[0].split('-', 1)[-1]
-                    self.add_edge(new_source, new_target, attr)
+        if sink is not None and track_provenance:
+            raise EndGraphError('Provenance cannot be tracked for edges '
+                                'written to a sink.')
+        if track_provenance:
+            self.provenance = EdgeProvenance()
+        else:
+            self.provenance = None
+        self._set_up_translation(mapp, conn, desired_map, method)
+        try:
+            if sink is not None:
+                self._stream_translated_edges(mapp, conn, desired_map,
+                                              sink)
+                return
+            translation_dicts = {}
+            for original_s, original_t in conn.edges_iter():
+                for new_source, new_target, attr, relations in \
+                        self._iter_translations(mapp, conn, desired_map,
+                                                original_s, original_t,
+                                                translation_dicts):
+                    self._add_candidate(new_source, new_target, attr,
+                                        (original_s, original_t),
+                                        relations)
+        finally:
+            self._clear_translation_caches()
+
+    def apply_delta(self, mapp, conn, added_conn_edges=(),
+                    removed_conn_edges=(), changed_relations=()):
+        """Update the graph after conn and mapp have been changed.
+
+        Only the edges in this graph that depend on the supplied changes
+        are translated again; the rest of the graph is left untouched.
+
+        Parameters
+        ----------
+        mapp : MapGraph
+          The MapGraph used to build this graph, with the changes in
+          changed_relations already made.
+
+        conn : ConGraph
+          The ConGraph used to build this graph, with the edges in
+          added_conn_edges added and those in removed_conn_edges removed.
+
+        added_conn_edges : iterable (optional)
+          (source, target) tuples newly added to conn.
+
+        removed_conn_edges : iterable (optional)
+          (source, target) tuples removed from conn.
+
+        changed_relations : iterable (optional)
+          (source, target) tuples for edges added to, removed from, or
+          modified in mapp.
+
+        Returns
+        -------
+        affected : set
+          Edges in this graph that were translated again.  Those no
+          longer in the graph had no remaining candidates.
+
+        Notes
+        -----
+        The graph must have been built by add_translated_edges with
+        track_provenance set to True.
+        """
+        if getattr(self, 'provenance', None) is None:
+            raise EndGraphError('apply_delta requires provenance; call '
+                                'add_translated_edges with '
+                                'track_provenance=True')
+        # conn has changed since the last translation.
+        self._clear_translation_caches()
+        try:
+            return self._apply_delta(mapp, conn, added_conn_edges,
+                                     removed_conn_edges, changed_relations)
+        finally:
+            self._clear_translation_caches()
+
+    def _apply_delta(self, mapp, conn, added_conn_edges, removed_conn_edges,
+                     changed_relations):
+        """Do the work of apply_delta once provenance has been checked."""
+        desired_map = self.map
+        touched = set(added_conn_edges) | set(removed_conn_edges)
+        affected = set()
+        for relation in changed_relations:
+            for node in relation:
+                if node.split('-')[0] == desired_map:
+                    # Every edge at a desired_map node whose coextensive
+                    # regions have changed must be redone.
+                    new = node.split('-', 1)[-1]
+                    if self.has_node(new):
+                        affected.update(self.in_edges(new))
+                        affected.update(self.out_edges(new))
+                    else:
+                        self.add_node(new)
+                elif conn.has_node(node):
+                    touched.update(conn.in_edges(node))
+                    touched.update(conn.out_edges(node))
+            for s, t in (relation, relation[::-1]):
+                affected.update(self.provenance.pairs_for_relation((s, t)))
+        for original_s, original_t in added_conn_edges:
+            for node in (original_s, original_t):
+                if node.split('-')[0] == desired_map:
+                    self.add_node(node.split('-', 1)[-1])
+        candidates = {}
+        for conn_edge in touched:
+            affected.update(self.provenance.pairs_for_conn_edge(conn_edge))
+            if conn.has_edge(*conn_edge):
+                candidates[conn_edge] = list(self._iter_translations(
+                        mapp, conn, desired_map, *conn_edge))
+                for new_source, new_target, attr, relations in \
+                        candidates[conn_edge]:
+                    if new_source != new_target:
+                        affected.add((new_source, new_target))
+        # Every candidate for an affected edge must be considered again,
+        # as add_edge keeps only the best one.
+        for pair in affected:
+            if pair not in self.provenance:
+                continue
+            for conn_edge in self.provenance.conn_edges_for(pair):
+                if conn_edge not in candidates and \
+                        conn.has_edge(*conn_edge):
+                    candidates[conn_edge] = list(self._iter_translations(
+                            mapp, conn, desired_map, *conn_edge))
+            self.provenance.discard(pair)
+            self.remove_edge(*pair)
+        # Candidates are replayed in the order add_translated_edges adds
+        # them, as add_edge keeps the first of equally good ones (e.g.,
+        # of two with Connection 'Unknown').
+        for conn_edge in conn.edges_iter():
+            if conn_edge not in candidates:
+                continue
+            for new_source, new_target, attr, relations in \
+                    candidates[conn_edge]:
+                if (new_source, new_target) in affected:
+                    self._add_candidate(new_source, new_target, attr,
+                                        conn_edge, relations)
+        return affected
+
+    def explain(self, source, target):
+        """Return the conn edges and mapp relations behind an edge.
+
+        Parameters
+        ----------
+        source, target : strings
+          Nodes in this graph.
+
+        Returns
+        -------
+        sources : dict
+          Maps 'conn_edges' to the set of conn edges translated to the
+          edge from source to target, and 'relations' to the set of mapp
+          edges used to translate them.
+
+        Notes
+        -----
+        The graph must have been built by add_translated_edges with
+        track_provenance set to True.
+        """
+        if getattr(self, 'provenance', None) is None:
+            raise EndGraphError('explain requires provenance; call '
+                                'add_translated_edges with '
+                                'track_provenance=True')
+        try:
+            return self.provenance.explain((source, target))
+        except KeyError:
+            raise EndGraphError('No provenance for edge from %s to %s' %
+                                (source, target))
+
+    def edge_columns(self, rebuild=False):
+        """Return the graph's edge attributes as arrays.
+
+        See EdgeColumns.  The columns are built on the first call and
+        then kept up to date by this class's methods for adding and
+        removing nodes and edges, so later calls return them at once.
+        Changes made by bypassing those methods (e.g., by calling
+        nx.DiGraph.add_edge.im_func) are not tracked; after such changes,
+        pass rebuild=True.
+        """
+        columns = getattr(self, '_columns', None)
+        if rebuild or columns is None or \
+                len(columns) != self.number_of_edges() or \
+                len(columns.nodes) != self.number_of_nodes():
+            columns = self._columns = EdgeColumns(self)
+        return columns
+
+    def translation_session(self, mapp, conn, desired_map, method):
+        """Return a TranslationSession that adds edges to this graph.
+
+        See TranslationSession for parameter details.
+        """
+        return TranslationSession(mapp, conn, desired_map, method, self)
 
     def add_translated_edge(self, mapp, conn, desired_map, method, edge):
         """This function translates one edge in conn to nomenclature of desired_bmap.
@@ -630,29 +1326,351 @@ latter are not disjoint""" % (new, originals))
         method : string
           AT method to be used: 'original' (that of Stephan & Kotter)
           or 'modified'
+
+        Notes
+        -----
+        Each call repeats the translation setup.  To probe many edges,
+        use translation_session instead.
         """
-        self.map = desired_map
-        # Add all target-map nodes to the EndGraph.  We need to search both
-        # the map and con graphs because one can contain nodes the other
-        # doesn't have.
-        for node in set(mapp.nodes()+conn.nodes()):
-            if node.split('-')[0] == desired_map:
-                self.add_node(node.split('-', 1)[-1])
-        at_setting = {'original': self._translate_attr_original,
-                      'modified': self._translate_attr_modified}
-        self._translate_attr = at_setting[method]
-        for original_s, original_t in edge:
-            s_dict = self._make_translation_dict(mapp, original_s, desired_map)
-            t_dict = self._make_translation_dict(mapp, original_t, desired_map)
-            for s_mapping in s_dict.iteritems():
-                for t_mapping in t_dict.iteritems():
-                    attr = self._translate_attr(s_mapping, t_mapping, mapp,
-                                                conn)
-                    # The first element in each mapping is the node in
-                    # desired_map.  We must remove the brain map name,
-                    # pre-pended to the name of the area.  (Note that
-                    # the brain map is stored as self.map.)
-                    new_source = s_mapping[0].split('-', 1)[-1]
-                    new_target = t_mapping[0].split('-', 1)[-1]
-                    self.add_edge(new_source, new_target, attr)
-    
\ No newline at end of file
+        with self.translation_session(mapp, conn, desired_map,
+                                      method) as session:
+            for original_edge in edge:
+                session.add(original_edge)
+
+
+class TranslationSession(object):
+
+    """Translate single edges in conn after a one-time setup.
+
+    Creating a session registers the desired_map nodes in the EndGraph,
+    binds the AT method, and prepares a cache of translation dicts.
+    Each query then does only the work for the edge in question.
+
+    Parameters
+    ----------
+    mapp : MapGraph
+      Graph of spatial relationships between BrainSites from various
+      BrainMaps.
+
+    conn : ConGraph
+      Graph of anatomical connections between BrainSites.
+
+    desired_map : string
+      Name of BrainMap to which translation will be performed.
+
+    method : string
+      AT method to be used: 'original' (that of Stephan & Kotter) or
+      'modified'
+
+    endg : EndGraph (optional)
+      Graph that receives edges passed to add.  A new EndGraph is made
+      if none is supplied.
+
+    Notes
+    -----
+    Neither mapp nor conn may be changed while the session is in use, as
+    translation dicts and conn's edges are cached.  Call close, or use the
+    session in a with statement, to drop the conn cache from endg.
+    """
+
+    def __init__(self, mapp, conn, desired_map, method, endg=None):
+        if endg is None:
+            endg = EndGraph()
+        endg._set_up_translation(mapp, conn, desired_map, method)
+        self.endg = endg
+        self.mapp = mapp
+        self.conn = conn
+        self.desired_map = desired_map
+        self._translation_dicts = {}
+
+    def translate(self, edge):
+        """Return the translations of an edge in conn.
+
+        Parameters
+        ----------
+        edge : tuple
+          (source, target) edge in conn.
+
+        Returns
+        -------
+        translations : list
+          (new_source, new_target, attr) tuples, one for each candidate
+          edge in desired_map.  Self-loops are omitted.
+        """
+        original_s, original_t = edge
+        return [(new_source, new_target, attr) for
+                new_source, new_target, attr, relations in
+                self.endg._iter_translations(self.mapp, self.conn,
+                                             self.desired_map, original_s,
+                                             original_t,
+                                             self._translation_dicts)
+                if new_source != new_target]
+
+    def add(self, edge):
+        """Translate an edge in conn and add the results to self.endg.
+
+        Parameters
+        ----------
+        edge : tuple
+          (source, target) edge in conn.
+        """
+        original_s, original_t = edge
+        for new_source, new_target, attr, relations in \
+                self.endg._iter_translations(self.mapp, self.conn,
+                                             self.desired_map, original_s,
+                                             original_t,
+                                             self._translation_dicts):
+            self.endg._add_candidate(new_source, new_target, attr, edge,
+                                     relations)
+
+    def close(self):
+        """Drop the cached translation data from self.endg."""
+        self.endg._clear_translation_caches()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _column(name):
+    """Return property giving the filled rows of column name."""
+    return property(lambda self: self._data[name][:self._size])
+
+
+class EdgeColumns(object):
+
+    """Edge attributes of a graph held in parallel arrays.
+
+    When the columns are built, row i of each array describes the ith
+    edge of g.edges_iter().  Filters return boolean masks over the rows,
+    computed in a single vectorized operation, and subgraph turns a mask
+    into a view.
+
+    The columns can be kept up to date as the graph changes with
+    set_edge, remove_edge, add_node, and remove_node, as EndGraph does
+    for its edge_columns.  Removals move the last row (or node) into the
+    freed slot, so rows then no longer follow g.edges_iter().
+
+    Parameters
+    ----------
+    g : EndGraph or NetworkX DiGraph
+      Edges may have 'Connection' (modified AT method) or 'EC_Source'
+      and 'EC_Target' (original AT method) attributes, and 'PDC'.
+
+    Attributes
+    ----------
+    nodes : list
+      Nodes of g; sources and targets index into it.
+
+    sources, targets : 1D int arrays
+
+    connection : 1D int array
+      Index in CONNECTIONS, or -1 if the edge has no Connection.
+
+    ec_source, ec_target : 1D int arrays
+      Index in ECS, or -1 if the edge has no ECs.
+
+    pdc : 1D float array
+      nan if the edge has no PDC.
+    """
+
+    CONNECTIONS = _CONNECTIONS
+    ECS = ('C', 'X', 'P', 'N', 'Nc', 'Np', 'Nx', 'U', 'Up', 'Ux')
+
+    _DTYPES = {'sources': int, 'targets': int, 'connection': int,
+               'ec_source': int, 'ec_target': int, 'pdc': float}
+
+    _connection_codes = dict(zip(CONNECTIONS, range(len(CONNECTIONS))))
+    _ec_codes = dict(zip(ECS, range(len(ECS))))
+
+    sources = _column('sources')
+    targets = _column('targets')
+    connection = _column('connection')
+    ec_source = _column('ec_source')
+    ec_target = _column('ec_target')
+    pdc = _column('pdc')
+
+    def __init__(self, g):
+        self.nodes = []
+        self._node_index = {}
+        self._rows = {}
+        self._size = 0
+        self._data = {}
+        for name, dtype in self._DTYPES.iteritems():
+            self._data[name] = np.empty(g.number_of_edges(), dtype=dtype)
+        self.add_nodes_from(g.nodes())
+        for source, target, attr in g.edges_iter(data=True):
+            self.set_edge(source, target, attr)
+
+    def add_node(self, node):
+        """Add node, which no edge yet uses, if it is new."""
+        if node not in self._node_index:
+            self._node_index[node] = len(self.nodes)
+            self.nodes.append(node)
+
+    def add_nodes_from(self, nodes):
+        for node in nodes:
+            self.add_node(node)
+
+    def remove_node(self, node):
+        """Remove node and the rows of its edges."""
+        i = self._node_index.pop(node)
+        rows = np.nonzero((self.sources == i) | (self.targets == i))[0]
+        nodes = self.nodes
+        edges = [(nodes[s], nodes[t]) for s, t in
+                 zip(self.sources[rows].tolist(),
+                     self.targets[rows].tolist())]
+        for source, target in edges:
+            self.remove_edge(source, target)
+        last = len(nodes) - 1
+        if i != last:
+            moved = nodes[last]
+            nodes[i] = moved
+            self._node_index[moved] = i
+            self.sources[self.sources == last] = i
+            self.targets[self.targets == last] = i
+        nodes.pop()
+
+    def set_edge(self, source, target, attr):
+        """Add a row for the edge, or overwrite its row, with attr."""
+        self.add_nodes_from((source, target))
+        row = self._rows.get((source, target))
+        if row is None:
+            row = self._size
+            self._size += 1
+            for name, column in self._data.items():
+                self._data[name] = _grown(column, self._size)
+            self._rows[(source, target)] = row
+        data = self._data
+        data['sources'][row] = self._node_index[source]
+        data['targets'][row] = self._node_index[target]
+        data['connection'][row] = self._connection_codes.get(
+            attr.get('Connection'), -1)
+        data['ec_source'][row] = self._ec_codes.get(attr.get('EC_Source'),
+                                                    -1)
+        data['ec_target'][row] = self._ec_codes.get(attr.get('EC_Target'),
+                                                    -1)
+        data['pdc'][row] = attr.get('PDC', np.nan)
+
+    def remove_edge(self, source, target):
+        """Remove the row of the edge, moving the last row into it."""
+        row = self._rows.pop((source, target))
+        last = self._size - 1
+        if row != last:
+            for array in self._data.itervalues():
+                array[row] = array[last]
+            moved = (self.nodes[self._data['sources'][row]],
+                     self.nodes[self._data['targets'][row]])
+            self._rows[moved] = row
+        self._size = last
+
+    def __len__(self):
+        return len(self.sources)
+
+    def _ecs_in(self, ecs):
+        """Return mask of edges with either EC in ecs."""
+        codes = [self.ECS.index(ec) for ec in ecs]
+        return (np.in1d(self.ec_source, codes) |
+                np.in1d(self.ec_target, codes))
+
+    def known(self):
+        """Return mask of edges whose existence is known.
+
+        These have a Connection other than 'Unknown', or ECs none of which
+        are unknown (U, Up, or Ux).
+        """
+        has_ecs = self.ec_source >= 0
+        return np.where(self.connection >= 0,
+                        self.connection != self.CONNECTIONS.index('Unknown'),
+                        has_ecs & ~self._ecs_in(('U', 'Up', 'Ux')))
+
+    def present(self):
+        """Return mask of edges known to be present.
+
+        These have a Connection of 'Present', or ECs none of which are
+        absent or unknown.
+        """
+        has_ecs = self.ec_source >= 0
+        absent_or_unknown = ('N', 'Nc', 'Np', 'Nx', 'U', 'Up', 'Ux')
+        return np.where(self.connection >= 0,
+                        self.connection == self.CONNECTIONS.index('Present'),
+                        has_ecs & ~self._ecs_in(absent_or_unknown))
+
+    def pdc_below(self, threshold):
+        """Return mask of edges with PDC less than threshold."""
+        with np.errstate(invalid='ignore'):
+            return self.pdc < threshold
+
+    def subgraph(self, mask):
+        """Return an EdgeSubgraphView of the edges selected by mask."""
+        return EdgeSubgraphView(self, mask)
+
+
+class EdgeSubgraphView(object):
+
+    """Read-only view of the edges in EdgeColumns selected by a mask.
+
+    Only the source and target indices of the selected rows are stored,
+    so the view is unaffected by later changes to the columns.  All
+    nodes of the original graph are kept.  The view can be passed to the
+    functions in cocotools.stats that take a graph, such as
+    distance_matrix and centrality_suite.
+
+    Parameters
+    ----------
+    columns : EdgeColumns
+
+    mask : 1D bool array
+    """
+
+    def __init__(self, columns, mask):
+        self._nodes = list(columns.nodes)
+        self.sources = columns.sources[mask]
+        self.targets = columns.targets[mask]
+        self._edge_set = None
+
+    def nodes(self):
+        return list(self._nodes)
+
+    def number_of_nodes(self):
+        return len(self._nodes)
+
+    def number_of_edges(self):
+        return len(self.sources)
+
+    __len__ = number_of_edges
+
+    def edges_iter(self):
+        """Yield the selected edges as (source, target) tuples."""
+        nodes = self._nodes
+        for s, t in zip(self.sources.tolist(), self.targets.tolist()):
+            yield nodes[s], nodes[t]
+
+    __iter__ = edges_iter
+
+    def edges(self):
+        return list(self.edges_iter())
+
+    def has_edge(self, source, target):
+        if self._edge_set is None:
+            self._edge_set = set(self.edges_iter())
+        return (source, target) in self._edge_set
+
+    def to_scipy_sparse_matrix(self):
+        """Return the selected edges as a binary CSR adjacency matrix.
+
+        Rows and columns follow self.nodes().
+        """
+        n = len(self._nodes)
+        return scipy.sparse.csr_matrix(
+            (np.ones(len(self.sources)), (self.sources, self.targets)),
+            shape=(n, n))
+
+    def to_graph(self):
+        """Return the view as a new NetworkX DiGraph without attributes."""
+        g = nx.DiGraph()
+        g.add_nodes_from(self._nodes)
+        g.add_edges_from(self.edges_iter())
+        return g
@@ -16,12 +16,19 @@ http://www.tp.umu.se/~rosvall/code.html
 #-----------------------------------------------------------------------------
 
 # Stdlib
+import os
 import re
+import shutil
+import tempfile
 
+from multiprocessing.pool import ThreadPool
 from subprocess import check_call
 
 # Third-party
 import networkx as nx
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
 
 # Our own
 from pajek import write_pajek
@@ -30,139 +37,206 @@ from pajek import write_pajek
 # Functions
 #-----------------------------------------------------------------------------
 
-def _load_modules(g, map):
-    """Add modules to an open graph.
+def _get_state(line, state):
+    """Compute the next state based on the current line content.
+
+    Called by _map_sections.
+    """
+    if not line or line.startswith('#') or line.isspace() or \
+       line.startswith('*Directed'): 
+        state = 'top'
+    elif line.startswith('*Modules'):
+        state = 'modules'
+    elif line.startswith('*Nodes'):
+        state = 'nodes'                
+    elif line.startswith('*Links'):
+        state = 'links'
+    # We return state unmodified if we didn't find a transition
+    return state
 
-    Iterates the input map file adding modules as nodes to the graph as it
-    finds them, and stops (returning the new state) when it detects the data
-    stops describing modules.
 
-    Called by _load_infomap.
+class InfomapMap(object):
 
-    Parameters
-    ----------
-    g : networkx DiGraph
-      This graph is modified in-place.
+    """Contents of an infomap .map partition file, held in arrays.
 
-    map :  file object
-      An open file object with infomap format.
-      
-    Returns
-    -------
-    Return the new state after the state transition."""
-    #print '===> load_modules'  # dbg
-    r = re.compile(r'^(?P<num>\d+)\s+(?P<id>.*)\s+(?P<ss>[\d.]+)\s+'
-                   r'(?P<x>[\d.]+)\s*$')
-    state = 'modules'
-    for line in map:
-        state = _get_state(line, state)
-        if state != 'modules':
-            return state
-        m = r.match(line)
-        if m is None:
-            raise ValueError('Line %r not understood in modules loader' %
-                             line)
-        mg = m.group
-        modnum = int(mg('num'))
-        # Each node in the module partition really contains a subgraph, 
-        # though the map file only has subnode data, without the original
-        # edges (which is sensible since those edges might cross modules)
-        g.add_node(modnum, dict(id = mg('id'),
-                                steady_state=float(mg('ss')),
-                                x = float(mg('x')),
-                                nodes = []))
-    return 'top'
-
-def _load_nodes(g, map):
-    """Add nodes to an open graph.
-
-    Iterates the input map file adding nodes to the graph as it finds them, and
-    stops (returning the new state) when it detects the data stops describing
-    modules.
-
-    Called by _load_infomap.
+    Created by read_map_file.  Labels are stored as they appear in the
+    file (quoted).
 
-    Parameters
+    Attributes
     ----------
-    g : networkx DiGraph
-      This graph is modified in-place.
+    module_ids : list
+      Label of each module (that of its most visited node).
 
-    map :  file object
-      An open file object with infomap format.
-      
-    Returns
-    -------
-    Return the new state after the state transition."""
-    #print '===> load_nodes'  # dbg
-    r = re.compile(r'^(?P<mod>\d+):(?P<rank>\d+)\s+(?P<id>.*)'
-                   r'\s+(?P<ss>[\d.]+)\s*$')
-    state = 'nodes'
-    for line in map:
-        state = _get_state(line, state)
-        if state != 'nodes':
-            return state
-        m = r.match(line)
+    module_numbers : 1D int array
+
+    module_flow, module_exit : 1D float arrays
+      Steady-state flow through, and exit flow from, each module.
+
+    node_ids : list
+      Label of each node.
+
+    node_modules, node_ranks : 1D int arrays
+      Module number of each node, and its rank within the module.
+
+    node_flow : 1D float array
+      Steady-state flow through each node.
+
+    link_sources, link_targets : 1D int arrays
+      Module numbers of the links between modules.
+
+    link_flow : 1D float array
+    """
+
+    def labels(self):
+        """Return node labels without the quotes added by infomap."""
+        return [node_id.strip('"') for node_id in self.node_ids]
+
+    def assignments(self, nodes):
+        """Return the module number of each of nodes.
+
+        Parameters
+        ----------
+        nodes : list
+          Nodes of the graph passed to infomap; they are matched to
+          labels as strings.
+
+        Returns
+        -------
+        modules : 1D int array
+          -1 for nodes not in the file.
+        """
+        index = dict(zip(self.labels(), range(len(self.node_ids))))
+        rows = np.array([index.get(str(node), -1) for node in nodes],
+                        dtype=int)
+        modules = self.node_modules[rows] if len(rows) else rows
+        return np.where(rows >= 0, modules, -1)
+
+    def to_graph(self):
+        """Return the partition as a DiGraph of modules.
+
+        Each node (module) has attributes id, steady_state, x, and nodes, a
+        list of (rank, id, steady_state) tuples for the nodes of the
+        original graph in the module.  Edges have the link flow as weight.
+        """
+        g = nx.DiGraph()
+        for number, module_id, flow, exit_flow in zip(
+                self.module_numbers.tolist(), self.module_ids,
+                self.module_flow.tolist(), self.module_exit.tolist()):
+            g.add_node(number, dict(id=module_id, steady_state=flow,
+                                    x=exit_flow, nodes=[]))
+        for module, rank, node_id, flow in zip(
+                self.node_modules.tolist(), self.node_ranks.tolist(),
+                self.node_ids, self.node_flow.tolist()):
+            g.node[module]['nodes'].append((rank, node_id, flow))
+        g.add_weighted_edges_from(zip(self.link_sources.tolist(),
+                                      self.link_targets.tolist(),
+                                      self.link_flow.tolist()))
+        return g
+
+
+# Number of fields per line in each section of a .map file, and patterns
+# matching whole lines for sections with labels containing spaces.
+_SECTION_FIELDS = dict(modules=4, nodes=3, links=3)
+_SECTION_PATTERNS = dict(
+    modules=re.compile(r'^(\d+)[ \t]+(.*)[ \t]+([\d.]+)[ \t]+([\d.]+)[ \t]*$',
+                       re.M),
+    nodes=re.compile(r'^(\d+:\d+)[ \t]+(.*)[ \t]+([\d.]+)[ \t]*$', re.M),
+    links=re.compile(r'^(\d+)[ \t]+(\d+)[ \t]+([\d.]+)[ \t]*$', re.M))
+_SECTION_END = re.compile(r'^([ \t\r]*$|#)', re.M)
+
+
+def _map_sections(text):
+    """Return dict mapping section names to their lines in a .map file.
+
+    The text is split at the section headers once; a section ends at its
+    first blank or comment line, as in _get_state.  Called by
+    read_map_file.
+    """
+    sections = dict(modules='', nodes='', links='')
+    for chunk in re.split(r'^\*', text, flags=re.M)[1:]:
+        header, newline, body = chunk.partition('\n')
+        state = _get_state('*' + header, 'top')
+        if state == 'top':
+            continue
+        end = _SECTION_END.search(body)
+        if end is not None:
+            body = body[:end.start()]
+        sections[state] = body
+    return sections
+
+
+def _section_columns(body, section):
+    """Return the columns of fields in the lines of a .map section.
+
+    Lines are split at whitespace; if any line does not then have the
+    section's number of fields (e.g., because a label contains spaces),
+    each line is matched by the section's pattern instead.  Called by
+    read_map_file.
+    """
+    lines = body.splitlines()
+    n_fields = _SECTION_FIELDS[section]
+    rows = [line.split() for line in lines]
+    if all(len(row) == n_fields for row in rows):
+        return zip(*rows) or [()] * n_fields
+    pattern = _SECTION_PATTERNS[section]
+    rows = []
+    for line in lines:
+        m = pattern.match(line)
         if m is None:
-            raise ValueError('Line %r not understood in nodes loader' %
-                             line)
-        mg = m.group
-        g.node[int(mg('mod'))]['nodes'].append( (int(mg('rank')), mg('id'), 
-                                         float(mg('ss'))) )
-    return 'top'
+            raise ValueError('Line %r not understood in %s loader' %
+                             (line, section))
+        rows.append(m.groups())
+    return zip(*rows)
+
 
+def _to_array(strings, dtype, section):
+    """Convert strings to a numeric array with one parsing call."""
+    try:
+        return np.array(strings, dtype=dtype)
+    except ValueError:
+        raise ValueError('Numbers not understood in %s loader' % section)
 
-def _load_links(g, map):
-    """Add links to an open graph.
 
-    Iterates the input map file adding links to the graph as it finds them, and
-    stops (returning the new state) when it detects the data stops describing
-    modules.
+def read_map_file(mapfile):
+    """Read an infomap .map partition file into arrays.
 
-    Called by _load_infomap.
+    The file is read at once and split into its Modules, Nodes, and Links
+    sections; each section is then tokenized and converted to arrays in
+    bulk.
 
     Parameters
     ----------
-    g : networkx DiGraph
-      This graph is modified in-place.
+    mapfile : str
+      Path of a file in infomap partition format.
 
-    map :  file object
-      An open file object with infomap format.
-      
     Returns
     -------
-    Return the new state after the state transition."""
-    #print '===> load_links'  # dbg
-    r = re.compile(r'^(?P<mod1>\d+)\s+(?P<mod2>\d+)\s+(?P<ss>[\d.]+)\s*$')
-    state = 'links'
-    for line in map:
-        state = _get_state(line, state)
-        if state != 'links':
-            return state
-        m = r.match(line)
-        if m is None:
-            raise ValueError('Line %r not understood in links loader' %
-                             line)
-        mg = m.group
-        g.add_edge(int(mg('mod1')), int(mg('mod2')), weight=float(mg('ss')))
-    return 'top'
-    
-    
-def _get_state(line, state):
-    """Compute the next state based on the current line content.
-
-    Called by _load_infomap, _load_links, _load_nodes, and _load_modules.
+    partition : InfomapMap
+      Call its to_graph method for the DiGraph made by _load_infomap.
     """
-    if not line or line.startswith('#') or line.isspace() or \
-       line.startswith('*Directed'): 
-        state = 'top'
-    elif line.startswith('*Modules'):
-        state = 'modules'
-    elif line.startswith('*Nodes'):
-        state = 'nodes'                
-    elif line.startswith('*Links'):
-        state = 'links'
-    # We return state unmodified if we didn't find a transition
-    return state
+    with open(mapfile) as f:
+        sections = _map_sections(f.read())
+    partition = InfomapMap()
+    numbers, ids, flow, exit_flow = _section_columns(sections['modules'],
+                                                     'modules')
+    partition.module_numbers = _to_array(numbers, int, 'modules')
+    partition.module_ids = list(ids)
+    partition.module_flow = _to_array(flow, float, 'modules')
+    partition.module_exit = _to_array(exit_flow, float, 'modules')
+    heads, ids, flow = _section_columns(sections['nodes'], 'nodes')
+    heads = _to_array(' '.join(heads).replace(':', ' ').split(), int,
+                      'nodes')
+    if len(heads) != 2 * len(ids):
+        raise ValueError('Module numbers not understood in nodes loader')
+    partition.node_modules = heads[0::2]
+    partition.node_ranks = heads[1::2]
+    partition.node_ids = list(ids)
+    partition.node_flow = _to_array(flow, float, 'nodes')
+    sources, targets, flow = _section_columns(sections['links'], 'links')
+    partition.link_sources = _to_array(sources, int, 'links')
+    partition.link_targets = _to_array(targets, int, 'links')
+    partition.link_flow = _to_array(flow, float, 'links')
+    return partition
 
 
 def _load_infomap(mapfile):
@@ -183,32 +257,10 @@ def _load_infomap(mapfile):
     -------
     g : networkx DiGraph
     """
-    loaders = dict(modules=_load_modules,
-                   nodes=_load_nodes,
-                   links=_load_links,
-                   top=lambda *x: 'top')
-    
-    g = nx.DiGraph()
-    state = 'top'
-    with open(mapfile) as map:
-        try:
-            while True:
-                # Each loader returns the new state when it changes.  We must
-                # then avoid consuming more lines unless in the 'top' sate; if
-                # we consume lines here from one data state to another, we'll
-                # effectively read one extra line before the loader gets
-                # called, and it will miss that data.  Hence this unusual
-                # approach with manually calling .next() here.
-                if state == 'top':
-                    line = map.next()
-                    state = _get_state(line, state)
-                state = loaders[state](g, map)
-        except StopIteration:
-            pass
-    return g
-
-
-def _infomap(basepath, n_iter=10, seed=123456):
+    return read_map_file(mapfile).to_graph()
+
+
+def _infomap(basepath, n_iter=10, seed=123456, executable='infomap'):
     """Create an InfoMap graph given a path.
 
     This calls the binary `infomap` program, which must be available in your
@@ -227,10 +279,13 @@ def _infomap(basepath, n_iter=10, seed=123456):
 
     seed : int (default 123456)
       Seed for infomap random number generator.
+
+    executable : str (default 'infomap')
+      Name or path of the infomap program.
     """
     netfile = basepath + '.net'
     mapfile = basepath + '.map'
-    cmd = ['infomap', str(seed), netfile, str(n_iter)]
+    cmd = [executable, str(seed), netfile, str(n_iter)]
     #print '$', ' '.join(cmd)  # dbg
     check_call(cmd)  # this will raise if the infomap cmd isn't found
     return _load_infomap(mapfile)
@@ -258,3 +313,118 @@ def nx2infomap(g, name=None, n_iter=10, seed=123456):
     print 'pajek name:', name
     write_pajek(g, name+'.net')
     return _infomap(name, n_iter, seed)
+
+
+def coassignment_matrix(assignments):
+    """Return the fraction of partitions in which each pair shares a module.
+
+    Parameters
+    ----------
+    assignments : 2D array
+      Module numbers, one row per partition and one column per node.
+      Negative numbers mark nodes missing from a partition.
+
+    Returns
+    -------
+    C : 2D array
+      C[i, j] is the fraction of rows in which nodes i and j have the same
+      module number.  Nodes missing from a row share no module in it.
+    """
+    assignments = np.asarray(assignments)
+    n_runs, n_nodes = assignments.shape
+    C = np.zeros((n_nodes, n_nodes))
+    for modules in assignments:
+        assigned = modules >= 0
+        C += ((modules[:, np.newaxis] == modules[np.newaxis, :]) &
+              assigned[:, np.newaxis] & assigned[np.newaxis, :])
+    return C / n_runs
+
+
+def consensus_modules(nodes, C, threshold=0.5):
+    """Group nodes that share a module in more than threshold of runs.
+
+    Parameters
+    ----------
+    nodes : list
+      Nodes in the order of the rows of C.
+
+    C : 2D array
+      Co-assignment matrix (see coassignment_matrix).
+
+    threshold : float (optional)
+
+    Returns
+    -------
+    modules : list of lists
+      Connected components of the graph linking node pairs with C above
+      threshold, largest first.
+    """
+    n_modules, labels = scipy.sparse.csgraph.connected_components(
+        scipy.sparse.csr_matrix(C > threshold), directed=False)
+    modules = [[] for i in range(n_modules)]
+    for node, label in zip(nodes, labels):
+        modules[label].append(node)
+    return sorted(modules, key=len, reverse=True)
+
+
+def multi_seed_infomap(g, seeds, n_iter=10, processes=None,
+                       executable='infomap'):
+    """Run infomap on a DiGraph with several seeds in parallel.
+
+    The network is written once to a private temporary directory, which
+    is removed afterwards.  Each seed runs in its own subdirectory (with
+    a link to the network), so runs do not overwrite each other's output.
+
+    Parameters
+    ----------
+    g : networkx DiGraph
+
+    seeds : list of ints
+      Seeds for infomap's random number generator; one run per seed.
+
+    n_iter : int (default 10)
+      Number of iterations for each run.
+
+    processes : int (optional)
+      Maximum number of concurrent infomap processes.  Default is the
+      number of CPUs.
+
+    executable : str (default 'infomap')
+      Name or path of the infomap program.
+
+    Returns
+    -------
+    nodes : list
+      The nodes of g, in the order used by the arrays.
+
+    assignments : 2D array
+      Module number of each node (columns) in each run (rows).
+
+    C : 2D array
+      Co-assignment matrix (see coassignment_matrix).  Pass it to
+      consensus_modules for a consensus partition.
+    """
+    nodes = sorted(g.nodes())
+    directory = tempfile.mkdtemp(prefix='infomap')
+    try:
+        netfile = os.path.join(directory, 'network.net')
+        write_pajek(g, netfile)
+
+        def run(job):
+            i, seed = job
+            basepath = os.path.join(directory, 'run%d' % i, 'network')
+            os.mkdir(os.path.dirname(basepath))
+            os.symlink(netfile, basepath + '.net')
+            check_call([executable, str(seed), basepath + '.net',
+                        str(n_iter)])
+            return read_map_file(basepath + '.map').assignments(nodes)
+
+        pool = ThreadPool(processes)
+        try:
+            assignments = np.array(pool.map(run, list(enumerate(seeds))))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(directory)
+    return nodes, assignments, coassignment_matrix(assignments)
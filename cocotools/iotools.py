@@ -1,9 +1,26 @@
 """Input/Output utilities: file reading, etc."""
 
+import collections
 import csv
+import json
+import os
+from numbers import Number
 from os.path import splitext
 
+import networkx as nx
+import numpy as np
+import scipy.sparse
+
 from mapgraph import MapGraph, MapGraphError
+from congraph import ConGraph
+from endgraph import EndGraph, EdgeProvenance
+
+GRAPH_FORMAT_VERSION = 2
+SNAPSHOT_FORMAT_VERSION = 2
+# Files in these versions can still be read.
+_READABLE_VERSIONS = (1, 2)
+_GRAPH_CLASSES = {'MapGraph': MapGraph, 'ConGraph': ConGraph,
+                  'EndGraph': EndGraph, 'DiGraph': nx.DiGraph}
 
 
 def read_graph_from_text(file_path, conn):
@@ -65,6 +82,847 @@ def write_graph_to_text(g, file_path):
             f.write('%s %s %s\n' % (source, target, g[source][target]))
 
 
+def _encode_strings(strings, name, arrays):
+    """Store strings, str or unicode, in arrays[name].
+
+    Unicode strings are stored UTF-8 encoded and flagged in
+    arrays[name + '_unicode'] (added only if there are any), so that
+    non-ASCII text survives and each string is restored with its type.
+    """
+    is_unicode = [isinstance(string, unicode) for string in strings]
+    arrays[name] = np.array([string.encode('utf-8') if flag else string
+                             for string, flag in zip(strings, is_unicode)],
+                            dtype=str)
+    if any(is_unicode):
+        arrays[name + '_unicode'] = np.array(is_unicode, dtype=bool)
+
+
+def _decode_strings(data, is_unicode=None):
+    """Return the strings stored by _encode_strings as a list."""
+    strings = data.tolist()
+    if is_unicode is not None:
+        strings = [string.decode('utf-8') if flag else string for
+                   string, flag in zip(strings, is_unicode.tolist())]
+    return strings
+
+
+# Codes for the type of each value in a column mixing numeric types.
+_FLOAT, _INT, _BOOL = range(3)
+
+
+def _encode_numbers(values, present, given, arrays):
+    """Store numbers in arrays['values'], keeping their types.
+
+    The column is bool, int64, or float, according to the values.  A
+    column mixing types is stored as float, with the exact integers in
+    arrays['ints'] and the type of each value in arrays['types'].
+    """
+    is_bool = np.array([isinstance(value, bool) for value in given],
+                       dtype=bool)
+    is_int = np.array([isinstance(value, (int, long)) for value in given],
+                      dtype=bool) & ~is_bool
+    if is_bool.all():
+        dtype = bool
+    elif is_int.all():
+        dtype = np.int64
+    else:
+        dtype = float
+    column = np.zeros(len(values), dtype=dtype)
+    column[present] = given
+    arrays['values'] = column
+    if dtype is float and (is_bool | is_int).any():
+        types = np.zeros(len(values), dtype=np.int8)
+        types[present] = np.where(is_bool, _BOOL,
+                                  np.where(is_int, _INT, _FLOAT))
+        ints = np.zeros(len(values), dtype=np.int64)
+        ints[present] = [value if isinstance(value, (int, long)) else 0
+                         for value in given]
+        arrays['types'] = types
+        arrays['ints'] = ints
+
+
+def _exact_number(value, type_code, int_value):
+    """Return a value of a mixed column as stored by _encode_numbers."""
+    if type_code == _BOOL:
+        return bool(int_value)
+    if type_code == _INT:
+        return int_value
+    return value
+
+
+def _encode_attribute(values, node_index):
+    """Return arrays that encode one edge attribute for save_graph.
+
+    values holds the attribute for each edge, or None where an edge
+    lacks it.  Strings are coded into a table, numbers are stored as a
+    column (see _encode_numbers), and lists of nodes (e.g., TPs) are
+    flattened into node indices with offsets.
+    """
+    present = np.array([value is not None for value in values], dtype=bool)
+    given = [value for value in values if value is not None]
+    arrays = {}
+    if all(isinstance(value, basestring) for value in given):
+        table = sorted(set(given))
+        codes = dict(zip(table, range(len(table))))
+        arrays['kind'] = np.array('str')
+        _encode_strings(table, 'table', arrays)
+        arrays['codes'] = np.array([codes.get(value, -1) for value in values],
+                                   dtype=np.int32)
+    elif all(isinstance(value, Number) for value in given):
+        arrays['kind'] = np.array('num')
+        _encode_numbers(values, present, given, arrays)
+    elif all(isinstance(value, list) for value in given):
+        lengths = [len(value) if value is not None else 0
+                   for value in values]
+        arrays['kind'] = np.array('nodes')
+        arrays['offsets'] = np.concatenate(([0], np.cumsum(lengths)))
+        arrays['flat'] = np.array([node_index[node] for value in given
+                                   for node in value], dtype=np.int32)
+    else:
+        raise ValueError('Cannot encode values: %s' % given[:3])
+    if not present.all():
+        arrays['present'] = present
+    return arrays
+
+
+def _decode_attribute(arrays, nodes, n_edges):
+    """Return per-edge values (None where absent) encoded by save_graph."""
+    kind = str(arrays['kind'])
+    if kind == 'str':
+        table = _decode_strings(arrays['table'], arrays.get('table_unicode'))
+        values = [table[code] for code in arrays['codes'].tolist()]
+    elif kind == 'num':
+        values = arrays['values'].tolist()
+        if 'types' in arrays:
+            values = [_exact_number(*args) for args in
+                      zip(values, arrays['types'].tolist(),
+                          arrays['ints'].tolist())]
+    else:
+        offsets = arrays['offsets'].tolist()
+        flat = [nodes[i] for i in arrays['flat'].tolist()]
+        values = [flat[offsets[i]:offsets[i+1]] for i in range(n_edges)]
+    if 'present' in arrays:
+        values = [value if present else None for value, present in
+                  zip(values, arrays['present'].tolist())]
+    return values
+
+
+def _instance_attributes(g):
+    """Return the public instance attributes of g that JSON can hold.
+
+    These are, e.g., the map and method of an EndGraph.  NetworkX's own
+    attributes are left out.
+    """
+    nx_names = set(vars(nx.DiGraph()))
+    return dict((name, value) for name, value in vars(g).iteritems() if
+                not name.startswith('_') and name not in nx_names and
+                (value is None or isinstance(value, (basestring, Number))))
+
+
+def _encode_provenance(provenance, arrays):
+    """Store an EdgeProvenance in arrays, under names 'provenance.*'."""
+    pairs, conn_edges, relations, columns = provenance.to_arrays()
+    for name, items in (('pairs', pairs), ('conn_edges', conn_edges),
+                        ('relations', relations)):
+        _encode_strings([node for item in items for node in item],
+                        'provenance.' + name, arrays)
+    for name, column in columns.iteritems():
+        arrays['provenance.' + name] = column
+
+
+def _decode_provenance(arrays):
+    """Return the EdgeProvenance stored by _encode_provenance."""
+    items = {}
+    for name in ('pairs', 'conn_edges', 'relations'):
+        nodes = _decode_strings(arrays['provenance.' + name],
+                                arrays.get('provenance.%s_unicode' % name))
+        items[name] = zip(nodes[::2], nodes[1::2])
+    columns = dict((name, arrays['provenance.' + name]) for name in
+                   ('pair', 'conn', 'relation'))
+    return EdgeProvenance.from_arrays(items['pairs'], items['conn_edges'],
+                                      items['relations'], columns)
+
+
+def save_graph(g, file_path):
+    """Save graph to a versioned binary (.npz) file.
+
+    The file holds a table of nodes, source and target indices for the
+    edges, and one set of arrays per edge attribute: string attributes
+    (e.g., RC, ECs, Connection) are coded into a table, numeric ones
+    (e.g., PDC) are stored as columns, and lists of nodes (TP) are
+    flattened with offsets.  Public instance attributes holding strings,
+    numbers, or None (e.g., the map and method of an EndGraph) are
+    saved too, as is an EndGraph's provenance, so that apply_delta can
+    be used on the loaded graph.  Read the file with load_graph.
+
+    Parameters
+    ----------
+    g : CoCoTools MapGraph, ConGraph, or EndGraph, or NetworkX DiGraph
+      Nodes must be strings (str or unicode).
+
+    file_path : string
+      Full specification of the file's name, relative to the current
+      directory.  NumPy appends .npz if it is missing.
+    """
+    nodes = g.nodes()
+    node_index = dict(zip(nodes, range(len(nodes))))
+    edges = g.edges(data=True)
+    arrays = {'format_version': np.array(GRAPH_FORMAT_VERSION),
+              'graph_class': np.array(type(g).__name__),
+              'instance': np.array(json.dumps(_instance_attributes(g))),
+              'sources': np.array([node_index[s] for s, t, a in edges],
+                                  dtype=np.int32),
+              'targets': np.array([node_index[t] for s, t, a in edges],
+                                  dtype=np.int32)}
+    _encode_strings(nodes, 'nodes', arrays)
+    if getattr(g, 'provenance', None) is not None:
+        _encode_provenance(g.provenance, arrays)
+    keys = sorted(set(key for s, t, attr in edges for key in attr))
+    arrays['attributes'] = np.array(keys, dtype=str)
+    for key in keys:
+        encoded = _encode_attribute([attr.get(key) for s, t, attr in edges],
+                                    node_index)
+        for part, array in encoded.iteritems():
+            arrays['attr.%s.%s' % (key, part)] = array
+    np.savez_compressed(file_path, **arrays)
+
+
+def load_graph(file_path):
+    """Load a graph saved with save_graph.
+
+    The graph is restored in one bulk pass: edges are inserted with their
+    saved attributes, bypassing the validation in the add_edge methods of
+    MapGraph and ConGraph (e.g., RC deduction), which the saved graph has
+    already passed.
+
+    Parameters
+    ----------
+    file_path : string
+      Full specification of the .npz file's name, relative to the current
+      directory.
+
+    Returns
+    -------
+    g : CoCoTools MapGraph, ConGraph, or EndGraph, or NetworkX DiGraph
+      Graph of the class that was saved.
+    """
+    with np.load(file_path) as data:
+        arrays = dict((name, data[name]) for name in data.files)
+    version = int(arrays['format_version'])
+    if version not in _READABLE_VERSIONS:
+        raise ValueError('Unsupported graph format version: %d' % version)
+    nodes = _decode_strings(arrays['nodes'], arrays.get('nodes_unicode'))
+    encoded = {}
+    for key in arrays['attributes'].tolist():
+        prefix = 'attr.%s.' % key
+        encoded[key] = dict((name[len(prefix):], array) for name, array in
+                            arrays.iteritems() if name.startswith(prefix))
+    attrs = _decode_edge_attributes(encoded, nodes, len(arrays['sources']))
+    instance = json.loads(str(arrays.get('instance', '{}')))
+    if 'provenance.pair' in arrays:
+        instance['provenance'] = _decode_provenance(arrays)
+    return _restore_graph(str(arrays['graph_class']), nodes,
+                          arrays['sources'], arrays['targets'], attrs,
+                          instance)
+
+
+def _decode_edge_attributes(encoded, nodes, n_edges):
+    """Return list of edge attribute dicts from encoded attributes.
+
+    encoded maps each attribute name to the arrays _encode_attribute
+    returned for it.
+    """
+    attrs = [{} for i in range(n_edges)]
+    for key, arrays in encoded.iteritems():
+        for attr, value in zip(attrs, _decode_attribute(arrays, nodes,
+                                                        n_edges)):
+            if value is not None:
+                attr[key] = value
+    return attrs
+
+
+def _restore_graph(class_name, nodes, sources, targets, attrs,
+                   instance=None):
+    """Return graph of class_name built in one bulk pass.
+
+    The add_edge methods of MapGraph and ConGraph are bypassed.  The
+    items of instance are set as attributes of the graph.
+    """
+    g = _GRAPH_CLASSES[class_name]()
+    for name, value in (instance or {}).iteritems():
+        setattr(g, str(name), value)
+    nx.DiGraph.add_nodes_from.im_func(g, nodes)
+    nx.DiGraph.add_edges_from.im_func(
+        g, zip([nodes[i] for i in sources.tolist()],
+               [nodes[i] for i in targets.tolist()], attrs))
+    return g
+
+
+def write_snapshot(g, directory):
+    """Write graph to a directory of arrays that can be memory-mapped.
+
+    The directory holds a string table of nodes (nodes.npy), the edges in
+    CSR form (indptr.npy and indices.npy, sorted by source and then
+    target), the reverse (CSC) structure for predecessor lookups, one
+    array per edge attribute part (encoded as in save_graph), and a JSON
+    header (meta.json) that also holds the public instance attributes
+    saved by save_graph (but not provenance).  Open the snapshot with
+    GraphSnapshot.
+
+    Parameters
+    ----------
+    g : CoCoTools MapGraph, ConGraph, or EndGraph, or NetworkX DiGraph
+      Nodes must be strings (str or unicode).
+
+    directory : string
+      Directory to write; it is created if necessary.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    nodes = g.nodes()
+    n = len(nodes)
+    node_index = dict(zip(nodes, range(n)))
+    edges = sorted(g.edges(data=True),
+                   key=lambda edge: (node_index[edge[0]], node_index[edge[1]]))
+    sources = np.array([node_index[s] for s, t, a in edges], dtype=np.int32)
+    targets = np.array([node_index[t] for s, t, a in edges], dtype=np.int32)
+    # Edges into each node, as positions in the CSR edge order.
+    in_edges = np.lexsort((sources, targets)).astype(np.int32)
+    arrays = {'indptr': np.concatenate(([0], np.cumsum(
+                  np.bincount(sources, minlength=n)))).astype(np.int64),
+              'indices': targets,
+              'in_indptr': np.concatenate(([0], np.cumsum(
+                  np.bincount(targets, minlength=n)))).astype(np.int64),
+              'in_indices': sources[in_edges],
+              'in_edges': in_edges}
+    _encode_strings(nodes, 'nodes', arrays)
+    kinds = {}
+    keys = sorted(set(key for s, t, attr in edges for key in attr))
+    for key in keys:
+        encoded = _encode_attribute([attr.get(key) for s, t, attr in edges],
+                                    node_index)
+        kinds[key] = str(encoded.pop('kind'))
+        for part, array in encoded.iteritems():
+            arrays['attr.%s.%s' % (key, part)] = array
+    for name, array in arrays.iteritems():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    meta = {'format_version': SNAPSHOT_FORMAT_VERSION,
+            'graph_class': type(g).__name__,
+            'attributes': kinds,
+            'instance': _instance_attributes(g)}
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+class _SnapshotAdjacency(collections.Mapping):
+
+    """Read-only mapping from nodes to their neighbors' edge data.
+
+    Serves as the succ, pred, and adj attributes of GraphSnapshot; the
+    dict for a node is decoded when it is looked up.
+    """
+
+    def __init__(self, snapshot, reverse=False):
+        self._snapshot = snapshot
+        self._reverse = reverse
+
+    def __getitem__(self, node):
+        if not self._snapshot.has_node(node):
+            raise KeyError(node)
+        return self._snapshot._neighbors(node, self._reverse)
+
+    def __iter__(self):
+        return iter(self._snapshot.nodes())
+
+    def __len__(self):
+        return self._snapshot.number_of_nodes()
+
+    def __contains__(self, node):
+        return self._snapshot.has_node(node)
+
+
+class GraphSnapshot(object):
+
+    """Read-only, NetworkX-like view of a snapshot from write_snapshot.
+
+    Arrays are opened with numpy.memmap, so opening is nearly
+    instantaneous and processes reading the same snapshot share one
+    page-cached copy.  Edge attributes are decoded only when requested.
+
+    The view supports the read-only part of the DiGraph interface (nodes,
+    edges, succ, pred, adj, successors, predecessors, degrees, has_edge,
+    g[u][v], and so on), so it can be passed to NetworkX algorithms and
+    to the functions in cocotools.stats.  to_scipy_sparse_matrix returns
+    the adjacency matrix without copying the index arrays, and to_graph
+    returns a modifiable copy.
+
+    Parameters
+    ----------
+    directory : string
+      Directory written by write_snapshot.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['format_version'] not in _READABLE_VERSIONS:
+            raise ValueError('Unsupported snapshot format version: %d' %
+                             meta['format_version'])
+        self.directory = directory
+        self.graph_class = str(meta['graph_class'])
+        self._instance = meta.get('instance', {})
+        self._kinds = dict((str(key), str(kind)) for key, kind in
+                           meta['attributes'].iteritems())
+        self._files = set(os.listdir(directory))
+        self._arrays = {}
+        self._tables = {}
+        self._nodes = None
+        self._node_index = None
+        self.graph = {}
+        self.succ = self.adj = _SnapshotAdjacency(self)
+        self.pred = _SnapshotAdjacency(self, reverse=True)
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(
+                os.path.join(self.directory, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def _optional_array(self, name):
+        """Return the array called name, or None if there is none."""
+        if name + '.npy' in self._files:
+            return self._array(name)
+
+    def _strings(self, name):
+        return _decode_strings(self._array(name),
+                               self._optional_array(name + '_unicode'))
+
+    def _index(self, node):
+        if self._node_index is None:
+            self._node_index = dict(zip(self.nodes(),
+                                        range(self.number_of_nodes())))
+        try:
+            return self._node_index[node]
+        except KeyError:
+            raise nx.NetworkXError('The node %s is not in the graph.' % node)
+
+    def is_directed(self):
+        return True
+
+    def is_multigraph(self):
+        return False
+
+    def nodes(self, data=False):
+        if self._nodes is None:
+            self._nodes = self._strings('nodes')
+        if data:
+            return [(node, {}) for node in self._nodes]
+        return list(self._nodes)
+
+    def nodes_iter(self, data=False):
+        return iter(self.nodes(data))
+
+    @property
+    def node(self):
+        """Node attribute dicts, which are always empty."""
+        return dict((node, {}) for node in self.nodes())
+
+    def nbunch_iter(self, nbunch=None):
+        """Return an iterator over the nodes in nbunch that are in g.
+
+        As in NetworkX, nbunch may be None (all nodes), a single node, or
+        an iterable of nodes.
+        """
+        if nbunch is None:
+            return self.nodes_iter()
+        if self.has_node(nbunch):
+            return iter([nbunch])
+        return (node for node in nbunch if self.has_node(node))
+
+    def number_of_nodes(self):
+        return len(self._array('nodes'))
+
+    __len__ = number_of_nodes
+
+    def __iter__(self):
+        return iter(self.nodes())
+
+    def has_node(self, node):
+        try:
+            self._index(node)
+        except (nx.NetworkXError, TypeError):
+            return False
+        return True
+
+    __contains__ = has_node
+
+    def number_of_edges(self):
+        return len(self._array('indices'))
+
+    def _out_slice(self, i):
+        indptr = self._array('indptr')
+        return slice(int(indptr[i]), int(indptr[i+1]))
+
+    def _in_slice(self, i):
+        indptr = self._array('in_indptr')
+        return slice(int(indptr[i]), int(indptr[i+1]))
+
+    def successors(self, node):
+        nodes = self.nodes()
+        indices = self._array('indices')[self._out_slice(self._index(node))]
+        return [nodes[j] for j in indices.tolist()]
+
+    neighbors = successors
+
+    def successors_iter(self, node):
+        return iter(self.successors(node))
+
+    neighbors_iter = successors_iter
+
+    def predecessors(self, node):
+        nodes = self.nodes()
+        i = self._index(node)
+        indices = self._array('in_indices')[self._in_slice(i)]
+        return [nodes[j] for j in indices.tolist()]
+
+    def predecessors_iter(self, node):
+        return iter(self.predecessors(node))
+
+    def _edge_positions(self, node, reverse=False):
+        """Return the neighbors of node and the CSR positions of its edges.
+
+        Successors are returned, or predecessors if reverse is True.
+        """
+        i = self._index(node)
+        if reverse:
+            in_slice = self._in_slice(i)
+            return (self._array('in_indices')[in_slice].tolist(),
+                    self._array('in_edges')[in_slice].tolist())
+        out = self._out_slice(i)
+        return (self._array('indices')[out].tolist(),
+                range(out.start, out.stop))
+
+    def _neighbors(self, node, reverse=False):
+        """Return dict mapping neighbors of node to edge attributes."""
+        nodes = self.nodes()
+        neighbors, positions = self._edge_positions(node, reverse)
+        return dict((nodes[j], self._edge_attr(position)) for j, position in
+                    zip(neighbors, positions))
+
+    def _edge_position(self, source, target):
+        """Return the CSR position of the edge, or None if absent."""
+        if not (self.has_node(source) and self.has_node(target)):
+            return None
+        out = self._out_slice(self._index(source))
+        indices = self._array('indices')[out]
+        j = self._index(target)
+        k = int(np.searchsorted(indices, j))
+        if k < len(indices) and indices[k] == j:
+            return out.start + k
+        return None
+
+    def has_edge(self, source, target):
+        return self._edge_position(source, target) is not None
+
+    has_successor = has_edge
+
+    def has_predecessor(self, node, predecessor):
+        return self.has_edge(predecessor, node)
+
+    def _edge_attr(self, position):
+        attr = {}
+        for key, kind in self._kinds.iteritems():
+            prefix = 'attr.%s.' % key
+            if (prefix + 'present.npy' in self._files and
+                not self._array(prefix + 'present')[position]):
+                continue
+            if kind == 'str':
+                if key not in self._tables:
+                    self._tables[key] = self._strings(prefix + 'table')
+                code = self._array(prefix + 'codes')[position]
+                attr[key] = self._tables[key][code]
+            elif kind == 'num':
+                attr[key] = self._array(prefix + 'values')[position].item()
+                if prefix + 'types.npy' in self._files:
+                    attr[key] = _exact_number(
+                        attr[key], self._array(prefix + 'types')[position],
+                        self._array(prefix + 'ints')[position].item())
+            else:
+                offsets = self._array(prefix + 'offsets')
+                flat = self._array(prefix + 'flat')
+                path = flat[offsets[position]:offsets[position+1]]
+                nodes = self.nodes()
+                attr[key] = [nodes[j] for j in path.tolist()]
+        return attr
+
+    def get_edge_data(self, source, target, default=None):
+        position = self._edge_position(source, target)
+        if position is None:
+            return default
+        return self._edge_attr(position)
+
+    def __getitem__(self, node):
+        return self._neighbors(node)
+
+    def adjacency_iter(self):
+        for node in self.nodes():
+            yield node, self._neighbors(node)
+
+    def _edges_iter(self, nbunch, data, reverse):
+        nodes = self.nodes()
+        for node in self.nbunch_iter(nbunch):
+            for j, position in zip(*self._edge_positions(node, reverse)):
+                edge = (nodes[j], node) if reverse else (node, nodes[j])
+                if data:
+                    yield edge + (self._edge_attr(position),)
+                else:
+                    yield edge
+
+    def edges_iter(self, nbunch=None, data=False):
+        return self._edges_iter(nbunch, data, False)
+
+    def edges(self, nbunch=None, data=False):
+        return list(self.edges_iter(nbunch, data))
+
+    def in_edges_iter(self, nbunch=None, data=False):
+        return self._edges_iter(nbunch, data, True)
+
+    def in_edges(self, nbunch=None, data=False):
+        return list(self.in_edges_iter(nbunch, data))
+
+    def selfloop_edges(self, data=False):
+        sources = np.repeat(np.arange(self.number_of_nodes()),
+                            np.diff(self._array('indptr')))
+        positions = np.nonzero(sources == self._array('indices'))[0]
+        nodes = self.nodes()
+        if data:
+            return [(nodes[sources[k]], nodes[sources[k]],
+                     self._edge_attr(k)) for k in positions.tolist()]
+        return [(nodes[sources[k]], nodes[sources[k]]) for k in
+                positions.tolist()]
+
+    def number_of_selfloops(self):
+        return len(self.selfloop_edges())
+
+    def _weights(self, positions, weight):
+        """Return the weights of the edges at positions as an array.
+
+        Edges without a numerical weight attribute have weight 1.
+        """
+        positions = np.asarray(positions, dtype=int)
+        if self._kinds.get(weight) != 'num':
+            return np.ones(len(positions))
+        prefix = 'attr.%s.' % weight
+        weights = self._array(prefix + 'values')[positions].astype(float)
+        if prefix + 'present.npy' in self._files:
+            present = self._array(prefix + 'present')[positions]
+            weights = np.where(present, weights, 1)
+        return weights
+
+    def _degree_iter(self, nbunch, weight, directions):
+        for node in self.nbunch_iter(nbunch):
+            degree = 0
+            for reverse in directions:
+                positions = self._edge_positions(node, reverse)[1]
+                if weight is None:
+                    degree += len(positions)
+                else:
+                    degree += float(self._weights(positions, weight).sum())
+            yield node, degree
+
+    def out_degree_iter(self, nbunch=None, weight=None):
+        return self._degree_iter(nbunch, weight, (False,))
+
+    def in_degree_iter(self, nbunch=None, weight=None):
+        return self._degree_iter(nbunch, weight, (True,))
+
+    def degree_iter(self, nbunch=None, weight=None):
+        return self._degree_iter(nbunch, weight, (False, True))
+
+    def _degree(self, degree_iter, nbunch):
+        if self.has_node(nbunch):
+            return next(degree_iter)[1]
+        return dict(degree_iter)
+
+    def out_degree(self, nbunch=None, weight=None):
+        return self._degree(self.out_degree_iter(nbunch, weight), nbunch)
+
+    def in_degree(self, nbunch=None, weight=None):
+        return self._degree(self.in_degree_iter(nbunch, weight), nbunch)
+
+    def degree(self, nbunch=None, weight=None):
+        return self._degree(self.degree_iter(nbunch, weight), nbunch)
+
+    def size(self, weight=None):
+        if weight is None:
+            return self.number_of_edges()
+        return float(self._weights(np.arange(self.number_of_edges()),
+                                   weight).sum())
+
+    def to_scipy_sparse_matrix(self):
+        """Return the binary adjacency matrix in CSR format.
+
+        The index arrays are the memory-mapped ones; rows and columns
+        follow self.nodes().
+        """
+        n = self.number_of_nodes()
+        indices = self._array('indices')
+        return scipy.sparse.csr_matrix((np.ones(len(indices)), indices,
+                                        self._array('indptr')),
+                                       shape=(n, n), copy=False)
+
+    def to_graph(self):
+        """Return the snapshot as a graph of its original class."""
+        nodes = self.nodes()
+        indptr = self._array('indptr')
+        sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+        encoded = {}
+        for key, kind in self._kinds.iteritems():
+            prefix = 'attr.%s.' % key
+            encoded[key] = {'kind': np.array(kind)}
+            for name in self._files:
+                if name.startswith(prefix):
+                    part = name[len(prefix):-len('.npy')]
+                    encoded[key][part] = self._array(prefix + part)
+        attrs = _decode_edge_attributes(encoded, nodes,
+                                        self.number_of_edges())
+        return _restore_graph(self.graph_class, nodes, sources,
+                              self._array('indices'), attrs, self._instance)
+
+
+class EdgeCSVWriter(object):
+
+    """Sink that writes edges to a CSV file as they are received.
+
+    Each row has the format: source,target,edge attributes.  This is the
+    format of the EndGraph CSV files in the graphs directory.  Instances
+    can be passed as the sink to EndGraph.add_translated_edges.
+
+    Parameters
+    ----------
+    file_path : string
+      Full specification of the CSV file's name, relative to the current
+      directory.
+    """
+
+    def __init__(self, file_path):
+        self._file = open(file_path, 'wb')
+        self._writer = csv.writer(self._file)
+        self.n_edges = 0
+
+    def write_edge(self, source, target, attr):
+        """Write one edge to the file."""
+        self._writer.writerow([source, target, attr])
+        self.n_edges += 1
+
+    def close(self):
+        """Flush and close the file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CoordinateIndex(object):
+
+    """Coordinates from a coordinate file, indexed by region.
+
+    The file is read once into an array; lookups for any graph and any
+    two dimensions are then dict and array operations.  Use
+    get_coord_index to share one index per file.
+
+    Parameters
+    ----------
+    coord_file : .tsv or .csv file
+      File must be organized like those stored in cocotools/coords.
+
+    Attributes
+    ----------
+    labels : list
+      Regions, in uppercase, in file order.
+
+    coords : 2D array
+      X, Y, and Z coordinates of the regions, one row per label.
+    """
+
+    def __init__(self, coord_file):
+        file_extension = splitext(coord_file)[1]
+        if file_extension == '.tsv':
+            delimiter = '\t'
+        elif file_extension == '.csv':
+            delimiter = ','
+        else:
+            raise ValueError('Unrecognized file type.')
+        self.labels = []
+        self.row = {}
+        coords = []
+        with open(coord_file) as f:
+            for row in csv.reader(f, delimiter=delimiter):
+                if not row or row[0][0] == '#':
+                    continue
+                f_node, color, x, y, z = row
+                try:
+                    xyz = (float(x), float(y), float(z))
+                except ValueError:
+                    # Column labels.
+                    continue
+                # We're enforcing that graphs have nodes in all
+                # uppercase.  Eventually nodes in the coordinate files
+                # should also be made all uppercase.
+                f_node = f_node.upper()
+                # The first entry for a region is the one used.
+                if f_node not in self.row:
+                    self.row[f_node] = len(self.labels)
+                    self.labels.append(f_node)
+                    coords.append(xyz)
+        self.coords = np.array(coords).reshape(-1, 3)
+
+    def lookup(self, nodes, dim='XY'):
+        """Return dict mapping nodes to coordinates and nodes not found.
+
+        Parameters
+        ----------
+        nodes : list
+
+        dim : string (optional)
+          Desired two dimensions: 'XY', 'XZ', or 'YZ'.
+
+        Returns
+        -------
+        coord_dict : dict
+          Maps each node found to a list of its two coordinates.
+
+        leftovers : list
+          Nodes not in the file, in the order given.
+        """
+        columns = ['XYZ'.index(dim[0]), 'XYZ'.index(dim[1])]
+        found = [node for node in nodes if node in self.row]
+        rows = [self.row[node] for node in found]
+        coords = self.coords[rows][:, columns].tolist()
+        leftovers = [node for node in nodes if node not in self.row]
+        return dict(zip(found, coords)), leftovers
+
+
+_COORD_INDEXES = {}
+
+
+def get_coord_index(coord_file):
+    """Return the CoordinateIndex for coord_file, reading it only once.
+
+    The index is cached by path and is rebuilt if the file is modified.
+    """
+    path = os.path.abspath(coord_file)
+    mtime = os.path.getmtime(path)
+    cached = _COORD_INDEXES.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, CoordinateIndex(coord_file))
+        _COORD_INDEXES[path] = cached
+    return cached[1]
+
+
 def get_coord_dict(g, coord_file, dim='XY'):
     """Return dict mapping regions in g to coordinates in coord_file.
 
@@ -79,35 +937,9 @@ def get_coord_dict(g, coord_file, dim='XY'):
       Desired two dimensions from coord_file.  Must be formatted as two
       capitalized letters (e.g., 'XY').  X = left-right, Y =
       posterior-anterior, Z = inferior-superior.
-    """
-    coord_dict = {}
-    file_extension = splitext(coord_file)[1]
-    if file_extension == '.tsv':
-        delimiter = '\t'
-    elif file_extension == '.csv':
-        delimiter = ','
-    else:
-        raise ValueError('Unrecognized file type.')
-    coord_reader = csv.reader(open(coord_file), delimiter=delimiter)
-    g_nodes = g.nodes()
-    for row in coord_reader:
-        if row[0][0] == '#':
-            continue
-        f_node, color, x, y, z = row
-        # We're enforcing that graphs have nodes in all uppercase.
-        # Eventually nodes in the coordinate files should also be made
-        # all uppercase.
-        f_node = f_node.upper()
-        if f_node in g_nodes:
-            g_nodes.remove(f_node)
-            if dim[0] == 'X':
-                first_coord = float(x)
-            else:
-                first_coord = float(y)
-            if dim[1] == 'Y':
-                second_coord = float(y)
-            else:
-                second_coord = float(z)
-            coord_dict[f_node] = [first_coord, second_coord]
-    return coord_dict, g_nodes
 
+    Notes
+    -----
+    The file is read once per session (see get_coord_index).
+    """
+    return get_coord_index(coord_file).lookup(g.nodes(), dim)
@@ -6,13 +6,14 @@ import networkx as nx
 import numpy as np
 
 from congraph import ConGraph
+from utils import CaseIndexedGraph
 
 
 class MapGraphError(Exception):
     pass
 
 
-class MapGraph(nx.DiGraph):
+class MapGraph(CaseIndexedGraph, nx.DiGraph):
 
     """Subclass of the NetworkX DiGraph designed to hold CoCoMac Mapping data.
 
@@ -1098,6 +1099,10 @@ its own map.""" % node_x)
                 raise MapGraphError('%s is not a valid RC.' % rc)
             if not isinstance(pdc, int) and not 0 <= pdc <= 18:
                 raise MapGraphError('Supplied PDC is invalid.')
+            # Deduced edges (above) join nodes already in the graph, so
+            # only new data can bring new case variants.
+            self.case_index.add(source)
+            self.case_index.add(target)
             self._add_valid_edge(source, target, rc, pdc, [])
         
     def add_edges_from(self, edges):
@@ -1818,7 +1823,7 @@ its own map.""" % node_x)
           BrainSite in CoCoMac format.
         """
         self._check_nodes([node])
-        nx.DiGraph.add_node.im_func(self, node)
+        super(MapGraph, self).add_node(node)
 
     def add_nodes_from(self, nodes):
         """Add nodes to the graph.
@@ -1841,5 +1846,6 @@ its own map.""" % node_x)
         If any one of the nodes supplied is in an incorrect format, none of
         the nodes are added to the graph.
         """
+        nodes = list(nodes)
         self._check_nodes(nodes)
-        nx.DiGraph.add_nodes_from.im_func(self, nodes)
+        super(MapGraph, self).add_nodes_from(nodes)
@@ -1,104 +1,212 @@
-import copy
-import pickle
+import cPickle
+import gzip
+import hashlib
+import os
+
+import networkx as nx
 
 import cocotools as coco
+from iotools import save_graph, load_graph
 
 # Hello Fernando!
 
-def run_ort(target_map):
-    # con_edges.pck
-    response = raw_input('Acquire connectivity edges or use saved ones (a/s)? ')
-    if response == 'a':
-        subset = coco.CONNECTIVITY_SOURCES
-        for brain_map in coco.CONNECTIVITY_TIMEOUTS:
-            subset.remove(brain_map)
-        con_edges, con_failures = coco.multi_map_ebunch('Connectivity', subset)
-        assert(len(con_failures) == 0)
-        with open('results/post_sfn_revisions/con_edges.pck', 'w') as f:
-            pickle.dump(con_edges, f)
-    elif response == 's':
-        with open('results/post_sfn_revisions/con_edges.pck') as f:
-            con_edges = pickle.load(f)
-
-    # cong1.pck
-    response = raw_input('Build new ConGraph or use old one (n/o)? ')
-    if response == 'n':
+# Increment to invalidate cached stages after changing the steps of the
+# pipeline (e.g., the cleaning rules in MapGraph.clean_data).
+PIPELINE_VERSION = 1
+
+
+class StageCache(object):
+
+    """Content-addressed store for the outputs of pipeline stages.
+
+    Each output is filed under a key that is a hash of the stage name and
+    the stage's inputs, so an output is reused exactly when the inputs
+    are unchanged.  Graphs are stored with iotools.save_graph; other
+    values (e.g., ebunches) are stored as gzipped pickles.
+
+    Parameters
+    ----------
+    directory : string
+      Directory holding the cached outputs; it is created if necessary.
+
+    Attributes
+    ----------
+    reused, computed : lists
+      Stages whose outputs were loaded from or added to the cache.
+    """
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.reused = []
+        self.computed = []
+
+    def key(self, stage, inputs):
+        """Return the key for stage given its inputs.
+
+        Parameters
+        ----------
+        stage : string
+          Name of the stage.
+
+        inputs : object
+          Anything with a deterministic repr (e.g., sorted lists of
+          strings, or keys of upstream stages).
+        """
+        content = repr((PIPELINE_VERSION, stage, inputs))
+        return hashlib.sha1(content).hexdigest()
+
+    def _path(self, stage, key, extension):
+        return os.path.join(self.directory,
+                            '%s-%s%s' % (stage, key, extension))
+
+    def load(self, stage, key):
+        """Return the cached output of stage; raise KeyError if absent."""
+        graph_path = self._path(stage, key, '.npz')
+        if os.path.exists(graph_path):
+            value = load_graph(graph_path)
+        else:
+            try:
+                f = gzip.open(self._path(stage, key, '.pck.gz'), 'rb')
+            except IOError:
+                raise KeyError(stage)
+            with f:
+                value = cPickle.load(f)
+        self.reused.append(stage)
+        return value
+
+    def store(self, stage, key, value):
+        """Add the output of stage to the cache."""
+        if isinstance(value, nx.DiGraph):
+            save_graph(value, self._path(stage, key, '.npz'))
+        else:
+            with gzip.open(self._path(stage, key, '.pck.gz'), 'wb') as f:
+                cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+        self.computed.append(stage)
+
+
+def _acquire_edges(search_type, sources):
+    ebunch, failures = coco.multi_map_ebunch(search_type, sources)
+    if failures:
+        raise ValueError('%s queries failed for %s' % (search_type,
+                                                       ', '.join(failures)))
+    return ebunch
+
+
+def run_ort(target_map, method='modified', cache='results/ort_cache',
+            con_sources=None, map_sources=None, resolution_map='PHT00'):
+    """Run the ORT pipeline, reusing stages whose inputs are unchanged.
+
+    The stages are: acquiring connectivity and mapping edges, building
+    the ConGraph and MapGraph, cleaning the MapGraph, keeping one level
+    of resolution, deducing edges, and translating to target_map.  A
+    stage's key is a hash of its parameters and of the keys of the stages
+    it depends on, so only the stages downstream of a changed input are
+    recomputed, and stages upstream of a cached one are not loaded.
+
+    Parameters
+    ----------
+    target_map : string
+      BrainMap to which edges are translated.
+
+    method : string (optional)
+      AT method to be used: 'original' (that of Stephan & Kotter) or
+      'modified'.
+
+    cache : StageCache or string (optional)
+      StageCache, or directory for a new one.
+
+    con_sources, map_sources : lists (optional)
+      BrainMaps to query for Connectivity and Mapping data.  Defaults are
+      the sources that do not time out.
+
+    resolution_map : string (optional)
+      Map passed to MapGraph.keep_only_one_level_of_resolution.
+
+    Returns
+    -------
+    endg : EndGraph
+    """
+    if con_sources is None:
+        con_sources = [bmap for bmap in coco.CONNECTIVITY_SOURCES if
+                       bmap not in coco.CONNECTIVITY_TIMEOUTS]
+    if map_sources is None:
+        map_sources = [bmap for bmap in coco.MAPPING_SOURCES if
+                       bmap not in coco.MAPPING_TIMEOUTS]
+    if not isinstance(cache, StageCache):
+        cache = StageCache(cache)
+    keys = {}
+    keys['con_edges'] = cache.key('con_edges', sorted(con_sources))
+    keys['cong1'] = cache.key('cong1', keys['con_edges'])
+    keys['map_edges'] = cache.key('map_edges', sorted(map_sources))
+    keys['mapg1'] = cache.key('mapg1', keys['map_edges'])
+    keys['mapg2'] = cache.key('mapg2', keys['mapg1'])
+    one_level_inputs = (keys['mapg2'], keys['cong1'], resolution_map)
+    keys['mapg3'] = cache.key('mapg3', one_level_inputs)
+    keys['cong2'] = cache.key('cong2', one_level_inputs)
+    keys['mapg4'] = cache.key('mapg4', keys['mapg3'])
+    keys['endg'] = cache.key('endg', (keys['mapg4'], keys['cong2'],
+                                      target_map, method))
+
+    def build_cong1():
         cong = coco.ConGraph()
-        cong.add_edges_from(con_edges)
-        with open('results/post_sfn_revisions/cong1.pck', 'w') as f:
-            pickle.dump(cong, f)
-    elif response == 'o':
-        with open('results/post_sfn_revisions/cong1.pck') as f:
-            cong = pickle.load(f)
-
-    # map_edges.pck
-    response = raw_input('Acquire mapping edges or use saved ones (a/s)? ')
-    if response == 'a':
-        subset = coco.MAPPING_SOURCES
-        for brain_map in coco.MAPPING_TIMEOUTS:
-            subset.remove(brain_map)
-        map_edges, map_failures = coco.multi_map_ebunch('Mapping', subset)
-        assert(len(map_failures) == 0)
-        with open('results/post_sfn_revisions/map_edges.pck', 'w') as f:
-            pickle.dump(map_edges, f)
-    elif response == 's':
-        with open('results/post_sfn_revisions/map_edges.pck') as f:
-            map_edges = pickle.load(f)
-
-    # mapg1.pck
-    response = raw_input('Build new MapGraph or use old one (n/o)? ')
-    if response == 'n':
+        cong.add_edges_from(get('con_edges'))
+        return cong
+
+    def build_mapg1():
         mapg = coco.MapGraph()
-        mapg.add_edges_from(map_edges)
-        with open('results/post_sfn_revisions/mapg1.pck', 'w') as f:
-            pickle.dump(mapg, f)
-    elif response == 'o':
-        with open('results/post_sfn_revisions/mapg1.pck') as f:
-            mapg = pickle.load(f)
-
-    # mapg2.pck
-    response = raw_input('Has clean_data already been called (y/n)? ')
-    if response == 'n':
+        mapg.add_edges_from(get('map_edges'))
+        return mapg
+
+    def build_mapg2():
+        mapg = get('mapg1')
         mapg.clean_data()
-        with open('results/post_sfn_revisions/mapg2.pck', 'w') as f:
-            pickle.dump(mapg, f)
-    elif response == 'y':
-        with open('results/post_sfn_revisions/mapg2.pck') as f:
-            mapg = pickle.load(f)
-
-    # mapg3.pck and cong2.pck
-    response = raw_input('Have hierarchies been removed (y/n)? ')
-    if response == 'n':
-        post_clean = copy.deepcopy(mapg)
-        cong = mapg.keep_only_one_level_of_resolution(cong, 'PHT00')
-        with open('results/post_sfn_revisions/mapg3.pck', 'w') as f:
-            pickle.dump(mapg, f)
-        with open('results/post_sfn_revisions/cong2.pck', 'w') as f:
-            pickle.dump(cong, f)
-    elif response == 'y':
-        with open('results/post_sfn_revisions/mapg3.pck') as f:
-            mapg = pickle.load(f)
-        with open('results/post_sfn_revisions/cong2.pck') as f:
-            cong = pickle.load(f)
-
-    # mapg4.pck
-    response = raw_input('Has deduce_edges already been called (y/n)? ')
-    if response == 'n':
+        return mapg
+
+    def build_one_level():
+        mapg = get('mapg2')
+        cong = mapg.keep_only_one_level_of_resolution(get('cong1'),
+                                                      resolution_map)
+        # Both outputs come from one call, so both are stored here.
+        for stage, value in (('mapg3', mapg), ('cong2', cong)):
+            if stage not in values:
+                cache.store(stage, keys[stage], value)
+                values[stage] = value
+        return values
+
+    def build_mapg4():
+        mapg = get('mapg3')
         mapg.deduce_edges()
-        with open('results/post_sfn_revisions/mapg4.pck', 'w') as f:
-            pickle.dump(mapg, f)
-    elif response == 'y':
-        with open('results/post_sfn_revisions/mapg4.pck') as f:
-            mapg = pickle.load(f)
-
-    # endg.pck
-    response = raw_input('Make new EndGraph (y/n)? ')
-    if response == 'y':
+        return mapg
+
+    def build_endg():
         endg = coco.EndGraph()
-        endg.add_translated_edges(mapg, cong, target_map)
-        with open('results/post_sfn_revisions/endg%s.pck' % target_map,
-                  'w') as f:
-            pickle.dump(endg, f)
-    elif response == 'n':
-        with open('results/post_sfn_revisions/endg%s.pck' % target_map) as f:
-            endg = pickle.load(f)
+        endg.add_translated_edges(get('mapg4'), get('cong2'), target_map,
+                                  method)
+        return endg
+
+    builders = {'con_edges': lambda: _acquire_edges('Connectivity',
+                                                    con_sources),
+                'cong1': build_cong1,
+                'map_edges': lambda: _acquire_edges('Mapping', map_sources),
+                'mapg1': build_mapg1,
+                'mapg2': build_mapg2,
+                'mapg3': build_one_level,
+                'cong2': build_one_level,
+                'mapg4': build_mapg4,
+                'endg': build_endg}
+    values = {}
+
+    def get(stage):
+        if stage not in values:
+            try:
+                values[stage] = cache.load(stage, keys[stage])
+            except KeyError:
+                value = builders[stage]()
+                if stage not in values:
+                    cache.store(stage, keys[stage], value)
+                    values[stage] = value
+        return values[stage]
+
+    return get('endg')
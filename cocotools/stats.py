@@ -1,12 +1,21 @@
 from __future__ import division, print_function
-import copy
+import collections
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
 
 import numpy as np
 import scipy.io
+import scipy.sparse
+import scipy.sparse.csgraph
 import networkx as nx
 
+from endgraph import EndGraph, EdgeColumns
 
-def random_stats_NX(g, n):
+
+def random_stats_NX(g, n, seed=None, processes=1, checkpoint=None):
     """Return mean and SD clustering and char. path length for random graphs.
 
     Parameters
@@ -15,6 +24,9 @@ def random_stats_NX(g, n):
 
     n : number of random graphs to generate
 
+    seed, processes, checkpoint : optional
+      See null_model_stats.
+
     Returns
     -------
     clusts
@@ -25,19 +37,346 @@ def random_stats_NX(g, n):
     The random graphs created are pseudo-graphs in that parallel edges and
     self-loops are allowed.
     """
-    clusts = []
-    charpaths = []
-    in_seq = g.in_degree().values()
-    out_seq = g.out_degree().values()
-    for i in range(n):
-        r = nx.directed_configuration_model(in_seq, out_seq,
-                                            create_using=nx.DiGraph())
-        clusts.append(directed_clustering(r))
-        charpaths.append(directed_char_path_length(r))
-    return clusts, charpaths
+    return null_model_stats(g, n, 'configuration', seed, processes,
+                            checkpoint)
+
+
+def _surrogate_random_state(root_seed, index):
+    """Return the RandomState for surrogate number index.
+
+    The stream depends only on root_seed and index, so results do not
+    depend on how surrogates are spread across processes.
+    """
+    return np.random.RandomState([root_seed, index])
+
+
+def _surrogate_metrics(data, model, root_seed, index):
+    """Make one surrogate graph and return its index and metrics.
+
+    data is the adjacency matrix of the original graph or, for the
+    configuration model, its in- and out-degree sequences.
+    """
+    random_state = _surrogate_random_state(root_seed, index)
+    if model == 'random':
+        r = nx.DiGraph(randmio_dir(data, random_state=random_state))
+    elif model == 'lattice':
+        r = nx.DiGraph(latmio_dir(data, random_state=random_state))
+    else:
+        in_seq, out_seq = data
+        r = nx.directed_configuration_model(
+            in_seq, out_seq, create_using=nx.DiGraph(),
+            seed=random_state.randint(2**31 - 1))
+    return index, directed_clustering(r), directed_char_path_length(r)
+
+
+# Data for _surrogate_metrics, set once in each worker process.
+_worker_data = None
+
+
+def _init_surrogate_worker(data):
+    """Pool initializer that gives a worker the data for its tasks."""
+    global _worker_data
+    _worker_data = data
+
+
+def _null_model_surrogate(args):
+    """Call _surrogate_metrics in a worker process."""
+    model, root_seed, index = args
+    return _surrogate_metrics(_worker_data, model, root_seed, index)
+
+
+def _iter_surrogates(data, model, root_seed, indices, processes):
+    """Yield the results of _surrogate_metrics for each of indices.
+
+    Results are yielded in the order of indices.  With more than one
+    process, data are sent to each worker once, when the pool starts,
+    and only about two tasks per worker are queued at a time, so a
+    consumer that stops early leaves little work behind.
+
+    Called by null_model_stats and _stream_null_model.
+    """
+    if processes <= 1 or len(indices) <= 1:
+        for index in indices:
+            yield _surrogate_metrics(data, model, root_seed, index)
+        return
+    pool = multiprocessing.Pool(processes, _init_surrogate_worker, (data,))
+    try:
+        tasks = iter(indices)
+        pending = collections.deque()
+        for index in itertools.islice(tasks, 2 * processes):
+            pending.append(pool.apply_async(_null_model_surrogate,
+                                            ((model, root_seed, index),)))
+        while pending:
+            result = pending.popleft().get()
+            for index in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(
+                        _null_model_surrogate, ((model, root_seed, index),)))
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _graph_fingerprint(g):
+    """Return the number of nodes and edges of g and a hash of its edges.
+
+    Written to null_model_stats checkpoints, so that results for one
+    graph are not resumed for another.
+    """
+    digest = hashlib.sha1(repr(sorted(g.edges()))).hexdigest()
+    return 'nodes=%d edges=%d hash=%s' % (g.number_of_nodes(),
+                                          g.number_of_edges(), digest)
+
+
+def _read_checkpoint(checkpoint, header):
+    """Return results saved in checkpoint, keyed by surrogate index.
+
+    Called by null_model_stats.
+    """
+    results = {}
+    if not os.path.exists(checkpoint):
+        return results
+    with open(checkpoint) as f:
+        if f.readline() != header:
+            raise ValueError('%s was written for a different graph, null '
+                             'model, or seed' % checkpoint)
+        for line in f:
+            index, clust, charpath = line.split()
+            results[int(index)] = (float(clust), float(charpath))
+    return results
+
+
+def null_model_stats(g, n, model='random', seed=None, processes=None,
+                     checkpoint=None):
+    """Return clustering coeffs and char. path lengths for null models.
+
+    Surrogate graphs are generated independently, optionally spread
+    across a pool of processes.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph
+
+    n : int
+      Number of surrogate graphs to generate.
+
+    model : string (optional)
+      'random' (randmio_dir), 'lattice' (latmio_dir), or 'configuration'
+      (NetworkX's directed configuration model).
+
+    seed : int (optional)
+      Root seed.  Surrogate i uses a random stream derived from seed and
+      i, so results are reproducible regardless of processes.  If None,
+      a root seed is drawn from numpy's global random state.
+
+    processes : int (optional)
+      Number of worker processes.  Defaults to the number of CPUs; 1
+      runs everything in this process.
+
+    checkpoint : string (optional)
+      Path of a text file to which each finished surrogate is appended.
+      If the file exists, surrogates already in it are not recomputed.
+      If seed is None, the seed saved in the file is reused.  The file
+      header also records the model and a fingerprint of g (see
+      _graph_fingerprint); a ValueError is raised if they do not match.
+
+    Returns
+    -------
+    clust_coeffs : list
+
+    char_paths : list
+      Both lists are ordered by surrogate index.
+    """
+    if model not in ('random', 'lattice', 'configuration'):
+        raise ValueError('invalid model')
+    if seed is None and checkpoint is not None and \
+            os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            seed = int(f.readline().split()[2].split('=')[1])
+    if seed is None:
+        seed = np.random.randint(2**31 - 1)
+    if model == 'configuration':
+        data = (g.in_degree().values(), g.out_degree().values())
+    else:
+        data = np.array(nx.adjacency_matrix(g))
+    results = {}
+    if checkpoint is not None:
+        header = '# model=%s seed=%d %s\n' % (model, seed,
+                                             _graph_fingerprint(g))
+        results = _read_checkpoint(checkpoint, header)
+        if not results:
+            with open(checkpoint, 'w') as f:
+                f.write(header)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    for index, clust, charpath in _iter_surrogates(
+            data, model, seed, [i for i in range(n) if i not in results],
+            processes):
+        results[index] = (clust, charpath)
+        if checkpoint is not None:
+            with open(checkpoint, 'a') as f:
+                f.write('%d %r %r\n' % (index, clust, charpath))
+    clust_coeffs = [results[i][0] for i in range(n)]
+    char_paths = [results[i][1] for i in range(n)]
+    return clust_coeffs, char_paths
+
+
+def _edge_index_stream(K, random_state, batch_size=4096):
+    """Yield random edge indices in [0, K), drawn in batches.
+
+    Called by _rewire.
+    """
+    while True:
+        for e in random_state.randint(0, K, batch_size).tolist():
+            yield e
+
+
+def _rewire(A, n_iter, D=None, random_state=None):
+    """Perform Maslov-Sneppen edge swaps on a directed adjacency matrix.
+
+    Called by randmio_dir and latmio_dir.
+
+    Parameters
+    ----------
+    A : 2D array
+      Directed adjacency matrix; it is not modified.
+
+    n_iter : int
+      Each edge is rewired approximately n_iter times.
+
+    D : 2D array (optional)
+      If supplied, a swap is accepted only if it does not increase the
+      total D-weighted length of the two edges involved (latmio_dir).
+
+    random_state : numpy RandomState (optional)
+      Source of random numbers; numpy's global state is used if None.
+
+    Returns
+    -------
+    R : 2D array
+      Rewired adjacency matrix.
+
+    Notes
+    -----
+    Edges are kept in index lists, with a set of a*n+b codes for O(1)
+    existence checks, and random edge indices are drawn in batches.
+    """
+    if random_state is None:
+        random_state = np.random.mtrand._rand
+    A = np.asarray(A)
+    n = A.shape[0]
+    sources, targets = np.nonzero(A)
+    weights = A[sources, targets].tolist()
+    sources = sources.tolist()
+    targets = targets.tolist()
+    K = len(sources)
+    R = np.zeros(A.shape, dtype=A.dtype)
+    if K < 2:
+        R[:] = A
+        return R
+    existing = set([a*n + b for a, b in zip(sources, targets)])
+    if D is not None:
+        D = np.asarray(D).tolist()
+    max_attempts = round(n*K/(n*(n-1)))
+    draws = _edge_index_stream(K, random_state)
+    for iteration in range(K*n_iter):
+        att = 0
+        while att <= max_attempts:
+            while True:
+                e1 = next(draws)
+                e2 = next(draws)
+                while e1 == e2:
+                    e2 = next(draws)
+                a = sources[e1]
+                b = targets[e1]
+                c = sources[e2]
+                d = targets[e2]
+                if a != c and a != d and b != c and b != d:
+                    break
+            if not (a*n + d in existing or c*n + b in existing):
+                if D is None or (D[a][b]*weights[e1] + D[c][d]*weights[e2] >=
+                                 D[a][d]*weights[e1] + D[c][b]*weights[e2]):
+                    existing.difference_update([a*n + b, c*n + d])
+                    existing.update([a*n + d, c*n + b])
+                    targets[e1] = d
+                    targets[e2] = b
+                    break
+            att += 1
+    R[sources, targets] = weights
+    return R
+
+
+def _lattice_distances(n):
+    """Return the distance-to-diagonal matrix used by latmio_dir."""
+    D = np.zeros((n,n))
+    forwards = np.mod(range(1, n), n)
+    backwards = np.mod(range(n-1, 0, -1), n)
+    u = np.array([0] + [min(pair) for pair in zip(forwards, backwards)])
+    for v in range(1, int(np.ceil(n/2)+1)):
+        D[n-v,:] = np.append(u[v:], u[:v])
+        D[v-1,:] = D[n-v, range(n-1, -1, -1)]
+    return D
+
+
+def randmio_dir(A, n_iter=1, random_state=None):
+    """Return a randomized copy of a directed adjacency matrix.
+
+    In- and out-degrees are preserved.  This matches randmio_dir in the
+    Sporns Matlab toolbox.
+
+    Parameters
+    ----------
+    A : 2D array
+      Directed adjacency matrix; it is not modified.
 
+    n_iter : int (optional)
+      Each edge is rewired approximately n_iter times.
 
-def lattice_stats(g, n_latt):
+    random_state : numpy RandomState (optional)
+      Source of random numbers; numpy's global state is used if None.
+
+    Returns
+    -------
+    R : 2D array
+    """
+    return _rewire(A, n_iter, random_state=random_state)
+
+
+def latmio_dir(A, n_iter=50, random_state=None):
+    """Return a lattice-like copy of a directed adjacency matrix.
+
+    In- and out-degrees are preserved.  This matches latmio_dir in the
+    Sporns Matlab toolbox with default D.
+
+    Parameters
+    ----------
+    A : 2D array
+      Directed adjacency matrix; it is not modified.
+
+    n_iter : int (optional)
+      Each edge is rewired approximately n_iter times.
+
+    random_state : numpy RandomState (optional)
+      Source of random numbers; numpy's global state is used if None.
+
+    Returns
+    -------
+    R : 2D array
+    """
+    if random_state is None:
+        random_state = np.random.mtrand._rand
+    A = np.asarray(A)
+    n = A.shape[0]
+    # Randomly permute the nodes so that the lattice does not depend on
+    # their order, and reverse the permutation afterwards.
+    ind_rp = random_state.permutation(n)
+    R = A[ind_rp][:, ind_rp]
+    R = _rewire(R, n_iter, _lattice_distances(n), random_state)
+    ind_rp_reverse = np.argsort(ind_rp)
+    return R[ind_rp_reverse][:, ind_rp_reverse]
+
+
+def lattice_stats(g, n_latt, seed=None, processes=1, checkpoint=None):
     """Return clustering coeffs and char. path lengths for lattice graphs.
 
     Parameters
@@ -46,6 +385,9 @@ def lattice_stats(g, n_latt):
 
     n_latt : number of random graphs to generate
 
+    seed, processes, checkpoint : optional
+      See null_model_stats.
+
     Returns
     -------
     clust_coeffs
@@ -53,74 +395,13 @@ def lattice_stats(g, n_latt):
 
     Notes
     -----
-    This routine matches latmio_dir in the Sporns Matlab toolbox, with ITER
-    set to 1 and default D.
+    Lattices are made with latmio_dir.
     """
-    clust_coeffs = []
-    char_paths = []
-    A = np.array(nx.adjacency_matrix(g))
-    n = A.shape[0]
-    ind_rp = range(n)
-    for i in range(n_latt):
-        R = copy.deepcopy(A)
-        np.random.shuffle(ind_rp)
-        R = R[ind_rp]
-        R = R.transpose()
-        R = R[ind_rp]
-        R = R.transpose()
-        D = np.zeros((n,n))
-        forwards = np.mod(range(1, n), n)
-        backwards = np.mod(range(n-1, 0, -1), n)
-        u = np.array([0] + [min(pair) for pair in zip(forwards, backwards)])
-        for v in range(1, int(np.ceil(n/2)+1)):
-            D[n-v,:] = np.append(u[v:], u[:v])
-            D[v-1,:] = D[n-v, range(n-1, -1, -1)]
-        x_indices, y_indices = np.nonzero(R)
-        # For some reason x_indices and y_indices are unwriteable.
-        # Using copies of them enables writeability.
-        x_indices = np.copy(x_indices)
-        y_indices = np.copy(y_indices)
-        K = len(x_indices)
-        max_attempts = round(n*K/(n*(n-1)))
-        for iteration in range(K*50):
-            att = 0
-            while att <= max_attempts:
-                while True:
-                    r1, r2 = np.random.rand(2)
-                    e1 = np.floor(K*r1)
-                    e2 = np.floor(K*r2)
-                    while e1 == e2:
-                        e2 = np.floor(K*np.random.rand(1)[0])
-                    a = x_indices[e1]
-                    b = y_indices[e1]
-                    c = x_indices[e2]
-                    d = y_indices[e2]
-                    if a not in (c, d) and b not in (c, d):
-                        break
-                if not (R[a,d] or R[c,b]):
-                    if (D[a,b]*R[a,b]+D[c,d]*R[c,d]) >= (D[a,d]*R[a,b]+
-                                                         D[c,b]*R[c,d]):
-                        R[a,d] = R[a,b]
-                        R[a,b] = 0
-                        R[c,b] = R[c,d]
-                        R[c,d] = 0
-                        y_indices[e1] = d
-                        y_indices[e2] = b
-                        break
-                att += 1
-        # Need to reverse the random permutation here!
-        ind_rp_reverse = np.argsort(ind_rp)
-        Rlatt = R[ind_rp_reverse]
-        Rlatt = Rlatt.transpose()
-        Rlatt = Rlatt[ind_rp_reverse]
-        Rlatt = Rlatt.transpose()
-        r = nx.DiGraph(Rlatt)
-        clust_coeffs.append(directed_clustering(r))
-        char_paths.append(directed_char_path_length(r))
-    return clust_coeffs, char_paths
+    return null_model_stats(g, n_latt, 'lattice', seed, processes,
+                            checkpoint)
 
 
-def random_stats(g, n_rand):
+def random_stats(g, n_rand, seed=None, processes=1, checkpoint=None):
     """Return clustering coeffs and char. path lengths for random graphs.
 
     Parameters
@@ -129,6 +410,9 @@ def random_stats(g, n_rand):
 
     n_rand : number of random graphs to generate
 
+    seed, processes, checkpoint : optional
+      See null_model_stats.
+
     Returns
     -------
     clust_coeffs
@@ -136,95 +420,322 @@ def random_stats(g, n_rand):
 
     Notes
     -----
-    This routine matches randmio_dir in the Sporns Matlab toolbox, with ITER
-    set to 1.
+    Random graphs are made with randmio_dir.
     """
-    clust_coeffs = []
-    char_paths = []
-    A = np.array(nx.adjacency_matrix(g))
-    n = A.shape[0]
-    for i in range(n_rand):
-        x_indices, y_indices = np.nonzero(A)
-        # For some reason x_indices and y_indices are unwriteable.
-        # Using copies of them enables writeability.
-        x_indices = np.copy(x_indices)
-        y_indices = np.copy(y_indices)
-        R = copy.deepcopy(A)
-        K = len(x_indices)
-        max_attempts = round(n*K/(n*(n-1)))
-        for iteration in range(K):
-            att = 0
-            while att <= max_attempts:
-                while True:
-                    r1, r2 = np.random.rand(2)
-                    e1 = np.floor(K*r1)
-                    e2 = np.floor(K*r2)
-                    while e1 == e2:
-                        e2 = np.floor(K*np.random.rand(1)[0])
-                    a = x_indices[e1]
-                    b = y_indices[e1]
-                    c = x_indices[e2]
-                    d = y_indices[e2]
-                    if a not in (c, d) and b not in (c, d):
-                        break
-                if not (R[a,d] or R[c,b]):
-                    R[a,d] = R[a,b]
-                    R[a,b] = 0
-                    R[c,b] = R[c,d]
-                    R[c,d] = 0
-                    y_indices[e1] = d
-                    y_indices[e2] = b
-                    break
-                att += 1
-        r = nx.DiGraph(R)
-        clust_coeffs.append(directed_clustering(r))
-        char_paths.append(directed_char_path_length(r))
-    return clust_coeffs, char_paths
+    return null_model_stats(g, n_rand, 'random', seed, processes,
+                            checkpoint)
             
 
-def directed_char_path_length(g):
-    """Compute the char. path length for a DiGraph.
+class RunningStats(object):
+
+    """Running mean and variance of a stream of values (Welford's method).
+
+    Values are not stored, so memory use does not grow with the stream.
+    """
 
-    This matches charpath in the Sporns Matlab toolbox.
-    """
-    A = nx.adjacency_matrix(g)
-    # First get the distance matrix D.
-    D = np.eye(A.shape[0])
-    n = 1
-    n_path_matrix = copy.deepcopy(A) # We don't want to f with A.
-    n_path_array = np.array(n_path_matrix)
-    np.seterr(invalid='ignore')  # Don't warn about the n_path_array division.
-    L = np.nan_to_num(n_path_array / n_path_array)
-    np.seterr(invalid='warn')  # Return this setting to the default.
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def push(self, x):
+        """Add a value to the stream."""
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        """Sample variance; nan for fewer than two values."""
+        if self.n < 2:
+            return np.nan
+        return self._m2 / (self.n - 1)
+
+    @property
+    def std(self):
+        """Sample standard deviation."""
+        return np.sqrt(self.variance)
+
+    def ci_halfwidth(self, z=1.96):
+        """Half-width of the normal confidence interval for the mean."""
+        return z * self.std / np.sqrt(self.n)
+
+
+def _stream_null_model(g, model, n_max, seed, processes, min_n, rel_tol):
+    """Accumulate clustering and char. path length over surrogates.
+
+    Stop early once at least min_n surrogates have been made and the
+    confidence intervals for both means are within rel_tol of the means.
+
+    Called by small_world_analysis.
+    """
+    clust, charpath = RunningStats(), RunningStats()
+    data = np.array(nx.adjacency_matrix(g))
+    # Results come in order, so the stopping point does not depend on
+    # processes.
+    surrogates = _iter_surrogates(data, model, seed, range(n_max),
+                                  processes)
     try:
-        nonzero = np.nonzero(L)[0][0]
-    except IndexError:
-        nonzero = False
-    else:
-        nonzero = True          # If index is 0, we still want True condition.
-    np.seterr(invalid='ignore')  # Don't warn about the n_path_array division.
-    while nonzero:
-        D += n * L
-        n += 1
-        n_path_matrix *= A
-        n_path_array = np.array(n_path_matrix)
-        D_zeros = np.zeros(D.shape)
-        D_zeros[D == 0] = 1
-        L = np.nan_to_num(n_path_array / n_path_array) * D_zeros
-        try:
-            nonzero = np.nonzero(L)[0][0]
-        except IndexError:
-            nonzero = False
-        else:
-            nonzero = True
-    np.seterr(invalid='warn')  # Return this setting to the default.
-    D[D == 0] = np.inf
-    D -= np.eye(A.shape[0])
-    # Now use D to compute the characteristic path length.
-    return np.sum(np.sum(D[D != np.inf])) / len(np.nonzero(D[D != np.inf])[0])
+        for index, c, l in surrogates:
+            clust.push(c)
+            # Disconnected surrogates have no char. path length.
+            if not np.isnan(l):
+                charpath.push(l)
+            if clust.n >= min_n and charpath.n >= 2 and \
+                    clust.ci_halfwidth() <= rel_tol * abs(clust.mean) and \
+                    charpath.ci_halfwidth() <= rel_tol * charpath.mean:
+                break
+    finally:
+        surrogates.close()
+    return clust, charpath
+
+
+def small_world_analysis(g, n_rand=1000, n_latt=100, seed=None,
+                         processes=1, min_surrogates=20, rel_tol=0.01):
+    """Compare g with random and lattice null models.
+
+    Surrogate metrics are streamed into running means and variances.
+    Generation of each kind of surrogate stops once its confidence
+    intervals are tight enough, so n_rand and n_latt are upper limits.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph
+
+    n_rand : int (optional)
+      Maximum number of random graphs (randmio_dir).
+
+    n_latt : int (optional)
+      Maximum number of lattice graphs (latmio_dir).
+
+    seed : int (optional)
+      Root seed; see null_model_stats.
+
+    processes : int (optional)
+      Number of worker processes.
+
+    min_surrogates : int (optional)
+      Minimum number of each kind of surrogate.
+
+    rel_tol : float (optional)
+      Generation stops when the 95% confidence intervals for mean
+      clustering and char. path length are within rel_tol (relative)
+      of the means.
+
+    Returns
+    -------
+    results : dict
+      'C' and 'L' are the clustering coefficient and char. path length
+      of g.  'C_rand', 'L_rand', 'C_latt', and 'L_latt' are the null
+      model means, with standard deviations under the same keys plus
+      '_std'.  'n_rand' and 'n_latt' are the numbers of surrogates
+      made.  'sigma' is (C/C_rand)/(L/L_rand) (Humphries & Gurney,
+      2008) and 'omega' is L_rand/L - C/C_latt (Telesford et al.,
+      2011).
+    """
+    if seed is None:
+        seed = np.random.randint(2**31 - 1)
+    rand_seed, latt_seed = np.random.RandomState(seed).randint(2**31 - 1,
+                                                               size=2)
+    C = directed_clustering(g)
+    L = directed_char_path_length(g)
+    results = {'C': C, 'L': L}
+    for model, n_max, model_seed, suffix in (('random', n_rand, rand_seed,
+                                              'rand'),
+                                             ('lattice', n_latt, latt_seed,
+                                              'latt')):
+        clust, charpath = _stream_null_model(g, model, n_max, model_seed,
+                                             processes, min_surrogates,
+                                             rel_tol)
+        results['C_' + suffix] = clust.mean
+        results['C_%s_std' % suffix] = clust.std
+        results['L_' + suffix] = charpath.mean
+        results['L_%s_std' % suffix] = charpath.std
+        results['n_' + suffix] = clust.n
+    results['sigma'] = (C / results['C_rand']) / (L / results['L_rand'])
+    results['omega'] = results['L_rand'] / L - C / results['C_latt']
+    return results
+
+
+def _sparse_adjacency(g):
+    """Return the binary adjacency matrix of g in CSR format.
+
+    Rows and columns follow g.nodes().  Objects other than NetworkX
+    graphs (e.g., EdgeSubgraphView) can supply their own
+    to_scipy_sparse_matrix method.
+    """
+    if hasattr(g, 'to_scipy_sparse_matrix'):
+        return g.to_scipy_sparse_matrix()
+    return nx.to_scipy_sparse_matrix(g, weight=None, format='csr')
+
+
+def distance_matrix(g):
+    """Return the matrix of shortest path lengths between nodes in g.
+
+    Edges are considered binary.  Distances are found by breadth-first
+    search on a sparse adjacency matrix.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph or UnknownEdges
+
+    Returns
+    -------
+    D : 2D array
+      D[i, j] is the length of the shortest path from the ith to the jth
+      node in g.nodes(); it is inf if there is no such path.
+    """
+    if isinstance(g, UnknownEdges):
+        return _complement_distances(_sparse_adjacency(g.end))
+    return _distances(_sparse_adjacency(g))
+
+
+def _distances(A):
+    """Return the shortest path lengths for binary adjacency matrix A."""
+    return scipy.sparse.csgraph.shortest_path(A, directed=True,
+                                              unweighted=True)
+
+
+def _binary_off_diagonal(A):
+    """Return A as a binary CSR matrix without self-loops."""
+    A = scipy.sparse.coo_matrix(A)
+    off_diagonal = (A.row != A.col) & (A.data != 0)
+    A = scipy.sparse.csr_matrix((np.ones(off_diagonal.sum()),
+                                 (A.row[off_diagonal], A.col[off_diagonal])),
+                                shape=A.shape)
+    A.data[:] = 1
+    return A
+
+
+def _complement_distances(A):
+    """Return the shortest path lengths in the complement of A.
+
+    The complement has an edge between every pair of distinct nodes that
+    are not joined in A.  A breadth-first search runs from all nodes at
+    once: a node not yet reached from a source is reached at the next
+    level unless every node in the source's frontier has a known edge to
+    it.  Only A and arrays the size of the result are held in memory.
+    """
+    A = _binary_off_diagonal(A)
+    n = A.shape[0]
+    D = np.empty((n, n))
+    D.fill(np.inf)
+    np.fill_diagonal(D, 0)
+    frontier = np.eye(n)
+    visited = np.eye(n, dtype=bool)
+    AT = A.transpose().tocsr()
+    level = 0
+    while frontier.any():
+        level += 1
+        # known[s, w] is the number of nodes in the frontier of s with a
+        # known edge to w.
+        known = (AT * frontier.T).T
+        reached = ~visited & (known < frontier.sum(axis=1)[:, np.newaxis])
+        D[reached] = level
+        visited |= reached
+        frontier = reached.astype(float)
+    return D
+
+
+def directed_char_path_length(g, return_distances=False):
+    """Compute the char. path length for a DiGraph.
+
+    This matches charpath in the Sporns Matlab toolbox: the mean of the
+    finite distances between distinct nodes.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph
+
+    return_distances : bool (optional)
+      If True, the distance matrix (see distance_matrix) is also
+      returned, for reuse.
+
+    Returns
+    -------
+    char_path : float
+      nan if no node can reach another.
+
+    D : 2D array
+      Returned only if return_distances is True.
+    """
+    D = distance_matrix(g)
+    char_path = _char_path_from_distances(D)
+    if return_distances:
+        return char_path, D
+    return char_path
+
+
+def _char_path_from_distances(D):
+    """Return the mean finite off-diagonal entry of D."""
+    off_diagonal = ~np.eye(D.shape[0], dtype=bool)
+    finite = D[np.isfinite(D) & off_diagonal]
+    if not finite.size:
+        return np.nan
+    return finite.sum() / finite.size
     
 
-def directed_clustering(g):
+def _clustering_coefficients(A):
+    """Return Fagiolo's directed clustering coefficient for each node.
+
+    Called by directed_clustering and directed_clustering_batch.
+
+    Parameters
+    ----------
+    A : scipy sparse matrix
+      Binary directed adjacency matrix.
+
+    Returns
+    -------
+    C : 1D array
+    """
+    A = scipy.sparse.csr_matrix(A, dtype=float)
+    A.data[:] = 1
+    S = A + A.transpose()
+    K = np.asarray(S.sum(axis=1)).ravel()
+    # The diagonal of S**3 (twice the number of directed triangles
+    # around each node) and of A**2 (the number of bilateral edges) are
+    # row sums of elementwise products, so no dense power is formed.
+    cyc3 = np.asarray((S * S).multiply(S).sum(axis=1)).ravel() / 2.0
+    bilateral = np.asarray(A.multiply(A.transpose()).sum(axis=1)).ravel()
+    CYC3 = K*(K-1) - 2*bilateral
+    # If there are zero possible 3-cycles, make the value in CYC3 Inf,
+    # so that C = 0.  This is the definition of Rubinov & Sporns,
+    # 2010, NeuroImage.
+    CYC3[CYC3 == 0] = np.inf
+    return cyc3 / CYC3
+
+
+def _complement_clustering_coefficients(A):
+    """Return _clustering_coefficients for the complement of A.
+
+    With B = A + A.T (self-loops removed) and M = J - I, the symmetrized
+    complement is S = 2M - B.  The diagonal of S**3 is expanded into
+    terms in the degrees of B and the diagonals of B**2 and B**3, so
+    only products of the known adjacency are formed.
+    """
+    A = _binary_off_diagonal(A)
+    n = A.shape[0]
+    B = A + A.transpose()
+    k = np.asarray(B.sum(axis=1)).ravel()
+    total = k.sum()
+    B2_diag = np.asarray(B.multiply(B).sum(axis=1)).ravel()
+    B3_diag = np.asarray((B * B).multiply(B).sum(axis=1)).ravel()
+    Bk = B * k
+    S3_diag = (8*(n-1)*(n-2) - 4*(2*(n-2)*k - 2*k + total) +
+               2*(2*Bk + k**2 - 3*B2_diag) - B3_diag)
+    cyc3 = S3_diag / 2.0
+    K = 2*(n-1) - k
+    # Pairs unjoined in both directions are bilateral in the complement.
+    reciprocal = np.asarray(A.multiply(A.transpose()).sum(axis=1)).ravel()
+    bilateral = (n-1) - k + reciprocal
+    CYC3 = K*(K-1) - 2*bilateral
+    CYC3[CYC3 == 0] = np.inf
+    return cyc3 / CYC3
+
+
+def directed_clustering(g, per_node=False):
     """Compute the clustering coefficient for a DiGraph.
 
     Edges are considered binary (i.e., unweighted).  All directed triangles
@@ -233,39 +744,153 @@ def directed_clustering(g):
     G. Fagiolo, 2007, Physical Review E
 
     See also clustering_coef_bd in the Sporns Matlab toolbox.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph or UnknownEdges
+
+    per_node : bool (optional)
+      If True, the coefficient for each node is also returned.
+
+    Returns
+    -------
+    mean : float
+      Mean clustering coefficient.
+
+    C : 1D array
+      Coefficients for the nodes in g.nodes(), in that order.  Returned
+      only if per_node is True.
     """
-    A = nx.adjacency_matrix(g)
-    S = A + A.transpose()
-    K = np.array(S.sum(axis=1)) # Make array for elementwise operations.
-    cyc3 = np.array((S**3).diagonal() / 2.0).reshape(A.shape[0], 1)
-    CYC3 = K*(K-1) - np.array(2*(A**2).diagonal()).reshape(A.shape[0], 1)
-    # If there are zero possible 3-cycles, make the value in CYC3 Inf,
-    # so that C = 0.  This is the definition of Rubinov & Sporns,
-    # 2010, NeuroImage.
-    CYC3[np.where(CYC3==0)] = np.inf
-    C = cyc3/CYC3
+    if isinstance(g, UnknownEdges):
+        C = _complement_clustering_coefficients(_sparse_adjacency(g.end))
+    else:
+        C = _clustering_coefficients(_sparse_adjacency(g))
+    if per_node:
+        return C.mean(), C
     return C.mean()
 
 
-def _compute_directed_closeness(path_lengths, node, num_nodes, all_nodes,
-                                direction):
-    lengths = 0.0
-    for other in all_nodes:
-        if node == other:
-            continue
+def directed_clustering_batch(adjacencies, per_node=False):
+    """Compute clustering coefficients for many graphs at once.
+
+    The graphs are combined into one block-diagonal sparse matrix, so
+    triangles are counted in a single pass.
+
+    Parameters
+    ----------
+    adjacencies : list
+      Directed adjacency matrices (2D arrays or scipy sparse matrices),
+      e.g., surrogates from randmio_dir.
+
+    per_node : bool (optional)
+      If True, coefficients for each node of each graph are also
+      returned.
+
+    Returns
+    -------
+    means : 1D array
+      Mean clustering coefficient of each graph.
+
+    coefficients : list
+      1D arrays of per-node coefficients.  Returned only if per_node is
+      True.
+    """
+    sizes = [A.shape[0] for A in adjacencies]
+    C = _clustering_coefficients(scipy.sparse.block_diag(
+            [scipy.sparse.csr_matrix(A) for A in adjacencies]))
+    coefficients = np.split(C, np.cumsum(sizes)[:-1])
+    means = np.array([c.mean() for c in coefficients])
+    if per_node:
+        return means, coefficients
+    return means
+
+
+class PathMetrics(object):
+
+    """Path-based metrics for a graph, served from one distance matrix.
+
+    The all-pairs distance matrix (see distance_matrix) is computed the
+    first time it is needed and cached.  Changes to the graph are not
+    tracked: after modifying g, call refresh so that later metrics use
+    the new structure.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph or UnknownEdges
+    """
+
+    def __init__(self, g):
+        self.g = g
+        self._nodes = None
+        self._distances = None
+
+    @property
+    def nodes(self):
+        """Nodes of g in the order used by the distance matrix."""
+        if self._nodes is None:
+            self.refresh()
+        return self._nodes
+
+    @property
+    def distances(self):
+        """The cached distance matrix."""
+        if self._distances is None:
+            self.refresh()
+        return self._distances
+
+    def refresh(self):
+        """Recompute the distance matrix from the current state of g."""
+        self._nodes = self.g.nodes()
+        self._distances = distance_matrix(self.g)
+
+    def closeness(self, direction='in'):
+        """Calculate in- or out-closeness for nodes in g.
+
+        Parameters
+        ----------
+        direction : string (optional)
+          'in' or 'out'.
+
+        Returns
+        -------
+        closeness : dict
+          Dict mapping nodes to their in- or out-closeness value (the
+          mean distance to or from all other nodes).  Nodes that cannot
+          be reached from, or cannot reach, every other node are mapped
+          to None.
+        """
         if direction == 'in':
-            try:
-                lengths += path_lengths[other][node]
-            except KeyError:
-                return
+            totals = self.distances.sum(axis=0)
         elif direction == 'out':
-            try:
-                lengths += path_lengths[node][other]
-            except KeyError:
-                return
+            totals = self.distances.sum(axis=1)
         else:
             raise ValueError('invalid direction')
-    return lengths / (num_nodes - 1)
+        n = len(self.nodes)
+        closeness = {}
+        for node, total in zip(self.nodes, totals):
+            if np.isinf(total):
+                closeness[node] = None
+            else:
+                closeness[node] = total / (n - 1)
+        return closeness
+
+    def char_path_length(self):
+        """Return the char. path length (see directed_char_path_length)."""
+        return _char_path_from_distances(self.distances)
+
+    def efficiency(self):
+        """Return the global efficiency of g.
+
+        This is the mean inverse distance between distinct nodes, with
+        unreachable pairs contributing zero (efficiency_bin in the Sporns
+        Matlab toolbox).
+        """
+        D = self.distances
+        n = D.shape[0]
+        if n < 2:
+            return 0.0
+        off_diagonal = ~np.eye(n, dtype=bool)
+        return (1 / D[off_diagonal]).sum() / (n * (n - 1))
 
 
 def directed_closeness(g, direction='in'):
@@ -282,18 +907,242 @@ def directed_closeness(g, direction='in'):
     -------
     closeness : dict
       Dict mapping nodes to their in- or out-closeness value.
+
+    Notes
+    -----
+    To compute both directions or other path-based metrics for the same
+    graph, use a PathMetrics instance to share the distance matrix.
     """
-    path_lengths = nx.shortest_path_length(g)
-    all_nodes = g.nodes()
-    num_nodes = g.number_of_nodes()
-    closeness = {}
-    for node in all_nodes:
-        closeness[node] = _compute_directed_closeness(path_lengths, node,
-                                                      num_nodes, all_nodes,
-                                                      direction)
-    return closeness
+    return PathMetrics(g).closeness(direction)
         
 
+def _betweenness(A):
+    """Return normalized betweenness centrality from adjacency matrix A.
+
+    Brandes' algorithm, with a breadth-first search from each node over
+    the CSR structure of A.  Values are scaled by 1 / ((n-1)(n-2)), as in
+    nx.betweenness_centrality.
+    """
+    n = A.shape[0]
+    indptr = A.indptr.tolist()
+    indices = A.indices.tolist()
+    betweenness = [0.0] * n
+    for s in range(n):
+        stack = []
+        predecessors = [[] for v in range(n)]
+        sigma = [0] * n
+        sigma[s] = 1
+        distance = [-1] * n
+        distance[s] = 0
+        queue = [s]
+        for v in queue:
+            stack.append(v)
+            for w in indices[indptr[v]:indptr[v+1]]:
+                if distance[w] < 0:
+                    queue.append(w)
+                    distance[w] = distance[v] + 1
+                if distance[w] == distance[v] + 1:
+                    sigma[w] += sigma[v]
+                    predecessors[w].append(v)
+        delta = [0.0] * n
+        while stack:
+            w = stack.pop()
+            for v in predecessors[w]:
+                delta[v] += sigma[v] / sigma[w] * (1 + delta[w])
+            if w != s:
+                betweenness[w] += delta[w]
+    betweenness = np.array(betweenness)
+    if n > 2:
+        betweenness /= (n - 1) * (n - 2)
+    return betweenness
+
+
+def _pagerank(A, alpha=0.85, max_iter=100, tol=1e-8):
+    """Return PageRank from adjacency matrix A, as in nx.pagerank."""
+    n = A.shape[0]
+    out_degree = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    out_degree[dangling] = 1
+    # Row-stochastic transpose, so that each step is one product.
+    W = (scipy.sparse.diags(1 / out_degree, 0) * A).transpose().tocsr()
+    x = np.ones(n) / n
+    for i in range(max_iter + 2):
+        x_last = x
+        x = alpha * (W * x_last + x_last[dangling].sum() / n) + (1 - alpha) / n
+        x /= x.sum()
+        if np.abs(x - x_last).sum() < tol:
+            return x
+    raise nx.NetworkXError('pagerank: power iteration failed to converge '
+                           'in %d iterations.' % max_iter)
+
+
+def _hits(A, max_iter=100, tol=1e-8):
+    """Return hub and authority scores from adjacency matrix A.
+
+    Power iteration as in nx.hits; both vectors are normalized to sum
+    to 1.
+    """
+    n = A.shape[0]
+    AT = A.transpose().tocsr()
+    h = np.ones(n) / n
+    for i in range(max_iter + 2):
+        h_last = h
+        a = AT * h_last
+        h = A * a
+        h /= h.max()
+        a /= a.max()
+        if np.abs(h - h_last).sum() < tol:
+            return h / h.sum(), a / a.sum()
+    raise nx.NetworkXError('HITS: power iteration failed to converge in '
+                           '%d iterations.' % max_iter)
+
+
+def _closeness_from_distances(D):
+    """Return in- and out-closeness arrays, nan where a node is cut off."""
+    n = D.shape[0]
+    with np.errstate(invalid='ignore'):
+        in_closeness = D.sum(axis=0) / (n - 1)
+        out_closeness = D.sum(axis=1) / (n - 1)
+    in_closeness[np.isinf(in_closeness)] = np.nan
+    out_closeness[np.isinf(out_closeness)] = np.nan
+    return in_closeness, out_closeness
+
+
+CENTRALITY_FIELDS = ('in_degree', 'out_degree', 'in_closeness',
+                     'out_closeness', 'betweenness', 'pagerank', 'hubs',
+                     'authorities')
+
+
+def centrality_suite(g, processes=1):
+    """Compute the centrality measures used in ranking reports.
+
+    The sparse adjacency matrix of g is built once and shared by all
+    measures; edges are considered binary.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph or EdgeSubgraphView
+
+    processes : int (optional)
+      Number of worker processes over which to spread the measures.
+      With more than one, the independent computations (distances,
+      betweenness, PageRank, and HITS) run in a multiprocessing.Pool.
+
+    Returns
+    -------
+    suite : structured array
+      One record per node of g, in g.nodes() order.  The 'node' field
+      holds the node; the remaining fields are named in
+      CENTRALITY_FIELDS.  Closeness is the mean distance to (in) or from
+      (out) all other nodes, as in PathMetrics.closeness, and is nan for
+      nodes cut off from any other.  Betweenness, PageRank, and HITS
+      match the NetworkX functions with default arguments.
+
+    Notes
+    -----
+    To rank nodes by a measure, pass
+    dict(zip(suite['node'], suite[field])) to get_top_k.
+    """
+    nodes = g.nodes()
+    # Copy, as the arrays of the adjacency matrix may be read-only (e.g.,
+    # memory-mapped by GraphSnapshot) or shared with g.
+    A = scipy.sparse.csr_matrix(_sparse_adjacency(g), dtype=float,
+                                copy=True)
+    A.data[:] = 1
+    jobs = (_distances, _betweenness, _pagerank, _hits)
+    if processes > 1:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            pending = [pool.apply_async(f, (A,)) for f in jobs]
+            D, betweenness, pagerank, (hubs, authorities) = [
+                result.get() for result in pending]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        D, betweenness, pagerank, (hubs, authorities) = [
+            f(A) for f in jobs]
+    in_closeness, out_closeness = _closeness_from_distances(D)
+    dtype = [('node', object), ('in_degree', int), ('out_degree', int)]
+    dtype += [(field, float) for field in CENTRALITY_FIELDS[2:]]
+    suite = np.empty(len(nodes), dtype=dtype)
+    for i, node in enumerate(nodes):
+        suite['node'][i] = node
+    suite['in_degree'] = np.asarray(A.sum(axis=0)).ravel()
+    suite['out_degree'] = np.asarray(A.sum(axis=1)).ravel()
+    suite['in_closeness'] = in_closeness
+    suite['out_closeness'] = out_closeness
+    suite['betweenness'] = betweenness
+    suite['pagerank'] = pagerank
+    suite['hubs'] = hubs
+    suite['authorities'] = authorities
+    return suite
+
+
+class UnknownEdges(object):
+
+    """View of the edges missing from a graph.
+
+    Because an EndGraph contains known-absent and known-present edges,
+    the edges missing from it are those whose existence is unknown.  They
+    are computed on demand from the known edges, so memory use scales
+    with the number of known edges.  The view can be iterated, counted,
+    and passed to distance_matrix, directed_char_path_length,
+    directed_clustering, and PathMetrics, which work from the adjacency
+    matrix of the known edges rather than building the unknown ones.
+
+    Parameters
+    ----------
+    end : EndGraph or NetworkX DiGraph
+      It is not copied; later changes to it are reflected in the view.
+    """
+
+    def __init__(self, end):
+        self.end = end
+
+    def nodes(self):
+        return self.end.nodes()
+
+    def number_of_nodes(self):
+        return self.end.number_of_nodes()
+
+    def number_of_edges(self):
+        n = self.end.number_of_nodes()
+        known = self.end.number_of_edges() - \
+            self.end.number_of_selfloops()
+        return n * (n - 1) - known
+
+    __len__ = number_of_edges
+
+    def has_edge(self, source, target):
+        return (source != target and source in self.end and
+                target in self.end and not self.end.has_edge(source,
+                                                             target))
+
+    def __contains__(self, edge):
+        return self.has_edge(*edge)
+
+    def edges_iter(self):
+        """Yield the unknown edges as (source, target) tuples."""
+        nodes = self.end.nodes()
+        for source in nodes:
+            successors = self.end.succ[source]
+            for target in nodes:
+                if source != target and target not in successors:
+                    yield source, target
+
+    __iter__ = edges_iter
+
+    def edges(self):
+        return list(self.edges_iter())
+
+    def to_graph(self):
+        """Return the unknown edges as a new NetworkX DiGraph."""
+        u = nx.DiGraph()
+        u.add_edges_from(self.edges_iter())
+        return u
+
+
 def compute_graph_of_unknowns(end):
     """Return the inverse of end.
 
@@ -313,17 +1162,79 @@ def compute_graph_of_unknowns(end):
 
     Notes
     -----
-    end is not modified by this function; a new graph is returned.
-    """
-    u = nx.DiGraph()
-    nodes = end.nodes()
-    for source in nodes:
-        for target in nodes:
-            if source != target and not end.has_edge(source, target):
-                u.add_edge(source, target)
-    return u
+    end is not modified by this function; a new graph is returned.  To
+    count, iterate, or analyze the unknown edges without building a new
+    graph, use UnknownEdges.
+    """
+    return UnknownEdges(end).to_graph()
     
 
+def get_top_k(measures, k=10, better='greater'):
+    """Returns nodes with the top k scores in order from best to worst.
+
+    Parameters
+    ----------
+    measures : dict or 1D array
+      Mapping of nodes to values for a particular measure.  If an array
+      is supplied, nodes are its indices.
+
+    k : int (optional)
+      Number of distinct scores to return nodes for.
+
+    better : string (optional)
+      Complete this sentence using the word "greater" or "smaller": The
+      nodes with the better scores in this dict are the ones with the
+      _____ values.
+
+    Returns
+    -------
+    top_k : list
+      The nodes with the top k scores.  Nodes with tied scores are
+      grouped in a list, in the order in which they appear in measures.
+
+    Notes
+    -----
+    The k best distinct scores are found with a heap (or, for an array,
+    by partitioning out the best values, taking more until k distinct
+    ones are found), and nodes are grouped by score in a single pass.
+    """
+    if isinstance(measures, dict):
+        nodes = measures.keys()
+        values = measures.values()
+        if better == 'greater':
+            best = heapq.nlargest(k, set(values))
+        else:
+            best = heapq.nsmallest(k, set(values))
+        candidates = zip(nodes, values)
+    else:
+        values = np.asarray(measures)
+        n = len(values)
+        m = max(k, 1)
+        while True:
+            # Only the m best values are sorted.
+            if m >= n:
+                top = values
+            elif better == 'greater':
+                top = values[np.argpartition(values, n - m)[n - m:]]
+            else:
+                top = values[np.argpartition(values, m - 1)[:m]]
+            distinct = np.unique(top)
+            if len(distinct) >= k or m >= n:
+                break
+            m *= 2
+        if better == 'greater':
+            distinct = distinct[::-1]
+        best = distinct[:k].tolist()
+        indices = np.nonzero(np.in1d(values, best))[0]
+        candidates = zip(indices.tolist(), values[indices].tolist())
+    rank = dict(zip(best, range(len(best))))
+    groups = [[] for score in best]
+    for node, value in candidates:
+        if value in rank:
+            groups[rank[value]].append(node)
+    return [group[0] if len(group) == 1 else group for group in groups]
+
+
 def get_top_ten(measures, better='greater'):
     """Returns top ten nodes in order from best to worst.
 
@@ -346,26 +1257,9 @@ def get_top_ten(measures, better='greater'):
     -----
     Nodes corresponding to 10 distinct scores (or as many as there are in
     the graph if there are fewer than 10) are returned; ties are placed in
-    brackets.
+    brackets.  See get_top_k.
     """
-    top_ten = []
-    best_to_worst = sorted(set(measures.values()))
-    if better == 'greater':
-        best_to_worst.reverse()
-    while len(top_ten) < 10:
-        try:
-            next_best_score = best_to_worst.pop(0)
-        except IndexError:
-            return top_ten
-        next_best_nodes = []
-        for key, value in measures.iteritems():
-            if value == next_best_score:
-                next_best_nodes.append(key)
-        if len(next_best_nodes) == 1:
-            top_ten.append(next_best_nodes[0])
-        else:
-            top_ten.append(next_best_nodes)
-    return top_ten
+    return get_top_k(measures, 10, better)
 
 
 def strip_absent_and_unknown_edges(end):
@@ -383,17 +1277,29 @@ def strip_absent_and_unknown_edges(end):
     g : NetworkX DiGraph
       Graph with those edges in EndGraph known to be present.  Edge
       attributes are not transferred to this graph.
+
+    Raises
+    ------
+    KeyError
+      If an edge has neither a Connection nor ECs.
+
+    Notes
+    -----
+    Edges with a Connection attribute are kept if it is 'Present' or
+    'Absent'; other edges are kept if their ECs are known to be present.
+    For other filters, or to avoid building a new graph, use EdgeColumns
+    directly.
     """
-    g = nx.DiGraph()
-    g.add_nodes_from(end.nodes())
-    for source, target in end.edges_iter():
-        if end[source][target].has_key('Connection'):
-            if end[source][target]['Connection'] in ('Present', 'Absent'):
-                g.add_edge(source, target)
-        else:
-            source_ec = end[source][target]['EC_Source']
-            target_ec = end[source][target]['EC_Target']
-            ns = ('N', 'Nc', 'Np', 'Nx', 'Up', 'Ux', 'U')
-            if source_ec not in ns and target_ec not in ns:
-                g.add_edge(source, target)
-    return g
+    if isinstance(end, EndGraph):
+        columns = end.edge_columns()
+    else:
+        columns = EdgeColumns(end)
+    missing = (columns.connection < 0) & (columns.ec_source < 0)
+    if missing.any():
+        row = np.nonzero(missing)[0][0]
+        raise KeyError('Edge from %s to %s has no Connection or ECs' %
+                       (columns.nodes[columns.sources[row]],
+                        columns.nodes[columns.targets[row]]))
+    mask = np.where(columns.connection >= 0, columns.known(),
+                    columns.present())
+    return columns.subgraph(mask).to_graph()
@@ -25,6 +25,23 @@ def test_add_edges_from():
                      'PDC_Site_Target': 0, 'PDC_EC_Target': 0,
                      'PDC_Density': 0, 'Connection': 'Present'})
 
+
+def test_duplicate_nodes():
+    g = cg.ConGraph()
+    attr = {'EC_Source': 'C', 'PDC_Site_Source': 0, 'PDC_EC_Source': 0,
+            'Degree': '1', 'EC_Target': 'P', 'PDC_Site_Target': 0,
+            'PDC_EC_Target': 1, 'PDC_Density': 0, 'Connection': 'Present'}
+    g.add_edges_from([('A99-Pg', 'B-1', attr), ('A99-pg', 'B-2', attr),
+                      ('b-1', 'A99-Pg', attr)])
+    nt.assert_equal(g.duplicate_nodes(), [['A99-Pg', 'A99-pg'],
+                                          ['B-1', 'b-1']])
+    g.remove_node('b-1')
+    nt.assert_equal(g.duplicate_nodes(), [['A99-Pg', 'A99-pg']])
+    g.add_node('a99-PG')
+    g.add_nodes_from(['C-1', ('c-1', {})])
+    nt.assert_equal(g.duplicate_nodes(), [['A99-Pg', 'A99-pg', 'a99-PG'],
+                                          ['C-1', 'c-1']])
+
 #------------------------------------------------------------------------------
 # Unit Tests
 #------------------------------------------------------------------------------
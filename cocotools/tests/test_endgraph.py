@@ -1,9 +1,10 @@
+import pickle
 from unittest import TestCase
 from testfixtures import replace
 from networkx import DiGraph
 import nose.tools as nt
 
-from cocotools import EndGraph, EndGraphError
+from cocotools import EndGraph, EndGraphError, EdgeColumns
 
 
 # Deliberately not tested: add_edge.
@@ -36,6 +37,157 @@ class OrtTestCase(TestCase):
         self.assertEqual(self.e['1']['2']['EC_Source'], 'P')
         self.assertEqual(self.e['1']['2']['EC_Target'], 'P')
 
+
+class IncrementalTranslationTestCase(TestCase):
+
+    def setUp(self):
+        self.m = DiGraph()
+        self.m.add_edges_from([('A-1', 'B-1', {'RC': 'S', 'PDC': 0}),
+                               ('B-1', 'A-1', {'RC': 'L', 'PDC': 0}),
+                               ('A-2', 'B-1', {'RC': 'S', 'PDC': 2}),
+                               ('B-1', 'A-2', {'RC': 'L', 'PDC': 2}),
+                               ('A-3', 'B-2', {'RC': 'I', 'PDC': 1}),
+                               ('B-2', 'A-3', {'RC': 'I', 'PDC': 1}),
+                               ('A-4', 'B-3', {'RC': 'I', 'PDC': 0}),
+                               ('B-3', 'A-4', {'RC': 'I', 'PDC': 0})])
+        self.c = DiGraph()
+        self.add_conn_edge('A-1', 'A-3', 'Present', 4)
+        self.add_conn_edge('A-2', 'A-3', 'Absent', 2)
+        self.add_conn_edge('A-3', 'A-4', 'Absent', 6)
+        self.e = EndGraph()
+        self.e.add_translated_edges(self.m, self.c, 'B', 'modified',
+                                    track_provenance=True)
+
+    def add_conn_edge(self, source, target, connection, pdc):
+        self.c.add_edge(source, target, Connection=connection,
+                        PDC_EC_Source=pdc, PDC_EC_Target=pdc,
+                        PDC_Site_Source=pdc, PDC_Site_Target=pdc)
+
+    def assert_matches_rebuild(self):
+        rebuilt = EndGraph()
+        rebuilt.add_translated_edges(self.m, self.c, 'B', 'modified',
+                                     track_provenance=True)
+        self.assertEqual(sorted(self.e.nodes()), sorted(rebuilt.nodes()))
+        self.assertEqual(sorted(self.e.edges(data=True)),
+                         sorted(rebuilt.edges(data=True)))
+        for source, target in rebuilt.edges_iter():
+            self.assertEqual(self.e.explain(source, target),
+                             rebuilt.explain(source, target))
+        self.assertEqual(len(self.e.provenance), len(rebuilt.provenance))
+
+    def test_explain(self):
+        self.assertEqual(self.e.explain('1', '2'),
+                         {'conn_edges': set([('A-1', 'A-3'),
+                                             ('A-2', 'A-3')]),
+                          'relations': set([('A-1', 'B-1'), ('A-2', 'B-1'),
+                                            ('A-3', 'B-2')])})
+        self.assertEqual(self.e.explain('2', '3'),
+                         {'conn_edges': set([('A-3', 'A-4')]),
+                          'relations': set([('A-3', 'B-2'),
+                                            ('A-4', 'B-3')])})
+        self.assertRaises(EndGraphError, self.e.explain, '3', '1')
+
+    def test_added_conn_edge(self):
+        self.add_conn_edge('A-4', 'A-1', 'Present', 3)
+        affected = self.e.apply_delta(self.m, self.c,
+                                      added_conn_edges=[('A-4', 'A-1')])
+        self.assertEqual(affected, set([('3', '1')]))
+        self.assert_matches_rebuild()
+
+    def test_removed_conn_edge(self):
+        self.c.remove_edge('A-1', 'A-3')
+        self.e.apply_delta(self.m, self.c,
+                           removed_conn_edges=[('A-1', 'A-3')])
+        self.assertEqual(self.e['1']['2']['Connection'], 'Unknown')
+        self.c.remove_edge('A-2', 'A-3')
+        self.e.apply_delta(self.m, self.c,
+                           removed_conn_edges=[('A-2', 'A-3')])
+        self.assertFalse(self.e.has_edge('1', '2'))
+        self.assert_matches_rebuild()
+
+    def test_changed_relations(self):
+        self.m.remove_edges_from([('A-2', 'B-1'), ('B-1', 'A-2')])
+        self.m.add_edges_from([('A-2', 'B-4', {'RC': 'I', 'PDC': 0}),
+                               ('B-4', 'A-2', {'RC': 'I', 'PDC': 0})])
+        self.e.apply_delta(self.m, self.c,
+                           changed_relations=[('A-2', 'B-1'),
+                                              ('A-2', 'B-4')])
+        self.assertEqual(self.e['4']['2']['Connection'], 'Absent')
+        self.assert_matches_rebuild()
+
+    def test_replay_in_conn_order(self):
+        # Edges from two maps give tied 'Unknown' candidates for 1->2;
+        # add_edge keeps the first in conn order, even though the other
+        # has the better PDC.
+        m = DiGraph()
+        for brain_map in ('A', 'D'):
+            for i in (1, 2):
+                m.add_edge('%s-%d' % (brain_map, i), 'B-%d' % i, RC='I',
+                           PDC=0)
+                m.add_edge('B-%d' % i, '%s-%d' % (brain_map, i), RC='I',
+                           PDC=0)
+        self.m = m
+        self.c = DiGraph()
+        self.add_conn_edge('A-1', 'A-2', 'Unknown', 10)
+        self.add_conn_edge('D-1', 'D-2', 'Unknown', 2)
+        self.e = EndGraph()
+        self.e.add_translated_edges(self.m, self.c, 'B', 'modified',
+                                    track_provenance=True)
+        self.c.remove_edge('A-1', 'A-2')
+        self.add_conn_edge('A-1', 'A-2', 'Unknown', 12)
+        self.e.apply_delta(self.m, self.c,
+                           added_conn_edges=[('A-1', 'A-2')],
+                           removed_conn_edges=[('A-1', 'A-2')])
+        self.assertEqual(self.e['1']['2']['PDC'], 4)
+        self.assert_matches_rebuild()
+
+    def test_stream_to_sink(self):
+        class ListSink(object):
+            def __init__(self):
+                self.edges = []
+            def write_edge(self, source, target, attr):
+                self.edges.append((source, target, attr))
+        self.add_conn_edge('A-4', 'A-1', 'Present', 3)
+        self.add_conn_edge('A-4', 'A-2', 'Absent', 1)
+        sink = ListSink()
+        e = EndGraph()
+        e.add_translated_edges(self.m, self.c, 'B', 'modified', sink=sink)
+        self.assertEqual(e.number_of_edges(), 0)
+        self.assertEqual(sorted(e.nodes()), ['1', '2', '3'])
+        self.e.add_translated_edges(self.m, self.c, 'B', 'modified')
+        self.assertEqual(sorted(sink.edges),
+                         sorted(self.e.edges(data=True)))
+
+    def test_translation_session(self):
+        session = EndGraph().translation_session(self.m, self.c, 'B',
+                                                 'modified')
+        self.assertEqual(sorted(session.endg.nodes()), ['1', '2', '3'])
+        translations = session.translate(('A-1', 'A-3'))
+        self.assertEqual([t[:2] for t in translations], [('1', '2')])
+        self.assertEqual(translations[0][2]['Connection'], 'Present')
+        self.assertEqual(session.endg.number_of_edges(), 0)
+        for edge in self.c.edges():
+            session.add(edge)
+        self.assertEqual(sorted(session.endg.edges(data=True)),
+                         sorted(self.e.edges(data=True)))
+        session.close()
+        self.assertFalse('_conn_arrays' in session.endg.__dict__)
+
+    def test_translation_caches_dropped(self):
+        self.assertFalse('_conn_arrays' in self.e.__dict__)
+        self.add_conn_edge('A-4', 'A-2', 'Absent', 1)
+        self.e.apply_delta(self.m, self.c, added_conn_edges=[('A-4', 'A-2')])
+        self.assertFalse('_conn_arrays' in self.e.__dict__)
+        self.e._conn_arrays = (self.c, {}, None, None)
+        state = pickle.loads(pickle.dumps(self.e)).__dict__
+        self.assertFalse('_conn_arrays' in state)
+        self.assertTrue('provenance' in state)
+
+    def test_requires_provenance(self):
+        e = EndGraph()
+        e.add_translated_edges(self.m, self.c, 'B', 'modified')
+        self.assertRaises(EndGraphError, e.apply_delta, self.m, self.c)
+
 #------------------------------------------------------------------------------
 # Unit Tests
 #------------------------------------------------------------------------------
@@ -112,12 +264,13 @@ def mock_resolve_connections(self, connections):
 @replace('cocotools.endgraph.EndGraph._get_rcs', mock_get_rcs)
 @replace('cocotools.endgraph.EndGraph._translate_connection',
          mock_translate_connection)
-@replace('cocotools.endgraph.EndGraph._get_mean_pdc', mock_get_mean_pdc)
 @replace('cocotools.endgraph.EndGraph._resolve_connections',
          mock_resolve_connections)
 def test_translate_attr_modified():
     mock_conn = DiGraph()
-    mock_conn.add_edge('B-1', 'B-2', Connection='Present')
+    mock_conn.add_edge('B-1', 'B-2', Connection='Present', PDC_EC_Source=5,
+                       PDC_EC_Target=10, PDC_Site_Source=5,
+                       PDC_Site_Target=4)
     translate = EndGraph._translate_attr_modified.im_func
     # PDCs that get averaged are 3 (RCs), 6 (existent conn edge), and
     # 18 (non-existent conn edge).
@@ -185,3 +338,55 @@ def test_make_translation_dict():
     translate = EndGraph._make_translation_dict.im_func
     nt.assert_equal(translate(EndGraph(), None, 'A-1', 'B'), {'X': ['X']})
     nt.assert_equal(translate(EndGraph(), None, 'A-1', 'A'), {'A-1': ['A-1']})
+
+
+def test_edge_columns():
+    g = DiGraph()
+    g.add_edge('A', 'B', {'Connection': 'Present', 'PDC': 1.0})
+    g.add_edge('B', 'C', {'Connection': 'Unknown', 'PDC': 5.0})
+    g.add_edge('C', 'A', {'EC_Source': 'P', 'EC_Target': 'C', 'PDC': 3.0})
+    g.add_edge('A', 'C', {'EC_Source': 'N', 'EC_Target': 'X'})
+    g.add_node('D')
+    columns = EdgeColumns(g)
+    edges = g.edges()
+    masks = {'known': columns.known(), 'present': columns.present(),
+             'pdc': columns.pdc_below(4)}
+    expected = {'known': [('A', 'B'), ('C', 'A'), ('A', 'C')],
+                'present': [('A', 'B'), ('C', 'A')],
+                'pdc': [('A', 'B'), ('C', 'A')]}
+    for name, mask in masks.iteritems():
+        nt.assert_equal(set(e for e, keep in zip(edges, mask) if keep),
+                        set(expected[name]))
+    view = columns.subgraph(columns.present())
+    nt.assert_equal(view.number_of_edges(), 2)
+    nt.assert_true(view.has_edge('C', 'A'))
+    nt.assert_false(view.has_edge('A', 'C'))
+    nt.assert_equal(view.to_scipy_sparse_matrix().sum(), 2)
+    h = view.to_graph()
+    nt.assert_equal(sorted(h.nodes()), ['A', 'B', 'C', 'D'])
+    nt.assert_equal(sorted(h.edges()), [('A', 'B'), ('C', 'A')])
+
+
+def test_cached_edge_columns():
+    e = EndGraph()
+    e.add_edge('A', 'B', {'Connection': 'Present', 'PDC': 4})
+    e.add_edge('B', 'C', {'Connection': 'Absent', 'PDC': 2})
+    e.add_node('D')
+    columns = e.edge_columns()
+    view = columns.subgraph(columns.present())
+    e.add_edge('A', 'B', {'Connection': 'Absent', 'PDC': 1})
+    e.add_edge('C', 'D', {'Connection': 'Present', 'PDC': 0})
+    e.add_edges_from([('D', 'A', {'Connection': 'Unknown', 'PDC': 3})])
+    e.remove_edge('B', 'C')
+    e.remove_node('B')
+    e.add_node('E')
+    nt.assert_true(e.edge_columns() is columns)
+    nt.assert_equal(view.edges(), [('A', 'B')])
+    present = columns.subgraph(columns.present()).to_graph()
+    nt.assert_equal(sorted(present.edges()), [('C', 'D')])
+    nt.assert_equal(sorted(present.nodes()), sorted(e.nodes()))
+    rebuilt = EdgeColumns(e)
+    edges = lambda c: sorted(
+        (c.nodes[s], c.nodes[t], connection, pdc) for s, t, connection, pdc
+        in zip(c.sources, c.targets, c.connection, c.pdc))
+    nt.assert_equal(edges(columns), edges(rebuilt))
@@ -7,10 +7,13 @@
 
 import os
 import re
+import shutil
+import sys
 import tempfile
 
 from networkx import DiGraph
 import nose.tools as nt
+import numpy as np
 
 import cocotools.infomap as infomap
 
@@ -29,3 +32,95 @@ def test_state():
             new_state = infomap._get_state(line, None)
             nt.assert_equals(new_state, state)
         
+
+
+
+MAP_FILE = """# modules: 2
+# codelength: 1.5
+*Directed
+*Modules 2
+1 "A 1" 0.6 0.1
+2 "C" 0.4 0.05
+*Nodes 3
+1:1 "A 1" 0.35
+1:2 "B" 0.25
+2:1 "C" 0.4
+*Links 1
+1 2 0.1
+"""
+
+
+def test_read_map_file():
+    with tempfile.NamedTemporaryFile(suffix='.map', delete=False) as f:
+        f.write(MAP_FILE)
+    try:
+        partition = infomap.read_map_file(f.name)
+        g = infomap._load_infomap(f.name)
+    finally:
+        os.unlink(f.name)
+    np.testing.assert_array_equal(partition.node_modules, [1, 1, 2])
+    np.testing.assert_array_equal(partition.node_flow, [0.35, 0.25, 0.4])
+    nt.assert_equal(partition.labels(), ['A 1', 'B', 'C'])
+    np.testing.assert_array_equal(partition.assignments(['C', 'X', 'A 1']),
+                                  [2, -1, 1])
+    nt.assert_equal(g.node[1], {'id': '"A 1"', 'steady_state': 0.6, 'x': 0.1,
+                                'nodes': [(1, '"A 1"', 0.35),
+                                          (2, '"B"', 0.25)]})
+    nt.assert_equal(g.edges(data=True), [(1, 2, {'weight': 0.1})])
+
+
+def test_read_map_file_bad_line():
+    # The extra token from the label with a space makes up for the
+    # missing flow, so only a per-line check catches the bad line.
+    bad = MAP_FILE.replace('1:2 "B" 0.25', '1:2 "B"')
+    with tempfile.NamedTemporaryFile(suffix='.map', delete=False) as f:
+        f.write(bad)
+    try:
+        nt.assert_raises(ValueError, infomap.read_map_file, f.name)
+    finally:
+        os.unlink(f.name)
+
+STUB_INFOMAP = '''#!%s
+"""Stub infomap: puts vertices in two modules, split by the seed's parity."""
+import sys
+seed, netfile = int(sys.argv[1]), sys.argv[2]
+lines = open(netfile).read().splitlines()
+n = int(lines[0].split()[1])
+labels = [line.split(' ', 1)[1].rsplit(' ', 3)[0] for line in lines[1:n+1]]
+split = 2 if seed %% 2 else 3
+with open(netfile[:-4] + '.map', 'w') as f:
+    f.write('# modules: 2\\n*Directed\\n*Modules 2\\n')
+    f.write('1 %%s 0.5 0.1\\n2 %%s 0.5 0.1\\n' %% (labels[0], labels[-1]))
+    f.write('*Nodes %%d\\n' %% n)
+    for i, label in enumerate(labels):
+        f.write('%%d:%%d %%s 0.25\\n' %% (1 + (i >= split), i + 1, label))
+    f.write('*Links 1\\n1 2 0.1\\n')
+''' % sys.executable
+
+
+def test_multi_seed_infomap():
+    g = DiGraph()
+    g.add_edges_from([('A', 'B'), ('B', 'C'), ('C', 'D X'), ('D X', 'A')])
+    directory = tempfile.mkdtemp()
+    try:
+        executable = os.path.join(directory, 'infomap')
+        with open(executable, 'w') as f:
+            f.write(STUB_INFOMAP)
+        os.chmod(executable, 0755)
+        nodes, assignments, C = infomap.multi_seed_infomap(
+            g, [1, 2, 3, 5], processes=2, executable=executable)
+    finally:
+        shutil.rmtree(directory)
+    nt.assert_equal(nodes, ['A', 'B', 'C', 'D X'])
+    np.testing.assert_array_equal(assignments[:, 2], [2, 1, 2, 2])
+    nt.assert_equal(C[0, 1], 1)
+    nt.assert_equal(C[1, 2], 0.25)
+    nt.assert_equal(C[2, 3], 0.75)
+    nt.assert_equal(infomap.consensus_modules(nodes, C),
+                    [['A', 'B'], ['C', 'D X']])
+
+
+def test_coassignment_matrix_missing_nodes():
+    C = infomap.coassignment_matrix([[1, -1, -1], [1, 1, -1]])
+    np.testing.assert_array_equal(C, [[1, 0.5, 0], [0.5, 0.5, 0],
+                                      [0, 0, 0]])
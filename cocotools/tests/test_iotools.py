@@ -1,8 +1,19 @@
+import csv
+import os
+import shutil
+import tempfile
+
+import networkx as nx
 from networkx import DiGraph
 import nose.tools as nt
 import numpy as np
 
-from cocotools.iotools import get_coord_dict
+from cocotools import MapGraph, EndGraph
+from cocotools.iotools import (get_coord_dict, get_coord_index, EdgeCSVWriter,
+                               save_graph, load_graph, write_snapshot,
+                               GraphSnapshot)
+from cocotools.stats import (directed_char_path_length, directed_clustering,
+                             random_stats, centrality_suite, UnknownEdges)
 
 
 def test_get_coord_dict():
@@ -15,3 +26,179 @@ def test_get_coord_dict():
                                  'OX': [1.57, -1.8],
                                  'TU': [5.21, 1.8]})
     nt.assert_equal(leftovers, ['A', 'X'])
+
+
+def test_get_coord_index():
+    coord_file = 'cocotools/coords/pht00_rhesus.tsv'
+    index = get_coord_index(coord_file)
+    nt.assert_true(index is get_coord_index(coord_file))
+    coord_dict, leftovers = index.lookup(['TU', 'A', '1'], 'YZ')
+    nt.assert_equal(coord_dict, {'1': [-10.8, 32.68], 'TU': [1.8, 11.11]})
+    nt.assert_equal(leftovers, ['A'])
+
+
+def test_edge_csv_writer():
+    f = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+    f.close()
+    with EdgeCSVWriter(f.name) as writer:
+        writer.write_edge('A', 'B', {'Connection': 'Present', 'PDC': 3.5})
+        writer.write_edge('B', 'C', {})
+    rows = list(csv.reader(open(f.name)))
+    os.unlink(f.name)
+    nt.assert_equal(writer.n_edges, 2)
+    nt.assert_equal(rows[0][:2], ['A', 'B'])
+    nt.assert_equal(eval(rows[0][2]), {'Connection': 'Present', 'PDC': 3.5})
+    nt.assert_equal(rows[1], ['B', 'C', '{}'])
+
+
+def test_save_and_load_graph():
+    mapp = MapGraph()
+    mapp.add_edges_from([('A00-1', 'B00-1', {'RC': 'S', 'PDC': 2}),
+                         ('B00-1', 'C00-1', {'RC': 'I', 'PDC': 5})])
+    nx_add_edge = DiGraph.add_edge.im_func
+    nx_add_edge(mapp, 'A00-1', 'C00-1', {'RC': 'S', 'PDC': 5,
+                                         'TP': ['B00-1']})
+    end = EndGraph()
+    nx_add_edge(end, 'A-1', 'A-2', {'Connection': 'Present', 'PDC': 2.5})
+    nx_add_edge(end, 'A-2', 'A-3', {'EC_Source': 'N', 'EC_Target': 'P',
+                                    'PDC': 1.0})
+    end.add_node('A-4')
+    f = tempfile.NamedTemporaryFile(suffix='.npz', delete=False)
+    f.close()
+    try:
+        for g in (mapp, end):
+            save_graph(g, f.name)
+            loaded = load_graph(f.name)
+            nt.assert_equal(type(loaded), type(g))
+            nt.assert_equal(sorted(loaded.nodes()), sorted(g.nodes()))
+            nt.assert_equal(sorted(loaded.edges(data=True)),
+                            sorted(g.edges(data=True)))
+    finally:
+        os.unlink(f.name)
+    nt.assert_equal(loaded['A-1']['A-2']['PDC'], 2.5)
+
+
+def test_save_graph_keeps_types():
+    g = DiGraph()
+    g.add_edge(u'A-\xe9', 'A-2', Flag=True, Count=3, Mixed=1, Name=u'\xfc')
+    g.add_edge('A-2', u'A-3', Flag=False, Count=-2, Mixed=2.5, Name='x')
+    g.add_edge('A-3', 'A-2', Mixed=False)
+    f = tempfile.NamedTemporaryFile(suffix='.npz', delete=False)
+    f.close()
+    directory = tempfile.mkdtemp()
+    try:
+        save_graph(g, f.name)
+        write_snapshot(g, directory)
+        for loaded in (load_graph(f.name),
+                       GraphSnapshot(directory).to_graph(),
+                       GraphSnapshot(directory)):
+            nt.assert_equal(sorted(loaded.edges(data=True)),
+                            sorted(g.edges(data=True)))
+            for s, t, attr in loaded.edges(data=True):
+                for key, value in attr.iteritems():
+                    nt.assert_equal(type(value), type(g[s][t][key]))
+            nt.assert_equal(sorted(map(type, loaded.nodes())),
+                            sorted(map(type, g.nodes())))
+    finally:
+        os.unlink(f.name)
+        shutil.rmtree(directory)
+
+
+def test_load_graph_apply_delta():
+    m = DiGraph()
+    m.add_edges_from([('A-1', 'B-1', {'RC': 'I', 'PDC': 0}),
+                      ('B-1', 'A-1', {'RC': 'I', 'PDC': 0}),
+                      ('A-2', 'B-2', {'RC': 'I', 'PDC': 1}),
+                      ('B-2', 'A-2', {'RC': 'I', 'PDC': 1})])
+    c = DiGraph()
+    pdcs = dict((name, 2) for name in ('PDC_EC_Source', 'PDC_EC_Target',
+                                       'PDC_Site_Source', 'PDC_Site_Target'))
+    c.add_edge('A-1', 'A-2', Connection='Present', **pdcs)
+    end = EndGraph()
+    end.add_translated_edges(m, c, 'B', 'modified', track_provenance=True)
+    f = tempfile.NamedTemporaryFile(suffix='.npz', delete=False)
+    f.close()
+    try:
+        save_graph(end, f.name)
+        loaded = load_graph(f.name)
+    finally:
+        os.unlink(f.name)
+    nt.assert_equal(loaded.method, 'modified')
+    nt.assert_equal(loaded.explain('1', '2'), end.explain('1', '2'))
+    c.add_edge('A-2', 'A-1', Connection='Absent', **pdcs)
+    for g in (end, loaded):
+        g.apply_delta(m, c, added_conn_edges=[('A-2', 'A-1')])
+    nt.assert_equal(sorted(loaded.edges(data=True)),
+                    sorted(end.edges(data=True)))
+    nt.assert_equal(loaded.explain('2', '1'), end.explain('2', '1'))
+
+
+def test_graph_snapshot():
+    mapp = MapGraph()
+    mapp.add_edges_from([('A00-1', 'B00-1', {'RC': 'S', 'PDC': 2}),
+                         ('B00-1', 'C00-1', {'RC': 'I', 'PDC': 5})])
+    DiGraph.add_edge.im_func(mapp, 'A00-1', 'C00-1',
+                             {'RC': 'S', 'PDC': 5, 'TP': ['B00-1']})
+    mapp.add_node('D00-1')
+    directory = tempfile.mkdtemp()
+    try:
+        write_snapshot(mapp, directory)
+        snapshot = GraphSnapshot(directory)
+        nt.assert_equal(sorted(snapshot), sorted(mapp))
+        nt.assert_equal(snapshot.number_of_edges(), mapp.number_of_edges())
+        nt.assert_equal(sorted(snapshot.edges(data=True)),
+                        sorted(mapp.edges(data=True)))
+        nt.assert_true(snapshot.has_edge('A00-1', 'C00-1'))
+        nt.assert_false(snapshot.has_edge('C00-1', 'D00-1'))
+        nt.assert_false(snapshot.has_edge('A00-1', 'E00-1'))
+        nt.assert_equal(snapshot['A00-1']['C00-1']['TP'], ['B00-1'])
+        nt.assert_equal(sorted(snapshot.predecessors('C00-1')),
+                        sorted(mapp.predecessors('C00-1')))
+        nt.assert_equal(snapshot.in_degree(), mapp.in_degree())
+        nt.assert_equal(directed_char_path_length(snapshot),
+                        directed_char_path_length(mapp))
+        restored = snapshot.to_graph()
+        nt.assert_equal(type(restored), MapGraph)
+        nt.assert_equal(sorted(restored.edges(data=True)),
+                        sorted(mapp.edges(data=True)))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_graph_snapshot_algorithms():
+    g = nx.gnm_random_graph(15, 60, seed=0, directed=True)
+    g = nx.relabel_nodes(g, dict((n, 'A00-%d' % n) for n in g))
+    for i, (source, target) in enumerate(g.edges()):
+        g[source][target]['weight'] = i % 3 + 1
+    g.add_edge('A00-3', 'A00-3')
+    directory = tempfile.mkdtemp()
+    try:
+        write_snapshot(g, directory)
+        snapshot = GraphSnapshot(directory)
+        nt.assert_equal(snapshot.nodes(), g.nodes())
+        for method in ('degree', 'in_degree', 'out_degree'):
+            nt.assert_equal(getattr(snapshot, method)(),
+                            getattr(g, method)())
+            nt.assert_equal(getattr(snapshot, method)(weight='weight'),
+                            getattr(g, method)(weight='weight'))
+            nt.assert_equal(getattr(snapshot, method)('A00-3'),
+                            getattr(g, method)('A00-3'))
+        nt.assert_equal(sorted(snapshot.edges(['A00-1', 'A00-2'])),
+                        sorted(g.edges(['A00-1', 'A00-2'])))
+        nt.assert_equal(dict(snapshot.pred['A00-1']), g.pred['A00-1'])
+        nt.assert_equal(snapshot.number_of_selfloops(), 1)
+        np.testing.assert_allclose(
+            [nx.pagerank(snapshot)[n] for n in g],
+            [nx.pagerank(g)[n] for n in g])
+        np.testing.assert_array_equal(
+            nx.to_scipy_sparse_matrix(snapshot).toarray(),
+            nx.to_scipy_sparse_matrix(g).toarray())
+        nt.assert_equal(len(UnknownEdges(snapshot)), len(UnknownEdges(g)))
+        nt.assert_equal(directed_clustering(snapshot), directed_clustering(g))
+        nt.assert_equal(random_stats(snapshot, 2, seed=0, processes=1),
+                        random_stats(g, 2, seed=0, processes=1))
+        np.testing.assert_array_equal(
+            centrality_suite(snapshot)['pagerank'],
+            centrality_suite(g)['pagerank'])
+    finally:
+        shutil.rmtree(directory)
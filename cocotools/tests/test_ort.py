@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+
+from testfixtures import replace
+import nose.tools as nt
+
+from cocotools import ort
+
+
+CON_EDGES = [('A00-1', 'A00-2', {'EC_Source': 'C', 'PDC_Site_Source': 1,
+                                  'PDC_EC_Source': 2, 'Degree': '1',
+                                  'EC_Target': 'P', 'PDC_Site_Target': 3,
+                                  'PDC_EC_Target': 4, 'PDC_Density': 18,
+                                  'Connection': 'Present'})]
+MAP_EDGES = [('A00-1', 'B00-1', {'RC': 'I', 'PDC': 0}),
+             ('A00-2', 'B00-2', {'RC': 'I', 'PDC': 0})]
+
+
+def mock_multi_map_ebunch(search_type, subset=False):
+    if search_type == 'Connectivity':
+        return CON_EDGES, []
+    return MAP_EDGES, []
+
+
+def test_stage_cache():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ort.StageCache(directory)
+        key = cache.key('edges', ['A', 'B'])
+        nt.assert_equal(key, cache.key('edges', ['A', 'B']))
+        nt.assert_not_equal(key, cache.key('edges', ['A', 'C']))
+        nt.assert_raises(KeyError, cache.load, 'edges', key)
+        cache.store('edges', key, MAP_EDGES)
+        nt.assert_equal(ort.StageCache(directory).load('edges', key),
+                        MAP_EDGES)
+    finally:
+        shutil.rmtree(directory)
+
+
+@replace('cocotools.multi_map_ebunch', mock_multi_map_ebunch)
+def test_run_ort_reuses_stages():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ort.StageCache(directory)
+        endg = ort.run_ort('B00', cache=cache, con_sources=['A00'],
+                           map_sources=['A00'])
+        nt.assert_equal(endg.edges(), [('1', '2')])
+        nt.assert_equal(len(cache.computed), 9)
+        # Unchanged inputs: only the final stage is loaded.
+        cache = ort.StageCache(directory)
+        endg = ort.run_ort('B00', cache=cache, con_sources=['A00'],
+                           map_sources=['A00'])
+        nt.assert_equal(endg.edges(), [('1', '2')])
+        nt.assert_equal((cache.reused, cache.computed), (['endg'], []))
+        # A new method: only translation is redone.
+        cache = ort.StageCache(directory)
+        ort.run_ort('B00', 'original', cache=cache, con_sources=['A00'],
+                    map_sources=['A00'])
+        nt.assert_equal(cache.computed, ['endg'])
+        nt.assert_equal(sorted(cache.reused), ['cong2', 'mapg4'])
+    finally:
+        shutil.rmtree(directory)
@@ -10,6 +10,7 @@ import tempfile
 
 from networkx import DiGraph
 import nose.tools as nt
+import scipy.sparse
 
 import cocotools.pajek as pajek
 
@@ -28,3 +29,27 @@ def test_write_pajek():
     nt.assert_true(re.search(r'\*arcs', content))
     # The infomap code barfs if the '*network' line is present, check for that
     nt.assert_false(re.search(r'\*network', content))
+
+
+def test_write_pajek_csr():
+    g = DiGraph()
+    g.add_weighted_edges_from([('B', 'A', 0.5), ('A', 'C X', 0.75)])
+    g.add_edge('C X', 'B')
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        pajek.write_pajek(g, f)
+    lines = open(f.name).read().splitlines()
+    os.unlink(f.name)
+    nt.assert_equal(lines, ['*vertices 3',
+                            '1 A 0.0 0.0 ellipse',
+                            '2 B 0.0 0.0 ellipse',
+                            '3 "C X" 0.0 0.0 ellipse',
+                            '*arcs',
+                            '1 3 0.75',
+                            '2 1 0.5',
+                            '3 2 1.0'])
+    A = scipy.sparse.csr_matrix([[0, 0, 0.75], [0.5, 0, 0], [0, 1.0, 0]])
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        pajek.write_pajek_csr(A, ['A', 'B', 'C X'], f)
+    csr_lines = open(f.name).read().splitlines()
+    os.unlink(f.name)
+    nt.assert_equal(csr_lines, lines)
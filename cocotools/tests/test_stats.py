@@ -1,7 +1,10 @@
+import os
+import tempfile
 from unittest import TestCase
 
 import networkx as nx
 import nose.tools as nt
+import numpy as np
 
 import cocotools.stats as cocostats
 
@@ -12,6 +15,34 @@ def test_directed_char_path_length():
     nt.assert_equal(cocostats.directed_char_path_length(g), 1.75)
 
 
+def test_directed_char_path_length_distances():
+    g = nx.DiGraph()
+    g.add_edges_from([(1, 2), (2, 3)])
+    g.add_node(4)
+    char_path, D = cocostats.directed_char_path_length(g,
+                                                       return_distances=True)
+    nt.assert_equal(char_path, 4/3.0)
+    np.testing.assert_array_equal(D[0], [0, 1, 2, np.inf])
+    nt.assert_true(np.isinf(D[3, :3]).all())
+    g.remove_edges_from([(1, 2), (2, 3)])
+    nt.assert_true(np.isnan(cocostats.directed_char_path_length(g)))
+
+
+def test_directed_clustering():
+    g = nx.DiGraph()
+    g.add_edges_from([(1, 2), (2, 3), (3, 1), (1, 3), (3, 4)])
+    mean, C = cocostats.directed_clustering(g, per_node=True)
+    # Node 3: 2 triangles of 4*3 - 2*1 possible; node 4: none possible.
+    np.testing.assert_allclose(C, [0.5, 1, 0.2, 0])
+    nt.assert_almost_equal(mean, C.mean())
+    h = nx.gnm_random_graph(10, 30, seed=0, directed=True)
+    means, coefficients = cocostats.directed_clustering_batch(
+        [nx.adjacency_matrix(g), nx.adjacency_matrix(h)], per_node=True)
+    np.testing.assert_allclose(means, [mean,
+                                       cocostats.directed_clustering(h)])
+    np.testing.assert_allclose(coefficients[0], C)
+
+
 def test_average_path_length():
     g = nx.DiGraph()
     g.add_edges_from([('A', 'B'), ('A', 'D'), ('B', 'C'), ('B', 'D'),
@@ -28,6 +59,37 @@ def test_compute_graph_of_unknowns():
                                 ('B', 'A'), ('D', 'C'), ('D', 'B')])
 
 
+
+def test_unknown_edges():
+    g = nx.DiGraph()
+    g.add_edges_from([('A', 'B'), ('C', 'D'), ('B', 'D'), ('D', 'A'),
+                      ('B', 'C')])
+    u = cocostats.UnknownEdges(g)
+    nt.assert_equal(len(u), 7)
+    nt.assert_equal(set(u),
+                    set(cocostats.compute_graph_of_unknowns(g).edges()))
+    nt.assert_true(('A', 'C') in u)
+    nt.assert_false(('A', 'B') in u)
+    nt.assert_false(('A', 'A') in u)
+    nt.assert_equal(cocostats.directed_char_path_length(u),
+                    cocostats.directed_char_path_length(u.to_graph()))
+    g.add_edge('A', 'C')
+    nt.assert_equal(len(u), 6)
+    g.add_edge('A', 'A')
+    h = nx.gnm_random_graph(12, 60, seed=0, directed=True)
+    for known in (g, h):
+        u = cocostats.UnknownEdges(known)
+        unknown = nx.DiGraph()
+        unknown.add_nodes_from(u.nodes())
+        unknown.add_edges_from(u.edges_iter())
+        A = nx.to_scipy_sparse_matrix(unknown, nodelist=u.nodes())
+        np.testing.assert_array_equal(cocostats.distance_matrix(u),
+                                      cocostats._distances(A))
+        np.testing.assert_allclose(
+            cocostats.directed_clustering(u, per_node=True)[1],
+            cocostats._clustering_coefficients(A))
+
+
 class GraphStatsTestCase(TestCase):
 
     def setUp(self):
@@ -51,6 +113,37 @@ class GraphStatsTestCase(TestCase):
                         ['B', 'F', 'G', 'D', 'C', ['A', 'H'], ['E', 'I', 'K',
                          'J']])
 
+    def test_top_k(self):
+        in_degree = self.g.in_degree()
+        nt.assert_equal(cocostats.get_top_k(in_degree, 3), ['B', 'F', 'G'])
+        nt.assert_equal(cocostats.get_top_k(in_degree, 2, 'smaller'),
+                        [['E', 'I', 'J'], ['A', 'H']])
+        nt.assert_equal(cocostats.get_top_k(np.array([0.5, 2, 0.5, 1]), 2),
+                        [1, 3])
+        nt.assert_equal(cocostats.get_top_k(np.array([0.5, 2, 0.5, 1]), 1,
+                                            'smaller'), [[0, 2]])
+
+    def test_centrality_suite(self):
+        self.g.add_edges_from([('I', 'J'), ('J', 'A')])
+        suite = cocostats.centrality_suite(self.g)
+        nodes = list(suite['node'])
+        nt.assert_equal(nodes, self.g.nodes())
+        hubs, authorities = nx.hits(self.g)
+        closeness = cocostats.directed_closeness(self.g)
+        for field, desired in (('in_degree', self.g.in_degree()),
+                               ('betweenness',
+                                nx.betweenness_centrality(self.g)),
+                               ('pagerank', nx.pagerank(self.g)),
+                               ('hubs', hubs),
+                               ('authorities', authorities),
+                               ('in_closeness', closeness)):
+            np.testing.assert_allclose(suite[field],
+                                       [desired[node] for node in nodes],
+                                       atol=1e-6)
+        parallel = cocostats.centrality_suite(self.g, processes=4)
+        for field in cocostats.CENTRALITY_FIELDS:
+            np.testing.assert_array_equal(parallel[field], suite[field])
+
     def test_in_closeness_unconnected(self):
         desired = {'A': None, 'B': None, 'C': None, 'D': None, 'E': None,
                    'F': None, 'G': None, 'H': None, 'I': None, 'J': None}
@@ -63,6 +156,32 @@ class GraphStatsTestCase(TestCase):
                    'I': 22/9.0, 'J': 21/9.0}
         self.assertEqual(cocostats.directed_closeness(self.g), desired)
 
+
+    def test_path_metrics(self):
+        self.g.add_edges_from([('I', 'J'), ('J', 'A')])
+        metrics = cocostats.PathMetrics(self.g)
+        D = metrics.distances
+        self.assertEqual(metrics.closeness(),
+                         cocostats.directed_closeness(self.g))
+        self.assertEqual(metrics.closeness('out'),
+                         cocostats.directed_closeness(self.g, 'out'))
+        self.assertEqual(metrics.char_path_length(),
+                         cocostats.directed_char_path_length(self.g))
+        self.assertTrue(metrics.distances is D)
+        self.g.remove_edge('J', 'A')
+        self.assertTrue(metrics.distances is D)
+        metrics.refresh()
+        self.assertFalse(metrics.distances is D)
+        self.assertEqual(metrics.closeness()['A'], None)
+        self.assertRaises(ValueError, metrics.closeness, 'both')
+
+
+def test_efficiency():
+    g = nx.DiGraph()
+    g.add_edges_from([(1, 2), (2, 3)])
+    # Distances 1 (twice) and 2 among six ordered pairs.
+    nt.assert_equal(cocostats.PathMetrics(g).efficiency(), 2.5/6)
+
         
 def test_strip_absent_and_unknown_edges():
     e = nx.DiGraph()
@@ -71,3 +190,88 @@ def test_strip_absent_and_unknown_edges():
     g = cocostats.strip_absent_and_unknown_edges(e)
     nt.assert_equal(g.number_of_edges(), 1)
     nt.assert_equal(g['C']['D'], {})
+    e.add_edge('D', 'E')
+    nt.assert_raises(KeyError, cocostats.strip_absent_and_unknown_edges, e)
+
+
+class RewiringTestCase(TestCase):
+
+    def setUp(self):
+        g = nx.gnm_random_graph(30, 150, seed=2, directed=True)
+        self.A = np.array(nx.adjacency_matrix(g))
+
+    def assert_degrees_preserved(self, R):
+        np.testing.assert_array_equal(R.sum(axis=0), self.A.sum(axis=0))
+        np.testing.assert_array_equal(R.sum(axis=1), self.A.sum(axis=1))
+        nt.assert_equal(np.trace(R), 0)
+
+    def test_randmio_dir(self):
+        R = cocostats.randmio_dir(self.A,
+                                  random_state=np.random.RandomState(0))
+        self.assert_degrees_preserved(R)
+        nt.assert_true((R != self.A).any())
+        R2 = cocostats.randmio_dir(self.A,
+                                   random_state=np.random.RandomState(0))
+        np.testing.assert_array_equal(R, R2)
+
+    def test_latmio_dir(self):
+        R = cocostats.latmio_dir(self.A, n_iter=5,
+                                 random_state=np.random.RandomState(0))
+        self.assert_degrees_preserved(R)
+
+
+class NullModelStatsTestCase(TestCase):
+
+    def setUp(self):
+        self.g = nx.gnm_random_graph(20, 80, seed=3, directed=True)
+
+    def test_reproducible_across_processes(self):
+        serial = cocostats.null_model_stats(self.g, 4, seed=7, processes=1)
+        parallel = cocostats.null_model_stats(self.g, 4, seed=7,
+                                              processes=2)
+        nt.assert_equal(serial, parallel)
+        nt.assert_equal(cocostats.random_stats(self.g, 4, seed=7), serial)
+
+    def test_checkpoint_resume(self):
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.close()
+        os.unlink(f.name)
+        partial = cocostats.null_model_stats(self.g, 2, 'lattice', seed=5,
+                                             processes=1, checkpoint=f.name)
+        resumed = cocostats.null_model_stats(self.g, 3, 'lattice',
+                                             processes=1, checkpoint=f.name)
+        lines = open(f.name).readlines()
+        other = nx.gnm_random_graph(20, 81, seed=3, directed=True)
+        nt.assert_raises(ValueError, cocostats.null_model_stats, other, 3,
+                         'lattice', processes=1, checkpoint=f.name)
+        os.unlink(f.name)
+        nt.assert_equal(len(lines), 4)
+        fresh = cocostats.null_model_stats(self.g, 3, 'lattice', seed=5,
+                                           processes=1)
+        nt.assert_equal(resumed, fresh)
+        nt.assert_equal(resumed[0][:2], partial[0])
+
+
+def test_running_stats():
+    values = [3.0, 1.5, 4.0, 2.5, 9.0]
+    stats = cocostats.RunningStats()
+    for v in values:
+        stats.push(v)
+    nt.assert_equal(stats.n, 5)
+    nt.assert_almost_equal(stats.mean, np.mean(values))
+    nt.assert_almost_equal(stats.variance, np.var(values, ddof=1))
+
+
+def test_small_world_analysis():
+    g = nx.gnm_random_graph(12, 40, seed=4, directed=True)
+    results = cocostats.small_world_analysis(g, n_rand=50, n_latt=50,
+                                             seed=1, min_surrogates=5,
+                                             rel_tol=0.5)
+    nt.assert_equal(results['n_rand'], 5)
+    nt.assert_equal(results['n_latt'], 5)
+    nt.assert_almost_equal(results['sigma'],
+                           (results['C'] / results['C_rand']) /
+                           (results['L'] / results['L_rand']))
+    nt.assert_equal(results, cocostats.small_world_analysis(
+            g, n_rand=50, n_latt=50, seed=1, min_surrogates=5,
+            rel_tol=0.5, processes=2))
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 
 import networkx as nx
@@ -6,6 +9,51 @@ import nose.tools as nt
 import cocotools.utils as utils
 
 
+def test_write_adjacency():
+    g = nx.DiGraph()
+    g.add_edge('A', 'B', Connection='Present', PDC=0)
+    g.add_edge('B', 'C', Connection='Unknown', PDC=3, weight=2)
+    g.add_edge('C', 'A', EC_Source='N', EC_Target='P')
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for file_name in ('g.mat', 'g.npz'):
+            path = os.path.join(temp_dir, file_name)
+            utils.write_adjacency(g, path)
+            nodes, A, layers = utils.read_adjacency(path)
+            index = dict((node, i) for i, node in enumerate(nodes))
+            nt.assert_equal(sorted(nodes), ['A', 'B', 'C'])
+            nt.assert_equal(A.nnz, 3)
+            nt.assert_equal(A[index['B'], index['C']], 2)
+            for layer in layers.itervalues():
+                nt.assert_equal(layer[index['A'], index['C']], 0)
+            expected = {'Connection': (1, 3, 0), 'PDC': (1, 4, 0),
+                        'EC_Source': (0, 0, 4), 'EC_Target': (0, 0, 3)}
+            for name, values in expected.iteritems():
+                nt.assert_equal(tuple(layers[name][index[s], index[t]] for
+                                      s, t in (('A', 'B'), ('B', 'C'),
+                                               ('C', 'A'))), values)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_read_adjacency_node_types():
+    g = nx.DiGraph()
+    g.add_edges_from([(u'\xe9', 3), (3, 'B')])
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for file_name in ('g.mat', 'g.npz'):
+            path = os.path.join(temp_dir, file_name)
+            utils.write_adjacency(g, path)
+            nodes, A, layers = utils.read_adjacency(path)
+            nt.assert_equal(sorted(nodes), sorted(g.nodes()))
+            nt.assert_equal(sorted(type(node) for node in nodes),
+                            sorted([int, unicode, unicode]))
+            index = dict((node, i) for i, node in enumerate(nodes))
+            nt.assert_equal(A[index[u'\xe9'], index[3]], 1)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
 def test_strip_brain_map_prefix():
     g = nx.DiGraph()
     g.add_edges_from([('A-1', 'B-1'), ('A-1', 'B-2'), ('B-3', 'B-1'),
@@ -38,6 +86,32 @@ class MergeNodesTestCase(TestCase):
         self.assertEqual(g2.selfloop_edges(), [])
 
 
+    def test_relabel_and_merge(self):
+        g = nx.DiGraph()
+        g.add_edges_from([('A1', 'A2'), ('A1', 'B1'), ('B2', 'C'), ('C', 'D'),
+                          ('B1', 'A2')])
+        g['C']['D']['weight'] = 2
+        g2 = utils.relabel_and_merge(g, {'A1': 'A', 'A2': 'A', 'B1': 'B',
+                                         'B2': 'B', 'D': 'E'})
+        self.assertEqual(sorted(g2.nodes()), ['A', 'B', 'C', 'E'])
+        self.assertEqual(sorted(g2.edges()), [('A', 'B'), ('B', 'A'),
+                                              ('B', 'C'), ('C', 'E')])
+        self.assertEqual(g2['C']['E'], {})
+        self.assertEqual(g['C']['D'], {'weight': 2})
+        # Merged nodes without outside edges are dropped, as by
+        # merge_nodes.
+        g.add_nodes_from(['F1', 'F2'])
+        g.add_edge('F1', 'F2')
+        g.graph['name'] = 'g'
+        g2 = utils.relabel_and_merge(g, {'F1': 'F', 'F2': 'F'})
+        self.assertFalse('F' in g2)
+        self.assertEqual(g2.graph, {'name': 'g'})
+        self.assertRaises(nx.NetworkXError, utils.relabel_and_merge, g,
+                          {'X': 'Y'})
+        self.assertRaises(nx.NetworkXError, utils.merge_nodes, g, 'A',
+                          ['A1', 'X'])
+
+
 class CheckForDupsTestCase(TestCase):
 
     def setUp(self):
@@ -60,3 +134,13 @@ class CheckForDupsTestCase(TestCase):
                          ['A', 'C', 'a', 'c'])
 
 
+def test_case_folding_index():
+    index = utils.CaseFoldingIndex(['D', 'A', 'E', 'a', 'B'])
+    nt.assert_equal(index.groups(), [['A', 'a']])
+    nt.assert_true(index.add('b'))
+    nt.assert_false(index.add('b'))
+    nt.assert_false(index.add('F'))
+    nt.assert_equal(index.groups(), [['A', 'a'], ['B', 'b']])
+    nt.assert_equal(index.duplicates(), ['A', 'B', 'a', 'b'])
+
+
@@ -1,12 +1,171 @@
-import copy
+from os.path import splitext
 
 import networkx as nx
-import scipy
+import numpy as np
+import scipy.io
+import scipy.sparse
+
+from endgraph import EdgeColumns
+
+
+# Edge attributes written as layers alongside A by write_adjacency.
+ADJACENCY_LAYERS = ('Connection', 'PDC', 'EC_Source', 'EC_Target')
+
+
+def adjacency_layers(g):
+    """Return the sparse adjacency matrix of g and its attribute layers.
+
+    Parameters
+    ----------
+    g : NetworkX Graph or DiGraph
+      Edges may have 'weight', 'Connection', 'PDC', 'EC_Source', and
+      'EC_Target' attributes.
+
+    Returns
+    -------
+    nodes : list
+      Nodes of g, in the order of the rows and columns of the matrices.
+
+    A : scipy.sparse.csr_matrix
+      Edge weights; edges without a weight have weight 1.
+
+    layers : dict
+      Maps each name in ADJACENCY_LAYERS to a CSR matrix with the same
+      structure as A.  Every value is 0 where the edge lacks the
+      attribute, so that MATLAB's sparse matrices keep the rest:
+      Connection and ECs are 1-based indices in EdgeColumns.CONNECTIONS
+      and EdgeColumns.ECS, and PDCs are stored as PDC + 1.
+    """
+    if not g.is_directed():
+        g = g.to_directed()
+    columns = EdgeColumns(g)
+    n_nodes = len(columns.nodes)
+    weights = np.fromiter((attr.get('weight', 1) for source, target, attr
+                           in g.edges_iter(data=True)), float, len(columns))
+    order = np.lexsort((columns.targets, columns.sources))
+    indptr = np.zeros(n_nodes + 1, dtype=int)
+    np.cumsum(np.bincount(columns.sources, minlength=n_nodes),
+              out=indptr[1:])
+    indices = columns.targets[order]
+
+    def to_csr(values):
+        # MATLAB's sparse matrices must be double.
+        return scipy.sparse.csr_matrix((values[order].astype(float),
+                                        indices, indptr),
+                                       shape=(n_nodes, n_nodes))
+
+    layers = {'Connection': to_csr(columns.connection + 1),
+              'PDC': to_csr(np.nan_to_num(columns.pdc + 1)),
+              'EC_Source': to_csr(columns.ec_source + 1),
+              'EC_Target': to_csr(columns.ec_target + 1)}
+    return columns.nodes, to_csr(weights), layers
+
+
+def _decoded_labels(nodes):
+    """Return nodes with str labels decoded from UTF-8 to unicode."""
+    return [node.decode('utf-8') if isinstance(node, str) else node
+            for node in nodes]
+
+
+def write_adjacency(g, path, format=None):
+    """Write the sparse adjacency matrix of g with labels and layers.
+
+    The file holds the node labels ('nodes'), the adjacency matrix ('A'),
+    one matrix per name in ADJACENCY_LAYERS (see adjacency_layers for
+    their encoding), and the code tables 'Connection_codes' and
+    'EC_codes'.  Node labels may be strings or integers; str labels are
+    read back as unicode.
+
+    Parameters
+    ----------
+    g : NetworkX Graph or DiGraph
+
+    path : string
+      Path to which the file should be written.
+
+    format : string (optional)
+      'mat' for MATLAB (v5, loadable by the Brain Connectivity Toolbox)
+      or 'npz' for NumPy, in which case the matrices are stored as CSR
+      arrays that share A's indptr and indices.  By default, the format
+      is given by the extension of path, or is 'mat' if there is none.
+    """
+    if format is None:
+        format = splitext(path)[1][1:] or 'mat'
+    nodes, A, layers = adjacency_layers(g)
+    nodes = _decoded_labels(nodes)
+    codes = {'Connection_codes': EdgeColumns.CONNECTIONS,
+             'EC_codes': EdgeColumns.ECS}
+    if format == 'mat':
+        mdict = {'nodes': np.array(nodes, dtype=object), 'A': A}
+        mdict.update(layers)
+        for key, table in codes.iteritems():
+            mdict[key] = np.array(table, dtype=object)
+        scipy.io.savemat(path, mdict=mdict, oned_as='column')
+    elif format == 'npz':
+        arrays = {'nodes': np.array([unicode(node) for node in nodes],
+                                    dtype=unicode),
+                  'A': A.data, 'indptr': A.indptr, 'indices': A.indices}
+        int_nodes = [isinstance(node, (int, long)) for node in nodes]
+        if any(int_nodes):
+            # The labels are stored as text; note which were integers.
+            arrays['int_nodes'] = np.array(int_nodes, dtype=bool)
+        for name, layer in layers.iteritems():
+            arrays[name] = layer.data
+        for key, table in codes.iteritems():
+            arrays[key] = np.array(table)
+        np.savez_compressed(path, **arrays)
+    else:
+        raise ValueError('%s is not a supported format.' % format)
+
+
+def read_adjacency(path):
+    """Read a file written by write_adjacency.
+
+    Parameters
+    ----------
+    path : string
+      Path to a .mat or .npz file.
+
+    Returns
+    -------
+    nodes, A, layers
+      As returned by adjacency_layers.
+    """
+    if splitext(path)[1] == '.npz':
+        f = np.load(path)
+        try:
+            nodes = f['nodes'].tolist()
+            if 'int_nodes' in f.files:
+                nodes = [int(node) if is_int else node for node, is_int in
+                         zip(nodes, f['int_nodes'].tolist())]
+            shape = (len(nodes), len(nodes))
+
+            def to_csr(name):
+                return scipy.sparse.csr_matrix((f[name], f['indices'],
+                                                f['indptr']), shape=shape)
+            A = to_csr('A')
+            layers = dict((name, to_csr(name)) for name in ADJACENCY_LAYERS)
+        finally:
+            f.close()
+    else:
+        f = scipy.io.loadmat(path)
+        nodes = [node.item() for node in f['nodes'].ravel()]
+        A = scipy.sparse.csr_matrix(f['A'])
+        layers = dict((name, scipy.sparse.csr_matrix(f[name])) for name in
+                      ADJACENCY_LAYERS)
+    return nodes, A, layers
 
 
 def write_A_to_mat(g, path):
     """Write adjacency matrix (A) of g as a .mat file.
 
+    A is written as a sparse matrix, along with the node labels and the
+    attribute layers described in write_adjacency.
+
+    Note that earlier versions wrote only a dense A, with no labels or
+    layers.  Code that loads these files and expects a full matrix
+    must convert A (e.g., with full(A) in MATLAB).
+
     Parameters
     ----------
     g : NetworkX Graph or DiGraph
@@ -15,8 +174,7 @@ def write_A_to_mat(g, path):
       Path to which .mat file should be written.  File name must be included,
       but .mat extension is optional.
     """
-    A = nx.adjacency_matrix(g)
-    scipy.io.savemat(path, mdict={'A': A})
+    write_adjacency(g, path, format='mat')
 
 
 def strip_brain_map_prefix(g):
@@ -24,16 +182,68 @@ def strip_brain_map_prefix(g):
 
     g is not modified.
     """
-    nodes = g.nodes()
-    while nodes:
-        n = nodes.pop()
-        no_prefix = n.split('-',1)[1]
-        same_name = [x for x in nodes if no_prefix == x.split('-',1)[1]]
-        for x in same_name:
-            nodes.remove(x)
-        g = merge_nodes(g, no_prefix, same_name + [n])
-    return g
-    
+    return relabel_and_merge(g, dict((n, n.split('-', 1)[1]) for n in g))
+
+
+def relabel_and_merge(g, mapping):
+    """Return new g with nodes renamed, merging those given the same name.
+
+    The new graph is built in one pass over the edges of g.  Nodes and
+    edges not involving renamed nodes keep (shallow copies of) their
+    attributes, and the graph attribute dict is copied.  Renamed nodes
+    and their edges lose their attributes, and edges between nodes merged
+    into one are dropped, so no self-loops are created.  As with
+    merge_nodes, a renamed node is kept only if it has an edge to or
+    from a node outside its merge (or takes the name of a node that is
+    not renamed).
+
+    g is not modified.
+
+    Parameters
+    ----------
+    g : NetworkX DiGraph
+
+    mapping : dict
+      Maps nodes in g to their new names.  Nodes absent from mapping keep
+      their names.
+
+    Returns
+    -------
+    g2 : NetworkX DiGraph
+
+    Raises
+    ------
+    NetworkXError
+      If a node in mapping is not in g.
+    """
+    for node in mapping:
+        if node not in g:
+            raise nx.NetworkXError('The node %s is not in the graph.' % node)
+    # The add methods of CoCoTools graphs validate attributes, which
+    # renamed nodes and edges no longer have; use those of DiGraph.
+    add_node = nx.DiGraph.add_node.im_func
+    add_edge = nx.DiGraph.add_edge.im_func
+    g2 = g.__class__()
+    g2.graph = g.graph.copy()
+    for node, attr in g.nodes_iter(data=True):
+        if node not in mapping:
+            add_node(g2, node, attr.copy())
+    renamed_edges = []
+    for source, target, attr in g.edges_iter(data=True):
+        if source in mapping or target in mapping:
+            new_source = mapping.get(source, source)
+            new_target = mapping.get(target, target)
+            if new_source != new_target:
+                renamed_edges.append((new_source, new_target))
+        else:
+            add_edge(g2, source, target, attr.copy())
+    for source, target in renamed_edges:
+        # Edges that already exist (e.g., to a merged node that kept the
+        # name of an untouched one) keep their attributes.
+        if not g2.has_edge(source, target):
+            add_edge(g2, source, target)
+    return g2
+
 
 def merge_nodes(g, new_name, nodes):
     """Return new g with nodes merged into a single node with new_name.
@@ -54,22 +264,125 @@ def merge_nodes(g, new_name, nodes):
     -------
     g2 : NetworkX DiGraph
       g with nodes merged into new_name.
+
+    Raises
+    ------
+    NetworkXError
+      If one of nodes is not in g.
+
+    Notes
+    -----
+    To make several merges, pass one mapping to relabel_and_merge rather
+    than calling this function repeatedly.
     """
-    g2 = copy.deepcopy(g)
-    predecessors, successors = set(), set()
-    for node in nodes:
-        for neighbor_type in ('predecessors', 'successors'):
-            exec 'neighbors = g2.%s(node)' % neighbor_type
-            for neighbor in neighbors:
-                exec '%s.add(neighbor)' % neighbor_type
-        g2.remove_node(node)
-    for p in predecessors:
-        if g2.has_node(p) and p != new_name:
-            g2.add_edge(p, new_name)
-    for s in successors:
-        if g2.has_node(s) and s != new_name:
-            g2.add_edge(new_name, s)
-    return g2
+    return relabel_and_merge(g, dict((node, new_name) for node in nodes))
+
+
+class CaseFoldingIndex(object):
+
+    """Index of nodes by their lowercase form, for finding duplicates.
+
+    CoCoMac sometimes spells the same BrainSite with different case
+    (e.g., 'A99-Pg' and 'A99-pg').  Adding a node is a single dict
+    operation, so the index can be kept up to date as a graph is built
+    instead of being recomputed over all pairs of nodes.
+
+    Parameters
+    ----------
+    nodes : iterable (optional)
+      Nodes with which to initialize the index.
+    """
+
+    def __init__(self, nodes=()):
+        self._variants = {}
+        self.add_nodes_from(nodes)
+
+    def add(self, node):
+        """Add node to the index.
+
+        Returns
+        -------
+        new_dup : bool
+          True if node is a new case variant of a node already indexed.
+        """
+        variants = self._variants.setdefault(node.lower(), [])
+        if node in variants:
+            return False
+        variants.append(node)
+        return len(variants) > 1
+
+    def add_nodes_from(self, nodes):
+        """Add each of nodes to the index."""
+        for node in nodes:
+            self.add(node)
+
+    def groups(self):
+        """Return sorted lists of nodes that differ only in case."""
+        return sorted(sorted(variants) for variants in
+                      self._variants.itervalues() if len(variants) > 1)
+
+    def duplicates(self):
+        """Return a sorted list of all nodes that differ only in case."""
+        return sorted(node for variants in self._variants.itervalues() if
+                      len(variants) > 1 for node in variants)
+
+
+class CaseIndexedGraph(object):
+
+    """Mixin for graphs that keep a CaseFoldingIndex of their nodes.
+
+    The index is updated by add_node and add_nodes_from; subclasses that
+    add edges without them (e.g., through DiGraph.add_edge) must add the
+    endpoints to case_index themselves.  Nodes removed from the graph
+    stay in the index, but are not reported by duplicate_nodes.
+    """
+
+    @property
+    def case_index(self):
+        """CaseFoldingIndex of the nodes, updated as they are added.
+
+        Graphs built without add_node or add_edge (e.g., unpickled ones)
+        have the index built from their nodes on first access.
+        """
+        try:
+            return self._case_index
+        except AttributeError:
+            self._case_index = CaseFoldingIndex(self)
+            return self._case_index
+
+    def duplicate_nodes(self):
+        """Return groups of nodes in the graph that differ only in case.
+
+        Case variants are recorded as nodes arrive, so no scan over the
+        nodes is needed.
+
+        Returns
+        -------
+        groups : list
+          Sorted lists of nodes, one per set of case variants.
+        """
+        groups = []
+        for group in self.case_index.groups():
+            group = [node for node in group if self.has_node(node)]
+            if len(group) > 1:
+                groups.append(group)
+        return groups
+
+    def add_node(self, n, attr_dict=None, **attr):
+        """Add node n to the graph and to case_index."""
+        self.case_index.add(n)
+        super(CaseIndexedGraph, self).add_node(n, attr_dict, **attr)
+
+    def add_nodes_from(self, nodes, **attr):
+        """Add nodes to the graph and to case_index."""
+        nodes = list(nodes)
+        for node in nodes:
+            # As in NetworkX, a node may come with its attribute dict.
+            if isinstance(node, tuple) and len(node) == 2 and \
+                    isinstance(node[1], dict):
+                node = node[0]
+            self.case_index.add(node)
+        super(CaseIndexedGraph, self).add_nodes_from(nodes, **attr)
 
 
 def check_for_dups(g):
@@ -82,26 +395,7 @@ def check_for_dups(g):
     Returns
     -------
     dups : list
-      List of nodes in g that differ only in case.
+      List of nodes in g that differ only in case, or None if there are
+      none.  CaseFoldingIndex(g).groups() separates them into groups.
     """
-    # Before iterating through all the nodes, see whether any are
-    # duplicated.
-    nodes = g.nodes()
-    unique_nodes = set([node.lower() for node in nodes])
-    if len(unique_nodes) < len(nodes):
-        dups = []
-        checked = []
-        for node in nodes:
-            lowercase_node = node.lower()
-            if lowercase_node not in checked:
-                checked.append(lowercase_node)
-                continue
-            # Still append to checked to keep indices matched with
-            # nodes.
-            checked.append(lowercase_node)
-            dups.append(node)
-            original_node = nodes[checked.index(lowercase_node)]
-            if original_node not in dups:
-                dups.append(original_node)
-        dups.sort()
-        return dups
+    return CaseFoldingIndex(g).duplicates() or None
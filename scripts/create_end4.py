@@ -1,6 +1,6 @@
 import pickle
 from networkx import relabel_nodes
-from cocotools import merge_nodes
+from cocotools import relabel_and_merge
 
 with open('results/graphs/end2.pck') as f:
     end2 = pickle.load(f)
@@ -33,10 +33,16 @@ merges = [('11', ['11', '11L', '11M']),
           ('TF', ['TF', 'TFL', 'TFM', 'TFO']),
           ('TL(36)', ['TL', '36'])]
 
+mapping = {}
 for new_name, old_names in merges:
-    end4 = merge_nodes(end4, new_name, old_names)
-    if len(end4.selfloop_edges()):
-        raise ValueError('%s, %s is the culprit' % (new_name, old_names))
+    for old_name in old_names:
+        if old_name in mapping:
+            raise ValueError('%s is in two merges' % old_name)
+        mapping[old_name] = new_name
+end4 = relabel_and_merge(end4, mapping)
+
+if len(end4.selfloop_edges()):
+    raise ValueError('merges created self-loop')
 
 end4.remove_nodes_from(['24/23', '6VV', '6VD', 'EL'])
 
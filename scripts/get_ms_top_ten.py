@@ -1,6 +1,6 @@
 import pickle
 
-import networkx as nx
+import numpy as np
 
 import cocotools as coco
 
@@ -8,16 +8,24 @@ import cocotools as coco
 with open('results/graphs/end4.pck') as f:
     end4 = pickle.load(f)
 
-in_degree = coco.get_top_ten(end4.in_degree())
-out_degree = coco.get_top_ten(end4.out_degree())
+suite = coco.centrality_suite(end4, processes=4)
 
-in_closeness = coco.get_top_ten(coco.directed_closeness(end4), 'smaller')
-out_closeness = coco.get_top_ten(coco.directed_closeness(end4, 'out'),
-                                 'smaller')
 
-betweenness = coco.get_top_ten(nx.betweenness_centrality(end4))
-pagerank = coco.get_top_ten(nx.pagerank(end4))
+def top_ten(field, better='greater'):
+    # Closeness is nan for nodes cut off from others.  Map these to None,
+    # as PathMetrics.closeness does, so the rankings match earlier runs.
+    values = [None if np.isnan(value) else value for value in suite[field]]
+    return coco.get_top_ten(dict(zip(suite['node'], values)), better)
 
-hubs_dict, authorities_dict = nx.hits(end4)
-hubs = coco.get_top_ten(hubs_dict)
-authorities = coco.get_top_ten(authorities_dict)
+
+in_degree = top_ten('in_degree')
+out_degree = top_ten('out_degree')
+
+in_closeness = top_ten('in_closeness', 'smaller')
+out_closeness = top_ten('out_closeness', 'smaller')
+
+betweenness = top_ten('betweenness')
+pagerank = top_ten('pagerank')
+
+hubs = top_ten('hubs')
+authorities = top_ten('authorities')